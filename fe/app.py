@@ -1,7 +1,8 @@
 import streamlit as st
 from ui.pages import upload, reconstruction, segmentation, pattern
 from src.session import initialize_session
-from src.task_queue import start_workers
+from src.task_queue import start_workers, start_janitor, cancel_session_tasks
+from src import config
 from ui import state
 import shutil
 import os
@@ -16,13 +17,9 @@ def init():
             initialize_session()
             st.session_state.initialized = True
 
-            # Initialize or retrieve number of workers from the session state
-            if "num_workers" not in st.session_state:
-                st.session_state.num_workers = 2  # Default number of workers
-
-            # Start background workers using src/task_queue.py
-            st.session_state.workers = start_workers(
-                num_workers=st.session_state.num_workers)
+            # Start the process-wide worker pool using src/task_queue.py; sessions share it
+            st.session_state.workers = start_workers()
+            start_janitor()
         st.session_state.initialization_successful = True  # Set success flag
     except Exception as e:
         st.error(f"Application initialization failed: {e}")
@@ -59,7 +56,7 @@ def main():
     }
 
     # Sidebar navigation
-    MESH_PERSISTENCE_DIR = "persistent_meshes"
+    MESH_PERSISTENCE_DIR = config.MESH_PERSISTENCE_DIR
 
     with st.sidebar:
         st.header("Navigation")
@@ -88,6 +85,11 @@ def main():
 
     # Session End Cleanup
     if st.session_state.get("is_session_end", False):
+        # Stop this session's queued and running tasks so they free their workers and cores
+        cancelled = cancel_session_tasks(st.session_state.session_id)
+        if cancelled:
+            print(f"Cancelled {len(cancelled)} task(s) for the ending session.")
+
         user_session_dir = os.path.join(MESH_PERSISTENCE_DIR, st.session_state.session_id)
         if os.path.exists(user_session_dir):
             shutil.rmtree(user_session_dir, ignore_errors=True)
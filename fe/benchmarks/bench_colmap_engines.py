@@ -0,0 +1,129 @@
+"""
+Benchmark comparing the COLMAP engines on synthetic scenes.
+
+Renders the scenes of ``bench_reconstruction`` and reconstructs each one
+with every engine (see ``src.photogrammetry.engines``), reporting the wall
+time of each pipeline stage side by side along with the registered images
+and reconstructed points, so the gain from running stages in-process can
+be told apart from differences in the result.
+
+Requires COLMAP on the PATH, and pycolmap for the "pycolmap" engine.
+
+Usage:
+    python -m benchmarks.bench_colmap_engines [--shapes cylinder] [--views 24 48]
+        [--resolution 640x480] [--engines cli pycolmap] [--repeat 3] [--output results.json]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.bench_reconstruction import SHAPES, _parse_resolution, count_ply_vertices, render_scene
+from src.instrumentation import Tracer
+from src.photogrammetry import engines, reconstruction
+from src.photogrammetry.colmap_wrapper import get_number_of_registered_images
+
+# Stages reported per engine, in pipeline order
+STAGES = ("feature_extraction", "feature_matching", "mapping", "model_selection", "model_conversion")
+
+
+def run_engine(image_dir: str, work_dir: str, num_views: int, engine: str, matcher: str) -> Dict:
+    """Reconstruct one image set with one engine and return its measurements."""
+    shutil.rmtree(work_dir, ignore_errors=True)
+    sparse_dir = os.path.join(work_dir, "sparse")
+    os.makedirs(sparse_dir)
+    tracer = Tracer()
+
+    start = time.perf_counter()
+    ply_path = reconstruction.run_reconstruction(
+        image_dir, os.path.join(work_dir, "database.db"), sparse_dir,
+        matcher=matcher, provenance="video", resume=False, engine=engine, tracer=tracer)
+    elapsed = time.perf_counter() - start
+
+    registered = get_number_of_registered_images(os.path.join(sparse_dir, "0")) if ply_path else 0
+    return {
+        "succeeded": ply_path is not None,
+        "time": elapsed,
+        "registered_ratio": registered / num_views,
+        "points": count_ply_vertices(ply_path) if ply_path else 0,
+        "stages": {record["stage"]: record["wall_time"] for record in tracer.records},
+    }
+
+
+def summarize(runs: List[Dict]) -> Dict:
+    """Median time of each stage and of the whole run over repeated runs of one engine."""
+    return {
+        "succeeded": all(run["succeeded"] for run in runs),
+        "time": statistics.median(run["time"] for run in runs),
+        "registered_ratio": min(run["registered_ratio"] for run in runs),
+        "points": statistics.median(run["points"] for run in runs),
+        "stages": {stage: statistics.median(run["stages"][stage] for run in runs)
+                   for stage in STAGES if all(stage in run["stages"] for run in runs)},
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shapes", nargs="+", default=["cylinder"], choices=SHAPES)
+    parser.add_argument("--views", type=int, nargs="+", default=[24], help="Images per scene")
+    parser.add_argument("--resolution", type=_parse_resolution, nargs="+", default=[(640, 480)],
+                        help="Image sizes as WIDTHxHEIGHT")
+    parser.add_argument("--engines", nargs="+", default=list(engines.ENGINES), choices=engines.ENGINES)
+    parser.add_argument("--matcher", default="sequential")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per engine; medians are reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--keep", action="store_true", help="Keep rendered images and workspaces")
+    args = parser.parse_args(argv)
+
+    if "pycolmap" in args.engines and engines.pycolmap is None:
+        parser.error("the pycolmap engine requires the pycolmap package")
+
+    temp_dir = tempfile.mkdtemp(prefix="bench-engines-")
+    results = []
+    try:
+        for shape, num_views, resolution in itertools.product(args.shapes, args.views, args.resolution):
+            scene = f"{shape}-{num_views}-{resolution[0]}x{resolution[1]}"
+            image_dir = os.path.join(temp_dir, scene, "images")
+            render_scene(shape, num_views, resolution, image_dir, args.seed)
+
+            summaries = {}
+            for engine in args.engines:
+                runs = [run_engine(image_dir, os.path.join(temp_dir, scene, engine), num_views, engine, args.matcher)
+                        for _ in range(args.repeat)]
+                summaries[engine] = summarize(runs)
+                results.append({"case": f"{scene}-{engine}", "scene": scene, "engine": engine,
+                                "matcher": args.matcher, "repeat": args.repeat, **summaries[engine]})
+
+            print(f"\n{scene} ({args.matcher} matching, median of {args.repeat})")
+            print(f"{'stage':<20}" + "".join(f"{engine:>12}" for engine in args.engines))
+            for stage in STAGES:
+                if any(stage in summary["stages"] for summary in summaries.values()):
+                    print(f"{stage:<20}" + "".join(
+                        f"{summaries[engine]['stages'].get(stage, float('nan')):>11.2f}s" for engine in args.engines))
+            print(f"{'total':<20}" + "".join(f"{summaries[engine]['time']:>11.2f}s" for engine in args.engines))
+            print(f"{'registered':<20}" + "".join(
+                f"{summaries[engine]['registered_ratio']:>12.0%}" for engine in args.engines))
+            print(f"{'points':<20}" + "".join(f"{summaries[engine]['points']:>12.0f}" for engine in args.engines))
+    finally:
+        if args.keep:
+            print(f"Kept workspaces in {temp_dir}")
+        else:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"created_at": time.time(), "platform": platform.platform(),
+                       "cpu_count": os.cpu_count(), "results": results}, f, indent=2)
+        print(f"Wrote results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark for video frame extraction throughput.
+
+Compares encoding extracted frames on the decode thread with the threaded
+FrameWriter pool.  A synthetic reference clip is generated when no video is
+given.
+
+Usage:
+    python -m benchmarks.bench_frame_extraction [--video clip.mp4] [--fps 10]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from src import config
+from src.photogrammetry.video_extractor import extract_frames
+
+
+def write_reference_clip(path: str, num_frames: int = 240, size=(1920, 1080), frame_rate: float = 30.0) -> str:
+    """Write a textured, panning synthetic clip so encoding cost resembles real footage."""
+    width, height = size
+    rng = np.random.default_rng(0)
+    texture = (rng.random((height // 8, (width * 2) // 8, 3)) * 255).astype(np.uint8)
+    texture = cv2.resize(texture, (width * 2, height), interpolation=cv2.INTER_CUBIC)
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), frame_rate, size)
+    for i in range(num_frames):
+        shift = int(i * width / num_frames)
+        writer.write(np.ascontiguousarray(texture[:, shift:shift + width]))
+    writer.release()
+    return path
+
+
+def run(video_path: str, fps: float, image_format: str, quality, num_workers: int) -> float:
+    """Extract frames once and return the achieved frames per second."""
+    output_dir = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        frames = extract_frames(video_path, output_dir, fps=fps, image_format=image_format,
+                                quality=quality, num_workers=num_workers)
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return len(frames) / elapsed if elapsed > 0 else float("inf")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", help="Reference clip (a synthetic 1080p clip is generated if omitted)")
+    parser.add_argument("--fps", type=float, default=10.0, help="Extraction rate in frames per second")
+    parser.add_argument("--format", default=config.FRAME_IMAGE_FORMAT, choices=["jpg", "png"])
+    parser.add_argument("--quality", type=int, default=None)
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({0, 2, config.FRAME_ENCODE_WORKERS}))
+    args = parser.parse_args()
+
+    temp_dir = None
+    video_path = args.video
+    if not video_path:
+        temp_dir = tempfile.mkdtemp()
+        video_path = write_reference_clip(os.path.join(temp_dir, "reference.avi"))
+
+    try:
+        print(f"{'workers':>8} {'frames/s':>10}")
+        for num_workers in args.workers:
+            fps = run(video_path, args.fps, args.format, args.quality, num_workers)
+            print(f"{num_workers:>8} {fps:>10.1f}")
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+Benchmark for the end-to-end reconstruction pipeline on synthetic scenes.
+
+Renders multi-view image sets of textured primitives (a cylinder and a
+torso-like elliptic body) from cameras orbiting the object, runs
+``reconstruction.run_reconstruction`` with each matcher and feature
+configuration, and reports the run time, the ratio of registered images
+and the number of reconstructed points.  Results can be saved as JSON and
+compared against a previous run to catch regressions.
+
+Requires COLMAP on the PATH.
+
+Usage:
+    python -m benchmarks.bench_reconstruction [--shapes cylinder torso] [--views 24 48]
+        [--resolution 640x480] [--matchers exhaustive sequential] [--features sift]
+        [--output results.json] [--baseline previous.json]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from src.instrumentation import Tracer
+from src.photogrammetry import reconstruction
+from src.photogrammetry.colmap_wrapper import get_number_of_registered_images
+
+SHAPES = ("cylinder", "torso")
+
+# Height of the rendered objects; they span y in [-1, 1]
+OBJECT_HALF_HEIGHT = 1.0
+
+# Distance of the orbiting cameras from the object's axis
+CAMERA_DISTANCE = 3.2
+
+# Surface samples per image pixel along each axis, so splatted points leave no holes
+SURFACE_OVERSAMPLING = 2.0
+
+# Relative slowdown and absolute drop in registered ratio reported as regressions
+TIME_TOLERANCE = 0.2
+REGISTERED_TOLERANCE = 0.05
+
+
+def _profile(shape: str, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Semi-axes (along x and z) of the horizontal cross-section at height y."""
+    if shape == "cylinder":
+        radius = np.full_like(y, 0.6)
+        return radius, radius
+    # Torso-like: elliptic cross-section, narrower at the waist and broad at the shoulders
+    scale = 0.8 + 0.2 * y ** 2 + 0.1 * y - 0.12 * np.exp(-((y + 0.1) ** 2) / 0.08)
+    return 0.7 * scale, 0.42 * scale
+
+
+def _texture(rng: np.random.Generator, size: int = 1024) -> np.ndarray:
+    """Multi-scale noise texture with enough corners and blobs for SIFT to match across views."""
+    texture = np.zeros((size, size, 3), np.float32)
+    for cells, weight in ((8, 0.5), (32, 0.3), (128, 0.2)):
+        noise = rng.random((cells, cells, 3)).astype(np.float32)
+        texture += weight * cv2.resize(noise, (size, size), interpolation=cv2.INTER_CUBIC)
+    texture = np.clip(texture * 255, 0, 255).astype(np.uint8)
+    # High-contrast spots and patches, like print or stitching on fabric
+    for _ in range(size):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        x, y = (int(c) for c in rng.integers(0, size, 2))
+        extent = int(rng.integers(size // 200 + 2, size // 40 + 3))
+        if rng.random() < 0.5:
+            cv2.circle(texture, (x, y), extent, color, -1)
+        else:
+            cv2.rectangle(texture, (x, y), (x + extent, y + extent // 2 + 1), color, -1)
+    return texture
+
+
+def sample_surface(shape: str, resolution: Tuple[int, int], seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Sample the textured surface of a primitive, including its end caps.
+
+    Args:
+        shape: One of ``SHAPES``.
+        resolution: (width, height) of the images the samples will be rendered into.
+        seed: Seed of the texture.
+
+    Returns:
+        Tuple of (N x 3 points, N x 3 unit normals, N x 3 uint8 BGR colors).
+    """
+    if shape not in SHAPES:
+        raise ValueError(f"Unknown shape: {shape}")
+    width, _ = resolution
+    texture = _texture(np.random.default_rng(seed))
+    size = texture.shape[0]
+
+    # Side: parameterized by angle and height
+    n_y = int(SURFACE_OVERSAMPLING * width * 0.75)
+    n_theta = int(SURFACE_OVERSAMPLING * width * 2.5)
+    theta, y = np.meshgrid(np.linspace(0, 2 * np.pi, n_theta, endpoint=False),
+                           np.linspace(-OBJECT_HALF_HEIGHT, OBJECT_HALF_HEIGHT, n_y))
+    theta, y = theta.ravel(), y.ravel()
+    a, b = _profile(shape, y)
+    side = np.column_stack([a * np.cos(theta), y, b * np.sin(theta)])
+    side_normals = np.column_stack([np.cos(theta) / a, np.zeros_like(y), np.sin(theta) / b])
+    side_colors = texture[((y + 1) / 2 * (size - 1)).astype(int), (theta / (2 * np.pi) * (size - 1)).astype(int)]
+
+    # Caps: concentric rings, textured from the other half of the texture so they differ from the side
+    caps, cap_normals, cap_colors = [], [], []
+    for cap_y, direction in ((-OBJECT_HALF_HEIGHT, -1.0), (OBJECT_HALF_HEIGHT, 1.0)):
+        r, angle = np.meshgrid(np.sqrt(np.linspace(0, 1, n_y // 2)),
+                               np.linspace(0, 2 * np.pi, n_theta // 2, endpoint=False))
+        r, angle = r.ravel(), angle.ravel()
+        a, b = _profile(shape, np.full_like(r, cap_y))
+        caps.append(np.column_stack([a * r * np.cos(angle), np.full_like(r, cap_y), b * r * np.sin(angle)]))
+        cap_normals.append(np.tile([0.0, direction, 0.0], (len(r), 1)))
+        u = ((r * np.cos(angle) + 1) / 4 * (size - 1)).astype(int)
+        v = ((r * np.sin(angle) + 1) / 4 * (size - 1)).astype(int) + size // 2
+        cap_colors.append(texture[np.clip(v, 0, size - 1), u])
+
+    points = np.concatenate([side, *caps])
+    normals = np.concatenate([side_normals, *cap_normals])
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    colors = np.concatenate([side_colors, *cap_colors])
+    return points.astype(np.float32), normals.astype(np.float32), colors
+
+
+def orbit_poses(num_views: int, distance: float = CAMERA_DISTANCE) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Camera poses on an orbit around the object, in capture order.
+
+    Returns:
+        List of (world-to-camera rotation, camera center) pairs.  Camera
+        axes follow COLMAP: x right, y down, z forward.
+    """
+    poses = []
+    for i in range(num_views):
+        azimuth = 2 * np.pi * i / num_views
+        # Two passes at different heights, like a person walking around a mannequin
+        elevation = 0.35 * np.sin(4 * np.pi * i / num_views)
+        center = np.array([distance * np.sin(azimuth), elevation, distance * np.cos(azimuth)])
+        forward = -center / np.linalg.norm(center)
+        right = np.cross(forward, [0.0, 1.0, 0.0])
+        right /= np.linalg.norm(right)
+        down = np.cross(forward, right)
+        poses.append((np.stack([right, down, forward]), center))
+    return poses
+
+
+def render_view(points: np.ndarray, normals: np.ndarray, colors: np.ndarray,
+                rotation: np.ndarray, center: np.ndarray, resolution: Tuple[int, int]) -> np.ndarray:
+    """
+    Render surface samples with a pinhole camera, a z-buffer and a headlight.
+
+    Returns:
+        A height x width x 3 BGR image on a plain grey background.
+    """
+    width, height = resolution
+    focal = 0.9 * width
+    rotation, center = rotation.astype(np.float32), center.astype(np.float32)
+    # Back faces of the closed surface are never visible
+    facing = np.flatnonzero(np.einsum("ij,ij->i", normals, center - points) > 0)
+    to_camera = center - points[facing]
+    camera_points = -to_camera @ rotation.T
+    z = camera_points[:, 2]
+    in_front = z > 1e-6
+    u = np.round(focal * camera_points[:, 0] / np.where(in_front, z, 1) + width / 2).astype(np.int64)
+    v = np.round(focal * camera_points[:, 1] / np.where(in_front, z, 1) + height / 2).astype(np.int64)
+    visible = np.flatnonzero(in_front & (u >= 0) & (u < width) & (v >= 0) & (v < height))
+
+    pixel = (v * width + u)[visible]
+    # Nearest sample per pixel: sort by pixel, then depth, and keep the first of each pixel
+    order = np.lexsort((z[visible], pixel))
+    first = order[np.unique(pixel[order], return_index=True)[1]]
+    nearest = visible[first]
+
+    # Lambertian shading with a light at the camera
+    to_camera = to_camera[nearest] / np.linalg.norm(to_camera[nearest], axis=1, keepdims=True)
+    shade = 0.35 + 0.65 * np.einsum("ij,ij->i", normals[facing[nearest]], to_camera)
+
+    image = np.full((height * width, 3), 128, np.uint8)
+    image[pixel[first]] = (colors[facing[nearest]] * shade[:, None]).astype(np.uint8)
+    # Mild blur, so splatted samples look like a camera image rather than aliased points
+    return cv2.GaussianBlur(image.reshape(height, width, 3), (3, 3), 0)
+
+
+def render_scene(shape: str, num_views: int, resolution: Tuple[int, int], output_dir: str, seed: int = 0) -> List[str]:
+    """
+    Render a multi-view image set of a primitive into a directory.
+
+    Returns:
+        Paths of the written JPEG images, in capture order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    points, normals, colors = sample_surface(shape, resolution, seed)
+    paths = []
+    for i, (rotation, center) in enumerate(orbit_poses(num_views)):
+        path = os.path.join(output_dir, f"{shape}_{i:04d}.jpg")
+        cv2.imwrite(path, render_view(points, normals, colors, rotation, center, resolution),
+                    [cv2.IMWRITE_JPEG_QUALITY, 95])
+        paths.append(path)
+    return paths
+
+
+def count_ply_vertices(ply_path: str) -> int:
+    """Read the vertex count from a PLY header."""
+    with open(ply_path, "rb") as f:
+        for line in f:
+            if line.startswith(b"element vertex"):
+                return int(line.split()[2])
+            if line.strip() == b"end_header":
+                break
+    return 0
+
+
+def run_case(image_dir: str, work_dir: str, num_views: int, matcher: str, feature_type: str) -> Dict:
+    """Reconstruct one image set with one configuration and return its measurements."""
+    shutil.rmtree(work_dir, ignore_errors=True)
+    sparse_dir = os.path.join(work_dir, "sparse")
+    os.makedirs(sparse_dir)
+    tracer = Tracer()
+
+    start = time.perf_counter()
+    ply_path = reconstruction.run_reconstruction(
+        image_dir, os.path.join(work_dir, "database.db"), sparse_dir,
+        feature_type=feature_type, matcher=matcher, provenance="video", resume=False, tracer=tracer)
+    elapsed = time.perf_counter() - start
+
+    # The mapper writes its largest model to sparse/0
+    registered = get_number_of_registered_images(os.path.join(sparse_dir, "0")) if ply_path else 0
+    return {
+        "succeeded": ply_path is not None,
+        "time": elapsed,
+        "registered_ratio": registered / num_views,
+        "points": count_ply_vertices(ply_path) if ply_path else 0,
+        "stages": {record["stage"]: round(record["wall_time"], 3) for record in tracer.records},
+    }
+
+
+def compare(results: List[Dict], baseline: List[Dict]) -> List[str]:
+    """Return descriptions of cases that got slower or registered fewer images than the baseline."""
+    previous = {result["case"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result["case"])
+        if before is None:
+            continue
+        if before["succeeded"] and not result["succeeded"]:
+            regressions.append(f"{result['case']}: reconstruction failed")
+            continue
+        if before["time"] > 0 and result["time"] > before["time"] * (1 + TIME_TOLERANCE):
+            regressions.append(f"{result['case']}: time {before['time']:.1f}s -> {result['time']:.1f}s")
+        if result["registered_ratio"] < before["registered_ratio"] - REGISTERED_TOLERANCE:
+            regressions.append(f"{result['case']}: registered {before['registered_ratio']:.0%} "
+                               f"-> {result['registered_ratio']:.0%}")
+    return regressions
+
+
+def _parse_resolution(value: str) -> Tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shapes", nargs="+", default=list(SHAPES), choices=SHAPES)
+    parser.add_argument("--views", type=int, nargs="+", default=[24], help="Images per scene")
+    parser.add_argument("--resolution", type=_parse_resolution, nargs="+", default=[(640, 480)],
+                        help="Image sizes as WIDTHxHEIGHT")
+    parser.add_argument("--matchers", nargs="+", default=["exhaustive", "sequential"])
+    parser.add_argument("--features", nargs="+", default=["sift"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results from a previous run")
+    parser.add_argument("--keep", action="store_true", help="Keep rendered images and workspaces")
+    args = parser.parse_args(argv)
+
+    temp_dir = tempfile.mkdtemp(prefix="bench-reconstruction-")
+    results = []
+    try:
+        print(f"{'case':<42} {'time (s)':>9} {'registered':>11} {'points':>8}")
+        for shape, num_views, resolution in itertools.product(args.shapes, args.views, args.resolution):
+            scene = f"{shape}-{num_views}-{resolution[0]}x{resolution[1]}"
+            image_dir = os.path.join(temp_dir, scene, "images")
+            render_scene(shape, num_views, resolution, image_dir, args.seed)
+            for matcher, feature_type in itertools.product(args.matchers, args.features):
+                case = f"{scene}-{matcher}-{feature_type}"
+                result = {"case": case, "shape": shape, "views": num_views, "resolution": list(resolution),
+                          "matcher": matcher, "feature_type": feature_type,
+                          **run_case(image_dir, os.path.join(temp_dir, scene, case), num_views,
+                                     matcher, feature_type)}
+                results.append(result)
+                print(f"{case:<42} {result['time']:>9.1f} {result['registered_ratio']:>11.0%} "
+                      f"{result['points']:>8}")
+    finally:
+        if args.keep:
+            print(f"Kept workspaces in {temp_dir}")
+        else:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"created_at": time.time(), "platform": platform.platform(),
+                       "cpu_count": os.cpu_count(), "results": results}, f, indent=2)
+        print(f"Wrote results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"])
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
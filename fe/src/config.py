@@ -1,12 +1,137 @@
 # Configuration settings
 
+import os
+
 TEMP_DIR = "tmp"  # Temporary directory for storing files
 
 # COLMAP executable path (if not in system PATH)
 COLMAP_EXECUTABLE = "colmap"  # Assumes COLMAP is in PATH.  Change if needed.
 
+# How COLMAP stages run: "cli" (a colmap process per stage) or "pycolmap" (in-process, needs pycolmap;
+# stages without a pycolmap binding still use COLMAP_EXECUTABLE)
+COLMAP_ENGINE = "cli"
+
 # Default COLMAP database name
 COLMAP_DATABASE_NAME = "database.db"
 
 # Default frame extraction rate for videos (frames per second)
 DEFAULT_VIDEO_FPS = 1
+
+# Maximum number of keyframes kept from an uploaded video
+DEFAULT_KEYFRAME_BUDGET = 120
+
+# Rate at which candidate frames are scored during keyframe selection
+KEYFRAME_CANDIDATE_FPS = 4
+
+# Output format and quality for frames extracted from videos
+FRAME_IMAGE_FORMAT = "jpg"  # "jpg" or "png"
+FRAME_JPEG_QUALITY = 95  # 0-100, higher is better quality
+FRAME_PNG_COMPRESSION = 3  # 0-9, higher is smaller and slower
+
+# Number of threads encoding extracted frames (0 encodes on the decode thread)
+FRAME_ENCODE_WORKERS = min(8, os.cpu_count() or 1)
+
+# Content-addressed store shared by all sessions for uploaded images
+IMAGE_STORE_DIR = "image_store"
+
+# Directory where reconstructed models are persisted
+MESH_PERSISTENCE_DIR = "persistent_meshes"
+
+# Limits for cached reconstructions in MESH_PERSISTENCE_DIR/cache (least recently used are evicted)
+RECONSTRUCTION_CACHE_MAX_ENTRIES = 50
+RECONSTRUCTION_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# File extensions COLMAP reads as input images
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Longest image side COLMAP works on; larger photos are downscaled into a working set before
+# reconstruction (None disables preprocessing).  3200 is COLMAP's own SIFT default.
+PREPROCESS_MAX_IMAGE_SIZE = 3200
+PREPROCESS_JPEG_QUALITY = 95  # 0-100, quality of re-encoded working images
+
+# Processes decoding and downscaling images in parallel
+PREPROCESS_WORKERS = min(8, os.cpu_count() or 1)
+
+# Largest image set matched exhaustively (O(n^2) pairs); larger sets use a cheaper strategy
+EXHAUSTIVE_MATCHING_MAX_IMAGES = 150
+
+# Number of neighbouring frames matched with each video frame
+SEQUENTIAL_MATCHING_OVERLAP = 10
+
+# COLMAP vocabulary tree for vocab-tree matching and loop detection (None if not installed)
+VOCAB_TREE_PATH = None
+
+# Time limits in seconds for COLMAP stages, keyed by stage (e.g. "mapping"); unlisted stages have no limit
+COLMAP_STAGE_TIMEOUTS = {}
+
+# Seconds a cancelled COLMAP process gets to exit after SIGTERM before it is killed
+COLMAP_TERMINATE_GRACE_PERIOD = 5
+
+# Dense reconstruction: "patch_match" (patch_match_stereo, needs CUDA), "delaunay" (meshes the sparse
+# model on the CPU) or "auto" (patch_match if an NVIDIA GPU is present)
+DENSE_METHOD = "auto"
+
+# Longest image side used by dense reconstruction; bounds its time and memory on CPU-only nodes
+DENSE_MAX_IMAGE_SIZE = 1000
+
+# Registered images two sparse models must share before model_merger is tried on them
+MODEL_MERGE_MIN_SHARED_IMAGES = 3
+
+# Binary PLY files at least this large are memory-mapped rather than read into memory
+MESH_MMAP_MIN_BYTES = 64 * 1024 ** 2
+
+# Number of parsed meshes kept in memory, keyed by path and modification time
+MESH_CACHE_MAX_ENTRIES = 8
+
+# Automatic segmentation: faces meeting at a dihedral angle above SEGMENTATION_CREASE_ANGLE (degrees)
+# are split, as are faces facing different of SEGMENTATION_NORMAL_CLUSTERS principal directions;
+# regions smaller than SEGMENTATION_MIN_REGION_AREA (fraction of the surface) join a neighbour
+SEGMENTATION_CREASE_ANGLE = 30.0
+SEGMENTATION_NORMAL_CLUSTERS = 6
+SEGMENTATION_MIN_REGION_AREA = 0.01
+
+# Task execution backend: "thread" (in-process threads), "process" (process pool)
+# or "sqlite" (durable queue in TASK_DB_PATH, shareable by worker processes and hosts)
+TASK_BACKEND = "thread"
+
+# SQLite database used by the "sqlite" task backend
+TASK_DB_PATH = "tasks.db"
+
+# Size of the process-wide worker pool; None sizes it from CPU cores and available memory
+WORKER_POOL_SIZE = None
+
+# Memory budgeted per concurrently running task when sizing the worker pool
+WORKER_MEMORY_PER_TASK = 2 * 1024 ** 3
+
+# Fraction of total memory that resource estimates of running tasks may add up to
+ADMISSION_MEMORY_FRACTION = 0.8
+
+# Seconds between re-checks of free memory while tasks wait for resources
+ADMISSION_POLL_INTERVAL = 2.0
+
+# Seconds a task may wait for resources before smaller tasks stop being started ahead of it
+ADMISSION_BACKFILL_LIMIT = 300
+
+# Seconds between refreshes of the task status panel
+STATUS_REFRESH_INTERVAL = 0.5
+
+# Seconds the task status panel waits for a status change before refreshing anyway
+STATUS_WAIT_TIMEOUT = 2.0
+
+# Seconds between task status reads for backends that cannot notify changes (e.g. SQLite)
+STATUS_POLL_INTERVAL = 0.5
+
+# Memory budget for task results; least recently used results beyond it are spilled to disk
+RESULT_STORE_MAX_BYTES = 256 * 1024 ** 2
+
+# Task results at least this large are written straight to disk
+RESULT_SPILL_THRESHOLD = 16 * 1024 ** 2
+
+# Directory for spilled task results; None uses a temporary directory
+RESULT_SPILL_DIR = None
+
+# Finished tasks older than this are forgotten by the janitor, across all sessions
+TASK_MAX_AGE_HOURS = 24
+
+# Seconds between janitor runs
+TASK_CLEANUP_INTERVAL = 15 * 60
@@ -0,0 +1,225 @@
+"""
+Content-addressed image store.
+
+Uploaded images are stored once per unique content under their SHA-256
+digest and hardlinked into per-session image directories, so re-uploads,
+Streamlit reruns and identical images across sessions cost no extra disk
+space or writes.  A small SQLite index records size, dimensions and EXIF
+camera information per blob.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+from src import config
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; dimensions then come from OpenCV
+    Image = None
+
+# Size of the chunks read when hashing files
+HASH_CHUNK_SIZE = 1 << 20
+
+# EXIF tag ids for camera make and model, and the GPS info IFD
+EXIF_MAKE = 0x010F
+EXIF_MODEL = 0x0110
+EXIF_GPS_IFD = 0x8825
+
+# Locks serializing writers per store root, shared by every ImageStore of this process
+_root_locks: Dict[str, threading.Lock] = {}
+_root_locks_guard = threading.Lock()
+
+
+def _root_lock(root: Path) -> threading.Lock:
+    with _root_locks_guard:
+        return _root_locks.setdefault(os.path.abspath(root), threading.Lock())
+
+
+def hash_bytes(data: Union[bytes, memoryview]) -> str:
+    """Return the SHA-256 hex digest of a bytes-like object."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path: Union[str, Path]) -> str:
+    """Return the SHA-256 hex digest of a file, reading it in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_image_info(path: Union[str, Path]) -> Dict[str, Any]:
+    """
+    Read image dimensions and EXIF camera information without decoding pixels.
+
+    Args:
+        path: Path to the image file.
+
+    Returns:
+        A dictionary with "width", "height", "camera_make" and "camera_model" (None when unknown).
+    """
+    info: Dict[str, Any] = {"width": None, "height": None, "camera_make": None, "camera_model": None}
+    try:
+        if Image is not None:
+            with Image.open(path) as image:
+                info["width"], info["height"] = image.size
+                exif = image.getexif()
+                info["camera_make"] = str(exif[EXIF_MAKE]).strip("\x00 ") if EXIF_MAKE in exif else None
+                info["camera_model"] = str(exif[EXIF_MODEL]).strip("\x00 ") if EXIF_MODEL in exif else None
+        else:
+            import cv2
+            image = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+            if image is not None:
+                info["height"], info["width"] = image.shape[:2]
+    except Exception as e:
+        logging.warning(f"Could not read image info for {path}: {e}")
+    return info
+
+
+def has_gps_tag(path: Union[str, Path]) -> bool:
+    """Return True if an image carries EXIF GPS coordinates."""
+    if Image is None:
+        return False
+    try:
+        with Image.open(path) as image:
+            return bool(image.getexif().get_ifd(EXIF_GPS_IFD))
+    except Exception:
+        return False
+
+
+class ImageStore:
+    """
+    A content-addressed blob store for images.
+
+    Blobs live at ``<root>/blobs/<digest[:2]>/<digest><ext>`` and are indexed
+    in ``<root>/index.db``.  The store is safe to share between threads and
+    between processes using the same directory, including through separate
+    instances (e.g. one per session).
+    """
+
+    def __init__(self, root: Union[str, Path] = config.IMAGE_STORE_DIR):
+        self.root = Path(root)
+        self.blob_dir = self.root / "blobs"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root / "index.db"
+        self._lock = _root_lock(self.root)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS blobs (
+                    digest TEXT PRIMARY KEY,
+                    extension TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    width INTEGER,
+                    height INTEGER,
+                    camera_make TEXT,
+                    camera_model TEXT,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.index_path), timeout=30)
+
+    def blob_path(self, digest: str, extension: str) -> Path:
+        """Return the path a blob with the given digest is stored at."""
+        return self.blob_dir / digest[:2] / f"{digest}{extension}"
+
+    def get_info(self, digest: str) -> Optional[Dict[str, Any]]:
+        """Return the index entry for a blob, or None if it is not stored."""
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        return dict(row) if row else None
+
+    def add_bytes(self, data: Union[bytes, memoryview], name: str = "") -> str:
+        """
+        Store image bytes, writing them to disk only if the content is new.
+
+        Args:
+            data: The image file contents.
+            name: Original file name, used only for its extension.
+
+        Returns:
+            The SHA-256 digest identifying the blob.
+        """
+        digest = hash_bytes(data)
+        extension = Path(name).suffix.lower()
+
+        with self._lock:
+            info = self.get_info(digest)
+            if info and self.blob_path(digest, info["extension"]).exists():
+                return digest
+
+            path = self.blob_path(digest, extension)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a unique temporary file first so readers, and writers in other
+            # processes, never see a partial blob
+            fd, temp_path = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+            image_info = read_image_info(path)
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (digest, extension, len(data), image_info["width"], image_info["height"],
+                     image_info["camera_make"], image_info["camera_model"], time.time()),
+                )
+        logging.debug(f"Stored new image blob {digest} ({len(data)} bytes)")
+        return digest
+
+    def add_file(self, path: Union[str, Path]) -> str:
+        """Store an image file from disk.  See ``add_bytes``."""
+        with open(path, "rb") as f:
+            return self.add_bytes(f.read(), str(path))
+
+    def link_into(self, digest: str, dest_dir: Union[str, Path], name: str) -> Path:
+        """
+        Hardlink a stored blob into a directory under the given file name.
+
+        Falls back to copying when hardlinks are not possible (e.g. across
+        filesystems).  An existing link to the same blob is left untouched.
+
+        Args:
+            digest: Digest returned by ``add_bytes``.
+            dest_dir: Directory to place the image in.
+            name: File name for the image in ``dest_dir``.
+
+        Returns:
+            Path to the linked image.
+        """
+        info = self.get_info(digest)
+        if info is None:
+            raise KeyError(f"Unknown image blob: {digest}")
+
+        blob = self.blob_path(digest, info["extension"])
+        dest = Path(dest_dir) / name
+        if dest.exists():
+            if os.path.samefile(blob, dest):
+                return dest
+            dest.unlink()
+
+        try:
+            os.link(blob, dest)
+        except OSError:
+            shutil.copy2(blob, dest)
+        return dest
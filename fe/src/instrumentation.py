@@ -0,0 +1,276 @@
+"""
+Per-stage timing and resource instrumentation.
+
+A ``Tracer`` records one metrics dictionary per pipeline stage:
+
+    {"stage": "feature_extraction", "started_at": 1700000000.0, "wall_time": 12.3,
+     "cpu_time": 40.1, "peak_rss": 1234567890, "output_bytes": 4567, "labels": {"num_images": 42}}
+
+Stages are measured on their own, even while other tasks run in the same
+process: ``cpu_time`` is the CPU time of the thread running the stage plus
+that of the child processes reported with ``track_process`` (e.g. COLMAP
+commands) and their descendants.  ``peak_rss`` is the largest combined
+resident set of those process trees, sampled while the stage runs; stages
+without child processes report the resident set of this whole process,
+since memory of one thread cannot be told apart.  Work a stage hands to
+other threads or to processes it does not report is not included.
+Records can be exported as JSON or Prometheus text.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import psutil
+
+# Seconds between memory samples while a stage runs
+RSS_SAMPLE_INTERVAL = 0.2
+
+# Prefix of exported Prometheus metric names
+METRIC_PREFIX = "stitchsketch_stage"
+
+# Exported Prometheus metrics: (record field, metric suffix, help text)
+PROMETHEUS_METRICS = (
+    ("wall_time", "wall_seconds", "Wall-clock time of a pipeline stage."),
+    ("cpu_time", "cpu_seconds", "CPU time of a pipeline stage, including its child processes."),
+    ("peak_rss", "peak_rss_bytes", "Peak resident memory of the child processes of a stage."),
+    ("output_bytes", "output_bytes", "Total size of the files a stage produced."),
+)
+
+
+# Usage of the stages running on each thread, innermost last
+_active = threading.local()
+
+
+def _tree_usage(process: psutil.Process) -> Optional[tuple]:
+    """
+    Resident memory and CPU seconds of a process and all its descendants.
+
+    The CPU time of the process includes the descendants it has reaped.
+
+    Returns:
+        Tuple of (rss, cpu seconds), or None once the process has been reaped.
+    """
+    try:
+        times = process.cpu_times()
+        cpu = times.user + times.system + times.children_user + times.children_system
+        rss = process.memory_info().rss
+        children = process.children(recursive=True)
+    except psutil.Error:
+        return None
+    for child in children:
+        try:
+            child_times = child.cpu_times()
+            cpu += child_times.user + child_times.system
+            rss += child.memory_info().rss
+        except psutil.Error:
+            pass  # The child exited between listing and sampling
+    return rss, cpu
+
+
+class _StageUsage:
+    """Child processes attributed to a running stage and the resources they used so far."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processes: Dict[int, psutil.Process] = {}
+        self._cpu: Dict[int, float] = {}
+        self.peak_rss = 0
+
+    def track(self, pid: int) -> bool:
+        try:
+            process = psutil.Process(pid)
+        except psutil.Error:
+            return False
+        with self._lock:
+            self._processes[pid] = process
+        self.sample()
+        return True
+
+    def sample(self):
+        with self._lock:
+            processes = dict(self._processes)
+        rss = 0
+        for pid, process in processes.items():
+            usage = _tree_usage(process)
+            if usage is None:
+                continue
+            rss += usage[0]
+            with self._lock:
+                # CPU times only grow; a reaped descendant moves into its parent's children times
+                self._cpu[pid] = max(self._cpu.get(pid, 0.0), usage[1])
+        with self._lock:
+            self.peak_rss = max(self.peak_rss, rss)
+
+    @property
+    def has_processes(self) -> bool:
+        return bool(self._processes)
+
+    @property
+    def cpu_seconds(self) -> float:
+        with self._lock:
+            return sum(self._cpu.values())
+
+
+def track_process(pid: int) -> bool:
+    """
+    Attribute a child process and its descendants to the stages running on this thread.
+
+    Returns:
+        True if a stage is measuring the process.
+    """
+    # Every enclosing stage accounts for the process, not just the first
+    tracked = [usage.track(pid) for usage in getattr(_active, "stages", ())]
+    return any(tracked)
+
+
+def sample_tracked_processes():
+    """
+    Sample the processes of the stages running on this thread now.
+
+    Call this once a tracked process has exited but before it is reaped
+    (e.g. after ``os.waitid`` with ``WNOWAIT``), so its final CPU time is recorded.
+    """
+    for usage in getattr(_active, "stages", ()):
+        usage.sample()
+
+
+def _process_rss(process: psutil.Process) -> int:
+    try:
+        return process.memory_info().rss
+    except psutil.Error:
+        return 0
+
+
+def path_size(path: str) -> int:
+    """Size of a file, or of all files below a directory, in bytes (0 if it does not exist)."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class Tracer:
+    """
+    Records metrics for the stages of a pipeline run.
+
+    Args:
+        on_record: Optional callback invoked with each finished stage record, e.g. to store it with a task.
+        sample_interval: Seconds between peak memory samples.
+    """
+
+    def __init__(self, on_record: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 sample_interval: float = RSS_SAMPLE_INTERVAL):
+        self.records: List[Dict[str, Any]] = []
+        self.on_record = on_record
+        self.sample_interval = sample_interval
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, outputs: Iterable[str] = (), **labels) -> Iterator[Dict[str, Any]]:
+        """
+        Measure a stage.
+
+        Args:
+            name: Stage name, e.g. "feature_extraction".
+            outputs: Files or directories whose total size is recorded when the stage ends.
+            **labels: Extra dimensions to chart by, e.g. ``num_images``.
+
+        Yields:
+            The record being built; callers may add labels to ``record["labels"]`` while it runs.
+        """
+        record: Dict[str, Any] = {"stage": name, "started_at": time.time(), "labels": dict(labels)}
+        process = psutil.Process()
+        usage = _StageUsage()
+        own_peak = [_process_rss(process)]
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(self.sample_interval):
+                usage.sample()
+                own_peak[0] = max(own_peak[0], _process_rss(process))
+
+        stages = _active.__dict__.setdefault("stages", [])
+        stages.append(usage)
+        sampler = threading.Thread(target=sample, daemon=True, name=f"rss-sampler-{name}")
+        sampler.start()
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        status = "completed"
+        try:
+            yield record
+        except BaseException:
+            status = "failed"
+            raise
+        finally:
+            record["wall_time"] = time.perf_counter() - wall_start
+            thread_cpu = time.thread_time() - cpu_start
+            stages.remove(usage)
+            done.set()
+            sampler.join()
+            usage.sample()
+            record["cpu_time"] = thread_cpu + usage.cpu_seconds
+            record["peak_rss"] = usage.peak_rss if usage.has_processes else max(own_peak[0], _process_rss(process))
+            record["output_bytes"] = sum(path_size(path) for path in outputs)
+            record["status"] = status
+            self._add(record)
+
+    def _add(self, record: Dict[str, Any]):
+        with self._lock:
+            self.records.append(record)
+        logging.info(f"Stage {record['stage']} {record['status']}: wall {record['wall_time']:.2f}s, "
+                     f"cpu {record['cpu_time']:.2f}s, peak RSS {record['peak_rss'] / 1024 ** 2:.0f} MiB, "
+                     f"output {record['output_bytes']} bytes")
+        if self.on_record is not None:
+            try:
+                self.on_record(record)
+            except Exception as e:
+                logging.warning(f"Could not store metrics of stage {record['stage']}: {e}")
+
+
+def trace_stage(tracer: Optional[Tracer], name: str, outputs: Iterable[str] = (), **labels):
+    """Return ``tracer.stage(...)``, or a no-op context if tracer is None."""
+    if tracer is None:
+        return nullcontext({"stage": name, "labels": dict(labels)})
+    return tracer.stage(name, outputs, **labels)
+
+
+def to_json(records: Iterable[Dict[str, Any]], **kwargs) -> str:
+    """Serialize stage records as a JSON array."""
+    return json.dumps(list(records), default=str, **kwargs)
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def to_prometheus(records: Iterable[Dict[str, Any]], prefix: str = METRIC_PREFIX) -> str:
+    """
+    Format stage records in the Prometheus text exposition format.
+
+    Each record becomes one gauge sample per metric, labelled with its
+    stage, status and labels (e.g. ``task_id``, ``num_images``).
+    """
+    records = list(records)
+    lines = []
+    for field, suffix, help_text in PROMETHEUS_METRICS:
+        metric = f"{prefix}_{suffix}"
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} gauge")
+        for record in records:
+            if field not in record:
+                continue
+            labels = {"stage": record["stage"], "status": record.get("status", ""), **record.get("labels", {})}
+            label_text = ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items())
+            lines.append(f"{metric}{{{label_text}}} {record[field]}")
+    return "\n".join(lines) + "\n"
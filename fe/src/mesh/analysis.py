@@ -1,18 +1,240 @@
 """
 Mesh segmentation module for selecting regions on a 3D mesh.
+
+Automatic segmentation works on whole arrays: face normals, areas and the
+dihedral angles between neighbouring faces are computed in NumPy over the
+face array, the face adjacency graph is built by sorting edge keys, and
+regions are grown as connected components of that graph with a vectorized
+union-find, so million-face meshes are segmented without Python loops over
+faces.
 """
 
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from src import config
+from src.mesh.io import Mesh, load_mesh
+
+# Rounds of k-means on face normals
+NORMAL_CLUSTER_ITERATIONS = 20
+
+# Faces the normal clusters are fitted on; all faces are then assigned to the nearest center
+NORMAL_CLUSTER_SAMPLE = 100_000
+
+# Rounds of merging small regions into their neighbours
+MERGE_ROUNDS = 10
+
+
+def face_normals_and_areas(mesh: Mesh) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Unit normals and areas of all faces.
+
+    Returns:
+        Tuple of (float32 (M, 3) normals, float32 (M,) areas).  Degenerate faces have a zero normal.
+    """
+    corners = mesh.vertices[mesh.faces]
+    cross = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    norms = np.linalg.norm(cross, axis=1)
+    normals = np.divide(cross, norms[:, None], out=np.zeros_like(cross), where=norms[:, None] > 0)
+    return normals, norms / 2
+
+
+def face_adjacency(mesh: Mesh) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pairs of faces sharing an edge.
+
+    Edges are keyed by their sorted vertex indices and sorted, so faces
+    sharing an edge become neighbours in the sorted order.  Faces around a
+    non-manifold edge are chained.
+
+    Returns:
+        Tuple of (face a, face b, shared edge length) arrays, one entry per adjacent pair.
+    """
+    edges = np.sort(mesh.faces[:, [[0, 1], [1, 2], [2, 0]]].reshape(-1, 2), axis=1).astype(np.int64)
+    keys = edges[:, 0] * max(mesh.num_vertices, 1) + edges[:, 1]
+    order = np.argsort(keys)
+    shared = keys[order[1:]] == keys[order[:-1]]
+    first, second = order[:-1][shared], order[1:][shared]
+    lengths = np.linalg.norm(mesh.vertices[edges[first, 0]] - mesh.vertices[edges[first, 1]], axis=1)
+    return first // 3, second // 3, lengths
+
+
+def dihedral_angles(normals: np.ndarray, face_a: np.ndarray, face_b: np.ndarray) -> np.ndarray:
+    """
+    Angles in degrees between the normals of adjacent faces: the discrete curvature along their shared edge.
+    """
+    cosines = np.einsum("ij,ij->i", normals[face_a], normals[face_b])
+    return np.degrees(np.arccos(np.clip(cosines, -1.0, 1.0)))
+
+
+def connected_components(num_nodes: int, node_a: np.ndarray, node_b: np.ndarray) -> np.ndarray:
+    """
+    Label the connected components of a graph given as edge arrays.
+
+    Union-find over all edges at once: every round hooks the root of the
+    higher label under the lower one across each edge, then compresses
+    paths by pointer jumping until every node points at its root.
+
+    Returns:
+        Component labels numbered from 0 in order of their lowest node.
+    """
+    labels = np.arange(num_nodes)
+    while True:
+        root_a, root_b = labels[node_a], labels[node_b]
+        crossing = root_a != root_b
+        if not crossing.any():
+            break
+        np.minimum.at(labels, np.maximum(root_a, root_b)[crossing], np.minimum(root_a, root_b)[crossing])
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+    return _compact(labels)
+
+
+def _compact(labels: np.ndarray) -> np.ndarray:
+    """Renumber labels to 0..k-1, keeping their order, in linear time."""
+    present = np.zeros(labels.max() + 1 if len(labels) else 0, bool)
+    present[labels] = True
+    return (np.cumsum(present) - 1)[labels]
+
+
+def cluster_normals(normals: np.ndarray, areas: np.ndarray, num_clusters: int) -> np.ndarray:
+    """
+    Group faces by orientation with area-weighted spherical k-means.
+
+    Centers start at mutually distant face normals (farthest-point
+    seeding from the area-weighted mean direction), so results are
+    deterministic.  Centers are fitted on an evenly strided sample of at
+    most ``NORMAL_CLUSTER_SAMPLE`` faces.
+
+    Returns:
+        Cluster index per face.
+    """
+    num_clusters = max(1, min(num_clusters, len(normals)))
+    all_normals = normals
+    step = max(1, len(normals) // NORMAL_CLUSTER_SAMPLE)
+    normals, areas = normals[::step], areas[::step]
+    mean = (normals * areas[:, None]).sum(axis=0)
+    centers = [normals[np.argmax(normals @ mean)] if np.linalg.norm(mean) > 0 else normals[np.argmax(areas)]]
+    similarity = normals @ centers[0]
+    for _ in range(num_clusters - 1):
+        centers.append(normals[np.argmin(similarity)])
+        similarity = np.maximum(similarity, normals @ centers[-1])
+    centers = np.array(centers)
+
+    assignment = None
+    for _ in range(NORMAL_CLUSTER_ITERATIONS):
+        updated = np.argmax(normals @ centers.T, axis=1)
+        if assignment is not None and np.array_equal(updated, assignment):
+            break
+        assignment = updated
+        sums = np.stack([np.bincount(assignment, normals[:, axis] * areas, num_clusters) for axis in range(3)], axis=1)
+        norms = np.linalg.norm(sums, axis=1)
+        # Empty clusters keep their center
+        centers = np.where(norms[:, None] > 0, sums / np.maximum(norms, 1e-12)[:, None], centers)
+    return np.argmax(all_normals @ centers.T.astype(all_normals.dtype), axis=1)
+
+
+def _merge_small_regions(labels: np.ndarray, areas: np.ndarray, face_a: np.ndarray, face_b: np.ndarray,
+                         lengths: np.ndarray, min_area: float) -> np.ndarray:
+    """Join regions below ``min_area`` to the larger neighbour they share the longest boundary with."""
+    for _ in range(MERGE_ROUNDS):
+        num_regions = labels.max() + 1
+        region_areas = np.bincount(labels, areas, num_regions)
+        region_a, region_b = labels[face_a], labels[face_b]
+        boundary = region_a != region_b
+        # Both directions of every boundary edge: (small region, neighbour, length)
+        source = np.concatenate([region_a[boundary], region_b[boundary]])
+        target = np.concatenate([region_b[boundary], region_a[boundary]])
+        length = np.concatenate([lengths[boundary], lengths[boundary]])
+        # Merging only into larger regions (ties by lower label) cannot form cycles
+        into_larger = (region_areas[target] > region_areas[source]) | \
+            ((region_areas[target] == region_areas[source]) & (target < source))
+        candidates = (region_areas[source] < min_area) & into_larger
+        if not candidates.any():
+            break
+        pairs, inverse = np.unique(source[candidates] * num_regions + target[candidates], return_inverse=True)
+        shared_length = np.bincount(inverse, length[candidates])
+        # For each small region, the neighbour with the longest shared boundary comes first
+        order = np.lexsort((-shared_length, pairs // num_regions))
+        small, first = np.unique(pairs[order] // num_regions, return_index=True)
+
+        parent = np.arange(num_regions)
+        parent[small] = pairs[order][first] % num_regions
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
+                break
+            parent = jumped
+        labels = _compact(parent[labels])
+    return labels
+
+
+def segment_faces(
+    mesh: Mesh,
+    crease_angle: float = config.SEGMENTATION_CREASE_ANGLE,
+    num_directions: int = config.SEGMENTATION_NORMAL_CLUSTERS,
+    min_region_area: float = config.SEGMENTATION_MIN_REGION_AREA,
+) -> np.ndarray:
+    """
+    Segment a triangle mesh into smooth regions of similar orientation.
+
+    Neighbouring faces belong to the same region when the dihedral angle
+    between them is at most ``crease_angle`` and their normals fall in the
+    same of ``num_directions`` principal directions.  Regions covering less
+    than ``min_region_area`` of the surface are merged into a neighbour.
+
+    Args:
+        mesh: A triangle mesh.
+        crease_angle: Dihedral angle in degrees above which faces are separated.
+        num_directions: Number of orientation clusters; 1 splits at creases only.
+        min_region_area: Smallest region, as a fraction of the total surface area.
+
+    Returns:
+        Region label per face, numbered from 0 by decreasing region area.
+
+    Raises:
+        ValueError: If the mesh has no faces (e.g. a sparse point cloud).
+    """
+    if mesh.is_point_cloud:
+        raise ValueError("Automatic segmentation needs a triangle mesh, not a point cloud")
+    normals, areas = face_normals_and_areas(mesh)
+    face_a, face_b, lengths = face_adjacency(mesh)
+    directions = cluster_normals(normals, areas, num_directions)
+
+    connected = (dihedral_angles(normals, face_a, face_b) <= crease_angle) & \
+        (directions[face_a] == directions[face_b])
+    labels = connected_components(mesh.num_faces, face_a[connected], face_b[connected])
+    labels = _merge_small_regions(labels, areas, face_a, face_b, lengths, min_region_area * areas.sum())
+
+    # Number regions by decreasing area
+    region_areas = np.bincount(labels, areas)
+    rank = np.empty(len(region_areas), np.int64)
+    rank[np.argsort(-region_areas, kind="stable")] = np.arange(len(region_areas))
+    return rank[labels]
+
+
+def split_regions(labels: np.ndarray) -> List[np.ndarray]:
+    """Face indices of each region, in label order."""
+    order = np.argsort(labels, kind="stable")
+    return np.split(order.astype(np.int32), np.cumsum(np.bincount(labels))[:-1])
+
 
-def select_regions(mesh, selection_method="interactive"):
+def select_regions(mesh: Union[Mesh, str], selection_method="interactive", **options) -> list:
     """
     Select regions on a 3D mesh using the specified method.
 
     Args:
-        mesh: The 3D mesh object.
+        mesh: The 3D mesh, or the path of a mesh file.
         selection_method: The method used for region selection (e.g., "interactive", "automatic").
+        **options: Options of ``segment_faces`` for automatic selection.
 
     Returns:
-        A list of selected regions on the mesh.
+        A list of selected regions on the mesh.  Automatic selection returns an
+        int32 array of face indices per region, largest region first.
     """
     if selection_method == "interactive":
         # Implement interactive region selection using a 3D viewer component.
@@ -21,10 +243,9 @@ def select_regions(mesh, selection_method="interactive"):
         # (This is a placeholder - the actual implementation would depend on the 3D viewer library)
         selected_regions = ["Interactive Region 1", "Interactive Region 2"]
     elif selection_method == "automatic":
-        # Implement automatic region selection using a mesh segmentation algorithm.
-        # This could involve clustering the mesh based on geometric features (e.g., curvature, normals).
-        # (This is a placeholder - the actual implementation would depend on the chosen algorithm)
-        selected_regions = ["Automatic Region A", "Automatic Region B"]
+        if not isinstance(mesh, Mesh):
+            mesh = load_mesh(mesh)
+        selected_regions = split_regions(segment_faces(mesh, **options))
     else:
         raise ValueError(f"Invalid selection method: {selection_method}")
 
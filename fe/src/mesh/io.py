@@ -0,0 +1,338 @@
+"""
+Loading meshes and point clouds into compact NumPy arrays.
+
+Binary PLY files, as written by COLMAP's ``model_converter`` and mesher,
+are parsed directly: the header describes fixed-size records, which are
+read as structured arrays.  Large files are memory-mapped, so only the
+fields that are used (e.g. positions, not colors) are paged in and copied.
+Other formats (OBJ, STL, ASCII PLY, PLYs with non-triangle faces) are
+loaded with trimesh.
+
+``load_mesh`` caches parsed meshes per path and modification time, so
+pages that show the same model do not parse it again on every rerun.
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import trimesh
+
+from src import config
+
+# PLY scalar types and their NumPy equivalents
+PLY_TYPES = {
+    "char": "i1", "int8": "i1",
+    "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2",
+    "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4",
+    "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4",
+    "double": "f8", "float64": "f8",
+}
+
+_BYTE_ORDERS = {"binary_little_endian": "<", "binary_big_endian": ">"}
+
+# Per-vertex fields of a mesh, by the PLY property names that hold them
+COLOR_PROPERTIES = ("red", "green", "blue")
+NORMAL_PROPERTIES = ("nx", "ny", "nz")
+
+
+class Mesh:
+    """
+    A triangle mesh or point cloud.
+
+    Args:
+        vertices: Vertex positions, (N, 3).
+        faces: Vertex indices of the triangles, (M, 3); None or empty for a point cloud.
+        vertex_data: Optional structured array of all per-vertex properties (positions, normals,
+            colors, ...), memory-mapped for large binary PLY files.
+
+    Attributes:
+        vertices: Contiguous float32 array of shape (N, 3).
+        faces: Contiguous int32 array of shape (M, 3).
+    """
+
+    def __init__(self, vertices: np.ndarray, faces: Optional[np.ndarray] = None,
+                 vertex_data: Optional[np.ndarray] = None):
+        self.vertices = _read_only(np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 3))
+        if faces is None:
+            faces = np.empty((0, 3), np.int32)
+        self.faces = _read_only(np.ascontiguousarray(faces, dtype=np.int32).reshape(-1, 3))
+        self.vertex_data = vertex_data
+        self._colors = None
+        self._normals = None
+
+    @property
+    def num_vertices(self) -> int:
+        return len(self.vertices)
+
+    @property
+    def num_faces(self) -> int:
+        return len(self.faces)
+
+    @property
+    def is_point_cloud(self) -> bool:
+        return self.num_faces == 0
+
+    def _vertex_fields(self, names: Tuple[str, ...], dtype) -> Optional[np.ndarray]:
+        if self.vertex_data is None or not all(name in (self.vertex_data.dtype.names or ()) for name in names):
+            return None
+        fields = np.empty((len(self.vertex_data), len(names)), dtype)
+        for i, name in enumerate(names):
+            fields[:, i] = self.vertex_data[name]
+        return _read_only(fields)
+
+    @property
+    def colors(self) -> Optional[np.ndarray]:
+        """Per-vertex RGB colors as a uint8 (N, 3) array, or None."""
+        if self._colors is None:
+            self._colors = self._vertex_fields(COLOR_PROPERTIES, np.uint8)
+        return self._colors
+
+    @property
+    def normals(self) -> Optional[np.ndarray]:
+        """Per-vertex normals as a float32 (N, 3) array, or None."""
+        if self._normals is None:
+            self._normals = self._vertex_fields(NORMAL_PROPERTIES, np.float32)
+        return self._normals
+
+    @property
+    def bounds(self) -> np.ndarray:
+        """Minimum and maximum corner of the bounding box, (2, 3)."""
+        if self.num_vertices == 0:
+            return np.zeros((2, 3), np.float32)
+        return np.stack([self.vertices.min(axis=0), self.vertices.max(axis=0)])
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    # Meshes are shared through the cache; writing to one would change it for every reader
+    array.setflags(write=False)
+    return array
+
+
+def read_ply_header(f) -> Tuple[str, List[Tuple[str, int, list]], int]:
+    """
+    Parse a PLY header.
+
+    Returns:
+        Tuple of (format, elements, header size in bytes).  Each element is
+        (name, count, properties); a property is (name, type) or (name, count type, item type) for lists.
+
+    Raises:
+        ValueError: If the file is not a PLY file.
+    """
+    if f.readline().strip() != b"ply":
+        raise ValueError("Not a PLY file")
+    ply_format = None
+    elements: List[Tuple[str, int, list]] = []
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError("Truncated PLY header")
+        words = line.decode("ascii", errors="replace").split()
+        if not words or words[0] in ("comment", "obj_info"):
+            continue
+        if words[0] == "format":
+            ply_format = words[1]
+        elif words[0] == "element":
+            elements.append((words[1], int(words[2]), []))
+        elif words[0] == "property":
+            if words[1] == "list":
+                elements[-1][2].append((words[4], words[2], words[3]))
+            else:
+                elements[-1][2].append((words[2], words[1]))
+        elif words[0] == "end_header":
+            return ply_format, elements, f.tell()
+
+
+def _record_dtype(properties: list, byte_order: str) -> Optional[np.dtype]:
+    """Record dtype of an element whose properties are all scalars, or None."""
+    if any(len(prop) != 2 for prop in properties):
+        return None
+    return np.dtype([(name, byte_order + PLY_TYPES[ply_type]) for name, ply_type in properties])
+
+
+def _face_dtype(properties: list, byte_order: str) -> Optional[np.dtype]:
+    """Record dtype of a face element, assuming every face is a triangle, or None if it has no index list."""
+    fields = []
+    for prop in properties:
+        if len(prop) == 3:
+            name, count_type, item_type = prop
+            if name not in ("vertex_indices", "vertex_index"):
+                return None
+            fields += [("count", byte_order + PLY_TYPES[count_type]),
+                       ("indices", byte_order + PLY_TYPES[item_type], (3,))]
+        else:
+            fields.append((prop[0], byte_order + PLY_TYPES[prop[1]]))
+    return np.dtype(fields) if any(name == "indices" for name, *_ in fields) else None
+
+
+def read_binary_ply(path: str, mmap: Optional[bool] = None) -> Optional[Mesh]:
+    """
+    Read a binary PLY point cloud or triangle mesh without per-record parsing.
+
+    Args:
+        path: Path to the PLY file.
+        mmap: Memory-map the file instead of reading it; by default, for files of at
+            least ``config.MESH_MMAP_MIN_BYTES``.
+
+    Returns:
+        The mesh, or None if the file is ASCII or has non-triangle faces or other
+        variable-length data, which ``read_mesh`` leaves to trimesh.
+    """
+    with open(path, "rb") as f:
+        ply_format, elements, offset = read_ply_header(f)
+    byte_order = _BYTE_ORDERS.get(ply_format)
+    if byte_order is None:
+        return None
+    file_size = os.path.getsize(path)
+    if mmap is None:
+        mmap = file_size >= config.MESH_MMAP_MIN_BYTES
+
+    vertex_data = None
+    faces = None
+    for name, count, properties in elements:
+        try:
+            dtype = _face_dtype(properties, byte_order) if name == "face" else _record_dtype(properties, byte_order)
+        except KeyError:
+            dtype = None  # A property type NumPy has no equivalent for
+        if dtype is None:
+            return None
+        if offset + count * dtype.itemsize > file_size:
+            raise ValueError(f"Truncated PLY file: {path}")
+        if count == 0:
+            records = np.empty(0, dtype)
+        elif mmap:
+            records = np.memmap(path, dtype, mode="r", offset=offset, shape=(count,))
+        else:
+            records = np.fromfile(path, dtype, count, offset=offset)
+        offset += count * dtype.itemsize
+
+        if name == "vertex":
+            vertex_data = records
+        elif name == "face":
+            if len(records) and not np.all(records["count"] == 3):
+                return None
+            faces = records["indices"]
+
+    if vertex_data is None or not all(axis in vertex_data.dtype.names for axis in ("x", "y", "z")):
+        raise ValueError(f"PLY file has no vertex positions: {path}")
+
+    vertices = np.empty((len(vertex_data), 3), np.float32)
+    for i, axis in enumerate("xyz"):
+        vertices[:, i] = vertex_data[axis]
+    return Mesh(vertices, faces, vertex_data)
+
+
+def _from_trimesh(loaded) -> Mesh:
+    """Convert a trimesh Trimesh or PointCloud, keeping per-vertex colors."""
+    vertices = np.asarray(loaded.vertices, np.float32)
+    faces = getattr(loaded, "faces", None)
+    colors = getattr(loaded, "colors", None)
+    visual = getattr(loaded, "visual", None)
+    if colors is None and visual is not None and visual.kind == "vertex":
+        colors = visual.vertex_colors
+    if colors is None or len(colors) != len(vertices):
+        return Mesh(vertices, faces)
+
+    vertex_data = np.empty(len(vertices), [(axis, "<f4") for axis in "xyz"] + [(name, "u1") for name in COLOR_PROPERTIES])
+    for i, axis in enumerate("xyz"):
+        vertex_data[axis] = vertices[:, i]
+    for i, name in enumerate(COLOR_PROPERTIES):
+        vertex_data[name] = np.asarray(colors)[:, i]
+    return Mesh(vertices, faces, vertex_data)
+
+
+def read_mesh(path: str, mmap: Optional[bool] = None) -> Mesh:
+    """
+    Read a mesh or point cloud file.
+
+    Args:
+        path: Path to a PLY, OBJ, STL or other file trimesh can read.
+        mmap: See ``read_binary_ply``.
+
+    Raises:
+        ValueError: If the file cannot be parsed.
+    """
+    if path.lower().endswith(".ply"):
+        mesh = read_binary_ply(path, mmap)
+        if mesh is not None:
+            return mesh
+        logging.info(f"Loading {path} with trimesh (ASCII or polygonal PLY)")
+    try:
+        loaded = trimesh.load(path, process=False)
+    except Exception as e:
+        raise ValueError(f"Could not load mesh {path}: {e}") from e
+    if isinstance(loaded, trimesh.Scene):
+        loaded = loaded.dump(concatenate=True)
+    return _from_trimesh(loaded)
+
+
+def write_ply(path: str, mesh: Mesh) -> None:
+    """Write a mesh or point cloud as a binary little-endian PLY file, with its normals and colors."""
+    fields = [("x", "<f4"), ("y", "<f4"), ("z", "<f4")]
+    columns: Dict[str, np.ndarray] = {"x": mesh.vertices[:, 0], "y": mesh.vertices[:, 1], "z": mesh.vertices[:, 2]}
+    for names, array, ply_type in ((NORMAL_PROPERTIES, mesh.normals, "<f4"), (COLOR_PROPERTIES, mesh.colors, "u1")):
+        if array is not None:
+            fields += [(name, ply_type) for name in names]
+            columns.update((name, array[:, i]) for i, name in enumerate(names))
+    vertex_records = np.empty(mesh.num_vertices, np.dtype(fields))
+    for name, column in columns.items():
+        vertex_records[name] = column
+
+    ply_types = {"<f4": "float", "u1": "uchar"}
+    header = ["ply", "format binary_little_endian 1.0", f"element vertex {mesh.num_vertices}"]
+    header += [f"property {ply_types[ply_type]} {name}" for name, ply_type in fields]
+    if not mesh.is_point_cloud:
+        header += [f"element face {mesh.num_faces}", "property list uchar int vertex_indices"]
+    header.append("end_header")
+
+    with open(path, "wb") as f:
+        f.write(("\n".join(header) + "\n").encode("ascii"))
+        vertex_records.tofile(f)
+        if not mesh.is_point_cloud:
+            face_records = np.empty(mesh.num_faces, [("count", "u1"), ("indices", "<i4", (3,))])
+            face_records["count"] = 3
+            face_records["indices"] = mesh.faces
+            face_records.tofile(f)
+
+
+_cache: "OrderedDict[str, Tuple[Tuple[int, int], Mesh]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def load_mesh(path: str) -> Mesh:
+    """
+    Read a mesh, reusing the parsed mesh if the file is unchanged since it was last loaded.
+
+    The cache holds the ``config.MESH_CACHE_MAX_ENTRIES`` most recently used
+    meshes; a file that changed on disk replaces its cached version.  Cached
+    arrays are read-only, as every caller shares them.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == version:
+            _cache.move_to_end(path)
+            return cached[1]
+
+    mesh = read_mesh(path)
+    with _cache_lock:
+        _cache[path] = (version, mesh)
+        _cache.move_to_end(path)
+        while len(_cache) > config.MESH_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return mesh
+
+
+def clear_mesh_cache() -> None:
+    """Drop all cached meshes."""
+    with _cache_lock:
+        _cache.clear()
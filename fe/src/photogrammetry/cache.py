@@ -0,0 +1,239 @@
+"""Persistent reconstruction cache keyed by image-set fingerprint."""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+from src import config
+from src.image_store import hash_file
+from src.instrumentation import trace_stage
+from src.photogrammetry import colmap_wrapper, reconstruction
+
+# Defaults of the run_colmap options that change the reconstructed model
+RESULT_OPTION_DEFAULTS: Dict[str, Any] = {
+    "feature_type": "sift",
+    "camera_model": "SIMPLE_RADIAL",
+    "vocab_tree_path": None,
+    "matcher": "auto",
+    "provenance": None,
+    "merge_models": False,
+    "dense": False,
+    "max_image_size": config.PREPROCESS_MAX_IMAGE_SIZE,
+}
+
+# run_colmap options that only affect how the pipeline runs, not its result
+RUNTIME_OPTIONS = frozenset({"resume", "incremental", "cancel_event", "stage_timeouts", "num_threads",
+                             "tracer", "engine"})
+
+
+def cache_key_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the options that identify a reconstruction, with defaults filled in."""
+    key = dict(RESULT_OPTION_DEFAULTS)
+    key.update((name, value) for name, value in options.items() if name not in RUNTIME_OPTIONS)
+    return key
+
+
+def list_images(image_dir: Union[str, Path]) -> List[Path]:
+    """Return the input images in a directory, sorted by name."""
+    return sorted(
+        path for path in Path(image_dir).iterdir()
+        if path.is_file() and path.suffix.lower() in config.IMAGE_EXTENSIONS
+    )
+
+
+class ReconstructionCache:
+    """
+    Cache of reconstructed models keyed by image content and COLMAP options.
+
+    Entries live at ``<root>/<fingerprint>/model.ply`` and are indexed in
+    ``<root>/index.db``, which also memoizes image digests by path, size and
+    mtime so unchanged images are not re-hashed.  The least recently used
+    entries are evicted once ``max_entries`` or ``max_bytes`` is exceeded.
+    """
+
+    def __init__(
+        self,
+        root: Union[str, Path] = os.path.join(config.MESH_PERSISTENCE_DIR, "cache"),
+        max_entries: int = config.RECONSTRUCTION_CACHE_MAX_ENTRIES,
+        max_bytes: int = config.RECONSTRUCTION_CACHE_MAX_BYTES,
+    ):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.index_path = self.root / "index.db"
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    fingerprint TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS file_digests (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    digest TEXT NOT NULL
+                )
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.index_path), timeout=30)
+
+    def file_digest(self, path: Union[str, Path]) -> str:
+        """Return the SHA-256 digest of a file, reusing the memoized value if it is unchanged."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT digest FROM file_digests WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path, stat.st_size, stat.st_mtime_ns),
+            ).fetchone()
+            if row:
+                return row[0]
+            digest = hash_file(path)
+            conn.execute("INSERT OR REPLACE INTO file_digests VALUES (?, ?, ?, ?)",
+                         (path, stat.st_size, stat.st_mtime_ns, digest))
+        return digest
+
+    def fingerprint(self, image_paths: Iterable[Union[str, Path]], options: Dict[str, Any]) -> str:
+        """
+        Compute the cache key for a set of images and COLMAP options.
+
+        The key depends on image contents, not on file names or order, except
+        that with the "auto" matcher it includes the image provenance, which
+        ``run_colmap`` infers from the names and EXIF tags to plan matching.
+        """
+        image_paths = [os.path.abspath(path) for path in image_paths]
+        key_options = cache_key_options(options)
+        if key_options["matcher"] == "auto" and key_options["provenance"] is None and image_paths:
+            image_dir = os.path.commonpath([os.path.dirname(path) for path in image_paths])
+            key_options["provenance"] = colmap_wrapper.infer_image_provenance(
+                image_dir, sorted(os.path.relpath(path, image_dir) for path in image_paths))
+        digest = hashlib.sha256()
+        for image_digest in sorted(self.file_digest(path) for path in image_paths):
+            digest.update(image_digest.encode())
+        digest.update(json.dumps(key_options, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def entry_path(self, fingerprint: str) -> Path:
+        """Return the path of the cached model for a fingerprint."""
+        return self.root / fingerprint / "model.ply"
+
+    def get(self, fingerprint: str) -> Optional[str]:
+        """Return the cached model path for a fingerprint, or None on a miss."""
+        path = self.entry_path(fingerprint)
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT 1 FROM entries WHERE fingerprint = ?", (fingerprint,)).fetchone()
+            if not row or not path.exists():
+                return None
+            conn.execute("UPDATE entries SET last_access = ? WHERE fingerprint = ?", (time.time(), fingerprint))
+        return str(path)
+
+    def put(self, fingerprint: str, ply_path: Union[str, Path]) -> str:
+        """
+        Copy a model into the cache and evict old entries.
+
+        Returns:
+            The cached path, or ``ply_path`` itself if the model alone exceeds ``max_bytes``
+            and is therefore not cached.
+        """
+        size = os.path.getsize(ply_path)
+        if size > self.max_bytes:
+            logging.warning(f"Not caching reconstruction {fingerprint}: {size} bytes exceed the "
+                            f"cache limit of {self.max_bytes} bytes")
+            return str(ply_path)
+        path = self.entry_path(fingerprint)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(ply_path, path)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (fingerprint, size, now, now))
+        self.evict(keep=fingerprint)
+        return str(path)
+
+    def evict(self, keep: Optional[str] = None) -> List[str]:
+        """
+        Remove least recently used entries until the cache is within its limits.
+
+        Memoized digests of images that no longer exist are dropped as well.
+
+        Args:
+            keep: Fingerprint that is never evicted, e.g. the entry just stored; its size still counts.
+        """
+        evicted = []
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                "SELECT fingerprint, size FROM entries ORDER BY fingerprint = ? DESC, last_access DESC",
+                (keep,)).fetchall()
+            total_bytes = 0
+            for position, (fingerprint, size) in enumerate(rows):
+                total_bytes += size
+                if fingerprint == keep or (position < self.max_entries and total_bytes <= self.max_bytes):
+                    continue
+                conn.execute("DELETE FROM entries WHERE fingerprint = ?", (fingerprint,))
+                shutil.rmtree(self.root / fingerprint, ignore_errors=True)
+                evicted.append(fingerprint)
+                logging.info(f"Evicted cached reconstruction: {fingerprint}")
+            stale = [(path,) for (path,) in conn.execute("SELECT path FROM file_digests")
+                     if not os.path.exists(path)]
+            conn.executemany("DELETE FROM file_digests WHERE path = ?", stale)
+        return evicted
+
+    def run(
+        self,
+        image_dir: str,
+        database_path: str,
+        sparse_dir: str,
+        progress_callback: Optional[Callable[[float, str], None]] = None,
+        **colmap_options,
+    ) -> Optional[str]:
+        """
+        Return a cached model for the images in ``image_dir`` or run the reconstruction.
+
+        Args:
+            image_dir: Path to the directory containing the images.
+            database_path: Path to the COLMAP database.
+            sparse_dir: Path to the directory where the sparse reconstruction will be stored.
+            progress_callback: Optional callback function to report progress.
+            **colmap_options: Options passed through to ``run_colmap``; they are part of the cache key.
+
+        Returns:
+            Path to the cached model.ply file, or None if reconstruction fails.
+        """
+        if progress_callback:
+            progress_callback(0, "Checking for a cached reconstruction...")
+        tracer = colmap_options.get("tracer")
+        with trace_stage(tracer, "cache_lookup") as record:
+            images = list_images(image_dir)
+            fingerprint = self.fingerprint(images, colmap_options)
+            cached = self.get(fingerprint)
+            record["labels"].update(num_images=len(images), hit=bool(cached))
+        if cached:
+            logging.info(f"Reconstruction cache hit: {fingerprint}")
+            if progress_callback:
+                progress_callback(100, f"Reused cached reconstruction: {cached}")
+            return cached
+
+        logging.info(f"Reconstruction cache miss: {fingerprint}")
+        ply_path = reconstruction.run_reconstruction(
+            image_dir, database_path, sparse_dir, progress_callback=progress_callback, **colmap_options)
+        if ply_path is None:
+            return None
+        with trace_stage(tracer, "cache_store", [str(self.entry_path(fingerprint))]):
+            return self.put(fingerprint, ply_path)
@@ -0,0 +1,297 @@
+"""
+Reader for binary COLMAP sparse models.
+
+Loads ``cameras.bin``, ``images.bin`` and ``points3D.bin`` into structured
+NumPy arrays.  Files are memory-mapped: the 2D observations of each image
+and the tracks of the 3D points are only read when they are accessed, so
+statistics over million-point models do not parse or copy data they do not
+use.
+"""
+
+import mmap
+import os
+import struct
+from typing import Dict, Optional
+
+import numpy as np
+
+# COLMAP camera model ids and their number of parameters
+CAMERA_MODELS = {
+    0: ("SIMPLE_PINHOLE", 3),
+    1: ("PINHOLE", 4),
+    2: ("SIMPLE_RADIAL", 4),
+    3: ("RADIAL", 5),
+    4: ("OPENCV", 8),
+    5: ("OPENCV_FISHEYE", 8),
+    6: ("FULL_OPENCV", 12),
+    7: ("FOV", 5),
+    8: ("SIMPLE_RADIAL_FISHEYE", 4),
+    9: ("RADIAL_FISHEYE", 5),
+    10: ("THIN_PRISM_FISHEYE", 12),
+    11: ("RAD_TAN_THIN_PRISM_FISHEYE", 16),
+}
+
+# Parameters are padded with NaN to the largest camera model
+MAX_CAMERA_PARAMS = max(num_params for _, num_params in CAMERA_MODELS.values())
+
+CAMERA_DTYPE = np.dtype([
+    ("camera_id", "<i4"),
+    ("model_id", "<i4"),
+    ("width", "<u8"),
+    ("height", "<u8"),
+    ("num_params", "<i4"),
+    ("params", "<f8", (MAX_CAMERA_PARAMS,)),
+])
+
+# Image records; the name and 2D observations follow the fixed part in images.bin
+IMAGE_DTYPE = np.dtype([
+    ("image_id", "<i4"),
+    ("qvec", "<f8", (4,)),
+    ("tvec", "<f8", (3,)),
+    ("camera_id", "<i4"),
+    ("num_points2D", "<i8"),
+    ("points2D_offset", "<i8"),
+])
+_IMAGE_HEADER = struct.Struct("<i4d3di")
+
+POINT2D_DTYPE = np.dtype([("xy", "<f8", (2,)), ("point3D_id", "<i8")])
+
+# Fixed part of a points3D.bin record (packed, 51 bytes); the track follows it
+POINT3D_DTYPE = np.dtype([
+    ("point3D_id", "<u8"),
+    ("xyz", "<f8", (3,)),
+    ("rgb", "u1", (3,)),
+    ("error", "<f8"),
+    ("track_length", "<u8"),
+])
+
+TRACK_DTYPE = np.dtype([("image_id", "<i4"), ("point2D_idx", "<i4")])
+
+_UINT64 = struct.Struct("<Q")
+_TRACK_LENGTH_OFFSET = POINT3D_DTYPE.fields["track_length"][1]
+
+
+def find_model_dir(sparse_dir: str) -> Optional[str]:
+    """
+    Return the directory holding a binary model: ``sparse_dir`` itself or the mapper's ``sparse_dir/0``.
+
+    Returns:
+        The model directory, or None if neither contains ``images.bin``.
+    """
+    for model_dir in (sparse_dir, os.path.join(sparse_dir, "0")):
+        if os.path.isfile(os.path.join(model_dir, "images.bin")):
+            return model_dir
+    return None
+
+
+def count_records(path: str) -> int:
+    """Number of records (cameras, images or points) in a model file, read from its header."""
+    with open(path, "rb") as f:
+        header = f.read(8)
+    if len(header) < 8:
+        raise ValueError(f"Truncated COLMAP model file: {path}")
+    return _UINT64.unpack(header)[0]
+
+
+def _map_file(path: str) -> mmap.mmap:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError(f"Empty COLMAP model file: {path}")
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_cameras(path: str) -> np.ndarray:
+    """Read ``cameras.bin`` into a ``CAMERA_DTYPE`` array."""
+    buffer = _map_file(path)
+    num_cameras = _UINT64.unpack_from(buffer, 0)[0]
+    cameras = np.zeros(num_cameras, CAMERA_DTYPE)
+    offset = 8
+    for i in range(num_cameras):
+        camera_id, model_id, width, height = struct.unpack_from("<iiQQ", buffer, offset)
+        offset += 24
+        if model_id not in CAMERA_MODELS:
+            raise ValueError(f"Unknown COLMAP camera model id {model_id} in {path}")
+        num_params = CAMERA_MODELS[model_id][1]
+        params = np.full(MAX_CAMERA_PARAMS, np.nan)
+        params[:num_params] = np.frombuffer(buffer, "<f8", num_params, offset)
+        cameras[i] = (camera_id, model_id, width, height, num_params, params)
+        offset += 8 * num_params
+    return cameras
+
+
+def read_images(path: str):
+    """
+    Read the image records of ``images.bin`` without their 2D observations.
+
+    Returns:
+        Tuple of (``IMAGE_DTYPE`` array, list of image names, the mapped file).
+        ``points2D_offset`` locates each image's observations in the mapped file.
+    """
+    buffer = _map_file(path)
+    num_images = _UINT64.unpack_from(buffer, 0)[0]
+    images = np.zeros(num_images, IMAGE_DTYPE)
+    names = []
+    offset = 8
+    for i in range(num_images):
+        image_id, qw, qx, qy, qz, tx, ty, tz, camera_id = _IMAGE_HEADER.unpack_from(buffer, offset)
+        offset += _IMAGE_HEADER.size
+        name_end = buffer.find(b"\0", offset)
+        names.append(buffer[offset:name_end].decode("utf-8"))
+        num_points2D = _UINT64.unpack_from(buffer, name_end + 1)[0]
+        offset = name_end + 9
+        images[i] = (image_id, (qw, qx, qy, qz), (tx, ty, tz), camera_id, num_points2D, offset)
+        offset += num_points2D * POINT2D_DTYPE.itemsize
+    return images, names, buffer
+
+
+def read_points3D(path: str):
+    """
+    Read the point records of ``points3D.bin`` without their tracks.
+
+    Records are variable-length, so their offsets are found with one pass
+    over the track lengths; the fields are then gathered in bulk.
+
+    Returns:
+        Tuple of (``POINT3D_DTYPE`` array, byte offsets of the tracks, the mapped file).
+    """
+    buffer = _map_file(path)
+    num_points = _UINT64.unpack_from(buffer, 0)[0]
+    offsets = np.empty(num_points, np.int64)
+    unpack_track_length = _UINT64.unpack_from
+    offset = 8
+    for i in range(num_points):
+        offsets[i] = offset
+        offset += POINT3D_DTYPE.itemsize + 8 * unpack_track_length(buffer, offset + _TRACK_LENGTH_OFFSET)[0]
+
+    return gather_records(buffer, POINT3D_DTYPE, offsets), offsets + POINT3D_DTYPE.itemsize, buffer
+
+
+def gather_records(buffer, dtype: np.dtype, offsets: np.ndarray) -> np.ndarray:
+    """
+    Gather fixed-size records at arbitrary byte offsets of a buffer.
+
+    Each offset's alignment relative to the record size selects a view of
+    the buffer in which the record is a whole element, so records are
+    copied without building a per-byte index.
+    """
+    records = np.empty(len(offsets), dtype)
+    size = dtype.itemsize
+    for shift in np.unique(offsets % size):
+        selected = offsets % size == shift
+        view = np.frombuffer(buffer, dtype, (len(buffer) - shift) // size, shift)
+        records[selected] = view[(offsets[selected] - shift) // size]
+    return records
+
+
+class ColmapModel:
+    """
+    A binary COLMAP sparse model, loaded on first access.
+
+    Args:
+        model_dir: Directory containing ``cameras.bin``, ``images.bin`` and ``points3D.bin``.
+    """
+
+    def __init__(self, model_dir: str):
+        self.model_dir = model_dir
+        self._cameras = None
+        self._images = None
+        self._points3D = None
+        self._tracks = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.model_dir, name)
+
+    @property
+    def cameras(self) -> np.ndarray:
+        """Cameras as a ``CAMERA_DTYPE`` array"""
+        if self._cameras is None:
+            self._cameras = read_cameras(self._path("cameras.bin"))
+        return self._cameras
+
+    def _load_images(self):
+        if self._images is None:
+            self._images = read_images(self._path("images.bin"))
+        return self._images
+
+    @property
+    def images(self) -> np.ndarray:
+        """Registered images as an ``IMAGE_DTYPE`` array"""
+        return self._load_images()[0]
+
+    @property
+    def image_names(self) -> Dict[int, str]:
+        """Image names keyed by image id"""
+        images, names, _ = self._load_images()
+        return dict(zip(images["image_id"].tolist(), names))
+
+    @property
+    def num_registered_images(self) -> int:
+        return len(self.images)
+
+    def points2D(self, image_id: int) -> np.ndarray:
+        """
+        The 2D observations of an image as a read-only ``POINT2D_DTYPE`` array.
+
+        The array maps ``images.bin`` directly; it is paged in as it is read.
+        ``point3D_id`` is -1 for keypoints without a 3D point.
+        """
+        images, _, buffer = self._load_images()
+        index = np.flatnonzero(images["image_id"] == image_id)
+        if len(index) == 0:
+            raise KeyError(f"Image {image_id} is not registered")
+        image = images[index[0]]
+        return np.frombuffer(buffer, POINT2D_DTYPE, int(image["num_points2D"]), int(image["points2D_offset"]))
+
+    def _load_points3D(self):
+        if self._points3D is None:
+            self._points3D = read_points3D(self._path("points3D.bin"))
+        return self._points3D
+
+    @property
+    def points3D(self) -> np.ndarray:
+        """3D points as a ``POINT3D_DTYPE`` array"""
+        return self._load_points3D()[0]
+
+    @property
+    def num_points3D(self) -> int:
+        return len(self.points3D)
+
+    @property
+    def tracks(self) -> np.ndarray:
+        """
+        Track elements of all points, concatenated in point order, as a ``TRACK_DTYPE`` array.
+
+        The elements of point ``i`` are ``tracks[track_starts[i]:track_starts[i] + track_length[i]]``.
+        """
+        if self._tracks is None:
+            points, track_offsets, buffer = self._load_points3D()
+            lengths = points["track_length"].astype(np.int64)
+            starts = np.cumsum(lengths) - lengths
+            element = np.arange(int(lengths.sum())) - np.repeat(starts, lengths)
+            offsets = np.repeat(track_offsets, lengths) + element * TRACK_DTYPE.itemsize
+            self._tracks = gather_records(buffer, TRACK_DTYPE, offsets)
+        return self._tracks
+
+    @property
+    def track_starts(self) -> np.ndarray:
+        lengths = self.points3D["track_length"].astype(np.int64)
+        return np.cumsum(lengths) - lengths
+
+    def track_length_histogram(self) -> np.ndarray:
+        """Number of points by track length: ``histogram[n]`` points are observed in n images."""
+        return np.bincount(self.points3D["track_length"].astype(np.int64))
+
+    def mean_reprojection_error(self) -> float:
+        """Mean reprojection error in pixels over all observations (NaN for an empty model)."""
+        points = self.points3D
+        weights = points["track_length"].astype(np.float64)
+        if weights.sum() == 0:
+            return float("nan")
+        return float(np.average(points["error"], weights=weights))
+
+    def observations_per_image(self) -> Dict[int, int]:
+        """Number of 3D point observations of each registered image, keyed by image id."""
+        counts = dict.fromkeys(self.images["image_id"].tolist(), 0)
+        image_ids, observations = np.unique(self.tracks["image_id"], return_counts=True)
+        counts.update(zip(image_ids.tolist(), observations.tolist()))
+        return counts
@@ -2,10 +2,26 @@
 
 import subprocess
 import shutil
+from collections import deque
 from pathlib import Path
-from typing import Optional, Callable
+from typing import Optional, Callable, List, Tuple
+import hashlib
+import json
 import logging
 import os
+import re
+import signal
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src import config
+from src.image_store import has_gps_tag
+from src.photogrammetry import colmap_model
+from src.instrumentation import Tracer, sample_tracked_processes, trace_stage, track_process
 # import tempfile <-- Remove tempfile
 
 # Configure logging
@@ -18,6 +34,992 @@ class COLMAPError(Exception):
     pass
 
 
+class COLMAPCancelled(COLMAPError):
+    """Raised when a COLMAP run is cancelled."""
+    pass
+
+
+class COLMAPTimeout(COLMAPError):
+    """Raised when a COLMAP stage exceeds its time limit."""
+    pass
+
+
+# Name of the directory (next to the database) holding stage completion markers
+CHECKPOINT_DIR_NAME = ".colmap_stages"
+
+# Database tables written by each stage, cleared before the stage is re-run
+STAGE_TABLES = {
+    "feature_extraction": ["cameras", "images", "keypoints", "descriptors", "matches", "two_view_geometries"],
+    "feature_matching": ["matches", "two_view_geometries"],
+}
+
+
+def _fingerprint(*parts) -> str:
+    """Hashes JSON-serializable parts into a stage fingerprint."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _image_dir_state(image_dir: str) -> list:
+    """Returns (name, size, mtime) for every file in the image directory."""
+    state = []
+    if os.path.isdir(image_dir):
+        for entry in sorted(os.scandir(image_dir), key=lambda e: e.name):
+            if entry.is_file():
+                stat = entry.stat()
+                state.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return state
+
+
+def _read_checkpoint(checkpoint_dir: str, stage: str) -> Optional[dict]:
+    """Reads the completion marker of a stage, if any."""
+    marker_path = os.path.join(checkpoint_dir, f"{stage}.json")
+    try:
+        with open(marker_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_checkpoint(checkpoint_dir: str, stage: str, fingerprint: str, command: Optional[List[str]] = None) -> None:
+    """Records that a stage completed for the given input fingerprint."""
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    marker_path = os.path.join(checkpoint_dir, f"{stage}.json")
+    temp_path = marker_path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump({"stage": stage, "fingerprint": fingerprint, "command": command,
+                   "completed_at": time.time()}, f)
+    os.replace(temp_path, marker_path)
+
+
+def _clear_checkpoint(checkpoint_dir: str, stage: str) -> None:
+    """Removes the completion marker of a stage."""
+    marker_path = os.path.join(checkpoint_dir, f"{stage}.json")
+    if os.path.exists(marker_path):
+        os.remove(marker_path)
+
+
+def _reset_database_tables(database_path: str, tables: list) -> None:
+    """Deletes the rows a stage wrote so COLMAP does not reuse stale results."""
+    if not os.path.exists(database_path):
+        return
+    with sqlite3.connect(database_path) as conn:
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        for table in tables:
+            if table in existing:
+                conn.execute(f"DELETE FROM {table}")
+
+
+# Frame names written by the video extractor and keyframe selector
+VIDEO_FRAME_PATTERN = re.compile(r"^frame_\d{6}\.\w+$")
+
+# Matching strategies that can be requested explicitly
+MATCHERS = ("auto", "exhaustive", "sequential", "spatial", "vocab_tree")
+
+
+def list_image_names(image_dir: str) -> List[str]:
+    """Returns the names of the input images in a directory, sorted."""
+    if not os.path.isdir(image_dir):
+        return []
+    return sorted(
+        entry.name for entry in os.scandir(image_dir)
+        if entry.is_file() and os.path.splitext(entry.name)[1].lower() in config.IMAGE_EXTENSIONS
+    )
+
+
+def infer_image_provenance(image_dir: str, image_names: Optional[List[str]] = None, gps_sample_size: int = 10) -> str:
+    """
+    Guesses where a set of images came from, to choose a matching strategy.
+
+    Args:
+        image_dir: Path to the directory containing the images.
+        image_names: Image names in the directory, if already listed.
+        gps_sample_size: Number of images checked for EXIF GPS tags.
+
+    Returns:
+        "video" if every image is an extracted video frame, "gps" if the
+        sampled images all carry GPS coordinates, otherwise "unordered".
+    """
+    if image_names is None:
+        image_names = list_image_names(image_dir)
+    if not image_names:
+        return "unordered"
+    if all(VIDEO_FRAME_PATTERN.match(name) for name in image_names):
+        return "video"
+    step = max(1, len(image_names) // gps_sample_size)
+    sample = image_names[::step][:gps_sample_size]
+    if all(has_gps_tag(os.path.join(image_dir, name)) for name in sample):
+        return "gps"
+    return "unordered"
+
+
+def plan_matching(
+    num_images: int,
+    provenance: str = "unordered",
+    vocab_tree_path: Optional[str] = None,
+    matcher: str = "auto",
+) -> Tuple[str, List[str], str]:
+    """
+    Chooses the COLMAP matcher for an image set.
+
+    Video frames are matched sequentially against their neighbours (with
+    loop detection when a vocabulary tree is available).  Small sets are
+    matched exhaustively.  Larger sets use spatial matching when the images
+    are geotagged, or vocabulary tree matching when a tree is available.
+
+    Args:
+        num_images: Number of images to match.
+        provenance: Image provenance from ``infer_image_provenance``.
+        vocab_tree_path: Path to the vocabulary tree file, if available.
+        matcher: One of ``MATCHERS``; "auto" plans from the image count and provenance.
+
+    Returns:
+        Tuple of (COLMAP matcher command, matcher arguments, human-readable reason).
+    """
+    if matcher not in MATCHERS:
+        raise ValueError(f"Unsupported matcher: {matcher}")
+
+    if matcher == "auto":
+        if provenance == "video":
+            matcher = "sequential"
+        elif num_images <= config.EXHAUSTIVE_MATCHING_MAX_IMAGES:
+            matcher = "exhaustive"
+        elif provenance == "gps":
+            matcher = "spatial"
+        elif vocab_tree_path:
+            matcher = "vocab_tree"
+        else:
+            logging.warning(f"Matching {num_images} unordered images exhaustively; "
+                            "configure a vocabulary tree to match large sets faster.")
+            matcher = "exhaustive"
+
+    if matcher == "sequential":
+        args = ["--SequentialMatching.overlap", str(config.SEQUENTIAL_MATCHING_OVERLAP)]
+        if vocab_tree_path:
+            args += ["--SequentialMatching.loop_detection", "1",
+                     "--SequentialMatching.vocab_tree_path", str(vocab_tree_path)]
+        return "sequential_matcher", args, f"sequential matching of {num_images} {provenance} images"
+    if matcher == "spatial":
+        return "spatial_matcher", [], f"spatial matching of {num_images} geotagged images"
+    if matcher == "vocab_tree":
+        if not vocab_tree_path:
+            raise ValueError("Vocabulary tree matching requires vocab_tree_path")
+        return "vocab_tree_matcher", ["--VocabTreeMatching.vocab_tree_path", str(vocab_tree_path)], \
+            f"vocabulary tree matching of {num_images} images"
+    return "exhaustive_matcher", [], f"exhaustive matching of {num_images} images"
+
+
+def _build_stages(
+    image_dir: str,
+    database_path: str,
+    sparse_dir: str,
+    feature_type: str,
+    vocab_tree_path: Optional[str],
+    camera_model: str,
+    mapper_args: Optional[List[str]],
+    matcher: str = "auto",
+    provenance: Optional[str] = None,
+    max_image_size: Optional[int] = None,
+) -> list:
+    """
+    Builds the COLMAP pipeline stages.
+
+    Returns:
+        A list of (stage key, name, command, progress weight, outputs that must exist to skip) tuples.
+    """
+    # Feature extraction settings
+    feature_config = {
+        "sift": [],
+        "orb": ["--SiftExtraction.use_gpu", "0",  # Disable GPU for more consistent operation
+                "--SiftExtraction.num_octaves", "3",
+                "--SiftExtraction.first_octave", "0",
+                "--SiftExtraction.peak_threshold", "0.01",
+                "--SiftExtraction.edge_threshold", "10"]
+    }
+
+    feature_extractor_args = ["--ImageReader.camera_model", camera_model] + feature_config.get(feature_type, [])
+    if max_image_size:
+        feature_extractor_args += ["--SiftExtraction.max_image_size", str(max_image_size)]
+
+    if feature_type not in feature_config:
+        raise ValueError(f"Unsupported feature type: {feature_type}")
+
+    # Feature matching settings
+    image_names = list_image_names(image_dir)
+    if provenance is None:
+        provenance = infer_image_provenance(image_dir, image_names)
+    matcher_command, feature_matcher_args, matching_plan = plan_matching(
+        len(image_names), provenance, vocab_tree_path, matcher)
+    logging.info(f"Matching plan: {matching_plan}")
+
+    model_dir = os.path.join(sparse_dir, "0")
+    ply_path = os.path.join(sparse_dir, "model.ply")
+
+    return [
+        (
+            "feature_extraction",
+            "Feature extraction",
+            [
+                "colmap",
+                "feature_extractor",
+                "--database_path",
+                database_path,
+                "--image_path",
+                image_dir,
+                *feature_extractor_args
+            ],
+            10, # Progress weight
+            [database_path],
+        ),
+        (
+            "feature_matching",
+            f"Feature matching ({matching_plan})",
+            [
+                "colmap",
+                matcher_command,
+                "--database_path",
+                database_path,
+                *feature_matcher_args
+            ],
+            30, # Progress weight
+            [database_path],
+        ),
+        (
+            "mapping",
+            "Map creation",
+            [
+                "colmap",
+                "mapper",
+                "--database_path",
+                database_path,
+                "--image_path",
+                image_dir,
+                "--output_path",
+                sparse_dir,
+                *(mapper_args or [])
+            ],
+            50, # Progress weight
+            [model_dir],
+        ),
+        (
+            "model_conversion",
+            "Model to ply",
+            [
+                "colmap",
+                "model_converter",
+                "--input_path",
+                model_dir,
+                "--output_path",
+                ply_path,
+                "--output_type",
+                "PLY"
+            ],
+            10, # Progress weight
+            [ply_path],
+        ),
+    ]
+
+
+DENSE_METHODS = ("auto", "patch_match", "delaunay")
+
+# Name of the dense workspace directory, next to the sparse directory
+DENSE_DIR_NAME = "dense"
+
+
+def dense_mesh_path(sparse_dir: str) -> str:
+    """Returns the path of the mesh the dense stages write for a sparse directory."""
+    return os.path.join(os.path.dirname(os.path.abspath(sparse_dir)), DENSE_DIR_NAME, "meshed.ply")
+
+
+def resolve_dense_method(method: str = "auto") -> str:
+    """Resolves "auto" to "patch_match" if an NVIDIA GPU is present and "delaunay" otherwise."""
+    if method not in DENSE_METHODS:
+        raise ValueError(f"Unsupported dense method: {method}")
+    if method == "auto":
+        return "patch_match" if shutil.which("nvidia-smi") else "delaunay"
+    return method
+
+
+def _build_dense_stages(
+    image_dir: str,
+    sparse_dir: str,
+    method: str = "auto",
+    max_image_size: Optional[int] = config.DENSE_MAX_IMAGE_SIZE,
+) -> list:
+    """
+    Builds the dense reconstruction and meshing stages that follow the sparse model.
+
+    With "patch_match", depth maps are computed for every undistorted image
+    and fused into a dense cloud, which is meshed with Poisson surface
+    reconstruction.  patch_match_stereo needs CUDA; "delaunay" instead meshes
+    the sparse points of the undistorted model on the CPU, which is coarser
+    but finishes in seconds to minutes.
+
+    Returns:
+        Stages in the format of ``_build_stages``.
+    """
+    dense_dir = os.path.dirname(dense_mesh_path(sparse_dir))
+    mesh_path = dense_mesh_path(sparse_dir)
+    size_args = ["--max_image_size", str(max_image_size)] if max_image_size else []
+
+    stages = [
+        (
+            "undistortion",
+            "Image undistortion",
+            [
+                "colmap",
+                "image_undistorter",
+                "--image_path",
+                image_dir,
+                "--input_path",
+                os.path.join(sparse_dir, "0"),
+                "--output_path",
+                dense_dir,
+                "--output_type",
+                "COLMAP",
+                *size_args
+            ],
+            5, # Progress weight
+            [os.path.join(dense_dir, "sparse")],
+        ),
+    ]
+    if resolve_dense_method(method) == "delaunay":
+        return stages + [
+            (
+                "delaunay_meshing",
+                "Delaunay meshing",
+                [
+                    "colmap",
+                    "delaunay_mesher",
+                    "--input_path",
+                    dense_dir,
+                    "--input_type",
+                    "sparse",
+                    "--output_path",
+                    mesh_path
+                ],
+                15, # Progress weight
+                [mesh_path],
+            ),
+        ]
+
+    fused_path = os.path.join(dense_dir, "fused.ply")
+    return stages + [
+        (
+            "dense_stereo",
+            "Patch match stereo",
+            [
+                "colmap",
+                "patch_match_stereo",
+                "--workspace_path",
+                dense_dir,
+                "--workspace_format",
+                "COLMAP",
+                "--PatchMatchStereo.geom_consistency",
+                "true",
+                *(["--PatchMatchStereo.max_image_size", str(max_image_size)] if max_image_size else [])
+            ],
+            60, # Progress weight
+            [os.path.join(dense_dir, "stereo", "depth_maps")],
+        ),
+        (
+            "stereo_fusion",
+            "Stereo fusion",
+            [
+                "colmap",
+                "stereo_fusion",
+                "--workspace_path",
+                dense_dir,
+                "--workspace_format",
+                "COLMAP",
+                "--input_type",
+                "geometric",
+                "--output_path",
+                fused_path
+            ],
+            20, # Progress weight
+            [fused_path],
+        ),
+        (
+            "poisson_meshing",
+            "Poisson meshing",
+            [
+                "colmap",
+                "poisson_mesher",
+                "--input_path",
+                fused_path,
+                "--output_path",
+                mesh_path
+            ],
+            15, # Progress weight
+            [mesh_path],
+        ),
+    ]
+
+
+def _normalize_weights(stages: list) -> list:
+    """Scales stage progress weights to sum to 100."""
+    total = sum(weight for _, _, _, weight, _ in stages)
+    return [(stage, name, command, weight * 100 / total, outputs) for stage, name, command, weight, outputs in stages]
+
+
+# Thread count option of each stage; not part of the stage fingerprint, since it does not change results
+THREAD_OPTIONS = {
+    "feature_extraction": "--SiftExtraction.num_threads",
+    "feature_matching": "--SiftMatching.num_threads",
+    "mapping": "--Mapper.num_threads",
+    "stereo_fusion": "--StereoFusion.num_threads",
+    "poisson_meshing": "--PoissonMeshing.num_threads",
+    "delaunay_meshing": "--DelaunayMeshing.num_threads",
+}
+
+
+def _with_threads(stage: str, command: List[str], num_threads: Optional[int]) -> List[str]:
+    """Appends the thread count option of a stage to its command, if a thread count is set."""
+    if num_threads is None or stage not in THREAD_OPTIONS:
+        return command
+    return command + [THREAD_OPTIONS[stage], str(num_threads)]
+
+
+def _stage_fingerprints(image_dir: str, stages: list, stage_options: Optional[dict] = None) -> List[str]:
+    """
+    Chains the fingerprint of each stage from its command and the upstream stage.
+
+    ``stage_options`` holds settings, keyed by stage, that change a stage's
+    result without appearing in its command (e.g. merging sparse models).
+    """
+    fingerprints = []
+    upstream_fingerprint = _fingerprint(_image_dir_state(image_dir))
+    for stage, _, command, _, _ in stages:
+        extra = (stage_options[stage],) if stage_options and stage_options.get(stage) else ()
+        upstream_fingerprint = _fingerprint(command, upstream_fingerprint, *extra)
+        fingerprints.append(upstream_fingerprint)
+    return fingerprints
+
+
+def list_sparse_models(sparse_dir: str) -> List[str]:
+    """Returns the numbered model directories the mapper wrote into ``sparse_dir``, in numeric order."""
+    if not os.path.isdir(sparse_dir):
+        return []
+    entries = sorted((entry for entry in os.listdir(sparse_dir) if entry.isdigit()), key=int)
+    return [os.path.join(sparse_dir, entry) for entry in entries
+            if os.path.isfile(os.path.join(sparse_dir, entry, "images.bin"))]
+
+
+def inspect_model(model_dir: str) -> dict:
+    """
+    Summarizes a sparse model for ranking.
+
+    Returns:
+        A dictionary with the model "path", its "registered_images", its number of "points" and
+        the set of registered "image_names".
+    """
+    model = colmap_model.ColmapModel(model_dir)
+    image_names = set(model.image_names.values())
+    return {
+        "path": model_dir,
+        "registered_images": len(image_names),
+        "points": colmap_model.count_records(os.path.join(model_dir, "points3D.bin")),
+        "image_names": image_names,
+    }
+
+
+def rank_models(models: List[dict]) -> List[dict]:
+    """Orders model summaries best first: by registered images, then by points."""
+    return sorted(models, key=lambda model: (model["registered_images"], model["points"]), reverse=True)
+
+
+def _merge_models(
+    ranked: List[dict],
+    work_dir: str,
+    cancel_event: Optional[threading.Event] = None,
+    timeout: Optional[float] = None,
+    runner=None,
+) -> Optional[dict]:
+    """
+    Merges models that share images into the best one with ``model_merger``, run by ``runner``.
+
+    Returns:
+        The summary of the merged model, or None if no model overlapped the best one
+        or merging did not register more images.
+    """
+    if runner is None:
+        from src.photogrammetry.engines import CLIEngine
+        runner = CLIEngine()
+    merged = ranked[0]
+    for step, other in enumerate(ranked[1:]):
+        shared = len(merged["image_names"] & other["image_names"])
+        if shared < config.MODEL_MERGE_MIN_SHARED_IMAGES:
+            logging.info(f"Not merging {other['path']}: {shared} images shared with the best model")
+            continue
+        output_dir = os.path.join(work_dir, f"merged_{step}")
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir)
+        try:
+            runner.run("model_merging", f"Merging {os.path.basename(other['path'])} into the best model", [
+                "colmap",
+                "model_merger",
+                "--input_path1",
+                merged["path"],
+                "--input_path2",
+                other["path"],
+                "--output_path",
+                output_dir,
+            ], cancel_event=cancel_event, timeout=timeout)
+            candidate = inspect_model(output_dir)
+        except (COLMAPCancelled, COLMAPTimeout):
+            raise
+        except (COLMAPError, OSError, ValueError) as e:
+            # Models may overlap without a consistent similarity transform; keep the unmerged model
+            logging.warning(f"Merging {other['path']} failed: {e}")
+            continue
+        if candidate["registered_images"] > merged["registered_images"]:
+            merged = candidate
+    return merged if merged is not ranked[0] else None
+
+
+def select_sparse_model(
+    sparse_dir: str,
+    merge: bool = False,
+    cancel_event: Optional[threading.Event] = None,
+    timeout: Optional[float] = None,
+    runner=None,
+) -> List[dict]:
+    """
+    Moves the best sparse model to ``sparse_dir/0``, where export and incremental runs read it.
+
+    When the scene splits into several components, the mapper numbers them
+    in the order it built them, so ``0`` is not necessarily the largest.
+    All models are inspected in parallel and ranked by registered images and
+    points.  With ``merge`` enabled, models sharing images with the best one
+    are merged into it first, and the merged model is used if it registers
+    more images.  The remaining models are renumbered 1..N in rank order.
+    ``runner`` is the engine running ``model_merger``; the CLI engine if None.
+
+    Returns:
+        The model summaries in their new order (without image names), best first.
+    """
+    model_dirs = list_sparse_models(sparse_dir)
+    if len(model_dirs) < 2:
+        return [{key: value for key, value in inspect_model(path).items() if key != "image_names"}
+                for path in model_dirs]
+
+    with ThreadPoolExecutor(max_workers=min(len(model_dirs), os.cpu_count() or 1)) as executor:
+        ranked = rank_models(list(executor.map(inspect_model, model_dirs)))
+    logging.info("Sparse models: " + ", ".join(
+        f"{os.path.basename(m['path'])} ({m['registered_images']} images, {m['points']} points)" for m in ranked))
+
+    merge_dir = os.path.join(sparse_dir, ".merge")
+    if merge:
+        merged = _merge_models(ranked, merge_dir, cancel_event, timeout, runner)
+        if merged is not None:
+            logging.info(f"Merged model registers {merged['registered_images']} images")
+            ranked = [merged] + ranked
+
+    # Rename through temporary names, since the new numbers overlap the old ones
+    staged = []
+    for index, model in enumerate(ranked):
+        staging_path = os.path.join(sparse_dir, f".model_{index}")
+        os.replace(model["path"], staging_path)
+        staged.append(staging_path)
+    for index, (model, staging_path) in enumerate(zip(ranked, staged)):
+        model["path"] = os.path.join(sparse_dir, str(index))
+        os.replace(staging_path, model["path"])
+    shutil.rmtree(merge_dir, ignore_errors=True)
+    return [{key: value for key, value in model.items() if key != "image_names"} for model in ranked]
+
+
+# COLMAP log lines that report progress within a stage
+_PROCESSED_FILE = re.compile(r"Processed file \[(\d+)/(\d+)\]")
+_MATCHING_BLOCK_2D = re.compile(r"Matching block \[(\d+)/(\d+), (\d+)/(\d+)\]")
+_MATCHING_ITEM = re.compile(r"(?:Matching|Processing) (image|block) \[(\d+)/(\d+)\]")
+_REGISTERING_IMAGE = re.compile(r"Registering image #(\d+) \((\d+)\)")
+_STEREO_VIEW = re.compile(r"Processing view (\d+) / (\d+)")
+_FUSING_IMAGE = re.compile(r"Fusing image \[(\d+)/(\d+)\]")
+
+# Number of COLMAP output lines kept for error messages
+OUTPUT_TAIL_LINES = 50
+
+# Minimum change in stage progress (0-1) between progress reports
+PROGRESS_REPORT_STEP = 0.01
+
+
+def parse_progress_line(line: str, num_images: Optional[int] = None) -> Optional[Tuple[float, str]]:
+    """
+    Parses a COLMAP log line for progress within the running stage.
+
+    Args:
+        line: A line of COLMAP output.
+        num_images: Total number of images, used to turn mapper registrations into a fraction.
+
+    Returns:
+        Tuple of (fraction of the stage completed, description), or None if the line reports no progress.
+    """
+    match = _PROCESSED_FILE.search(line)
+    if match:
+        done, total = int(match.group(1)), int(match.group(2))
+        return done / total if total else 0.0, f"extracted features for image {done}/{total}"
+
+    match = _MATCHING_BLOCK_2D.search(line)
+    if match:
+        row, rows, col, cols = (int(g) for g in match.groups())
+        total = rows * cols
+        done = (row - 1) * cols + col
+        return done / total if total else 0.0, f"matched block {done}/{total}"
+
+    match = _MATCHING_ITEM.search(line)
+    if match:
+        kind, done, total = match.group(1), int(match.group(2)), int(match.group(3))
+        return done / total if total else 0.0, f"matched {kind} {done}/{total}"
+
+    match = _STEREO_VIEW.search(line)
+    if match:
+        done, total = int(match.group(1)), int(match.group(2))
+        return done / total if total else 0.0, f"computed depth map {done}/{total}"
+
+    match = _FUSING_IMAGE.search(line)
+    if match:
+        done, total = int(match.group(1)), int(match.group(2))
+        return done / total if total else 0.0, f"fused image {done}/{total}"
+
+    match = _REGISTERING_IMAGE.search(line)
+    if match:
+        registered = int(match.group(2))
+        if num_images:
+            return min(1.0, registered / num_images), f"registered {registered}/{num_images} images"
+        return None
+
+    return None
+
+
+def _format_eta(seconds: float) -> str:
+    """Formats a duration as e.g. "1h02m", "3m05s" or "12s"."""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+def _terminate_process_group(process: subprocess.Popen) -> None:
+    """Terminates a COLMAP process and any children, killing them if they ignore SIGTERM."""
+    if process.poll() is not None:
+        return
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, signal.SIGTERM)
+        else:
+            process.terminate()
+        try:
+            process.wait(timeout=config.COLMAP_TERMINATE_GRACE_PERIOD)
+        except subprocess.TimeoutExpired:
+            if os.name == "posix":
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+    except ProcessLookupError:
+        pass  # Already exited
+
+
+def _watch_process(
+    process: subprocess.Popen,
+    stopped: threading.Event,
+    cancel_event: Optional[threading.Event],
+    timeout: Optional[float],
+    reason: list,
+) -> None:
+    """Terminates the process when the run is cancelled or the stage times out."""
+    deadline = time.monotonic() + timeout if timeout else None
+    while not stopped.is_set():
+        if cancel_event is not None and cancel_event.is_set():
+            reason.append("cancelled")
+        elif deadline is not None and time.monotonic() >= deadline:
+            reason.append("timeout")
+        if reason:
+            _terminate_process_group(process)
+            return
+        stopped.wait(0.2)
+
+
+def _wait_unreaped(process: subprocess.Popen) -> None:
+    """Blocks until the process exits without reaping it, so its final CPU times can still be read."""
+    if not hasattr(os, "waitid"):
+        return
+    try:
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+    except ChildProcessError:
+        pass  # Already reaped, e.g. by a cancellation
+
+
+def _run_command(
+    name: str,
+    command: List[str],
+    on_progress: Optional[Callable[[float, str], None]] = None,
+    num_images: Optional[int] = None,
+    cancel_event: Optional[threading.Event] = None,
+    timeout: Optional[float] = None,
+) -> None:
+    """
+    Runs a single COLMAP command, streaming its output line by line.
+
+    Output is logged as it arrives and only the last ``OUTPUT_TAIL_LINES``
+    lines are kept in memory for error reporting.  The command runs in its
+    own process group, which is terminated when ``cancel_event`` is set or
+    the command runs longer than ``timeout`` seconds.
+
+    Args:
+        name: Human-readable stage name.
+        command: The command line to run.
+        on_progress: Optional callback receiving the fraction of the stage completed (0-1) and a description
+            including an ETA.
+        num_images: Total number of images, used to report mapper progress.
+        cancel_event: Optional event that cancels the command when set.
+        timeout: Optional time limit in seconds.
+
+    Raises:
+        COLMAPCancelled: If the command was cancelled.
+        COLMAPTimeout: If the command exceeded its time limit.
+        COLMAPError: If the command fails.
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        raise COLMAPCancelled(f"COLMAP command '{name}' was cancelled")
+
+    logging.info(f"Running COLMAP command: {name}")
+    logging.info(f"Command: {' '.join(command)}")  # Log the full command
+
+    tail: deque = deque(maxlen=OUTPUT_TAIL_LINES)
+    started_at = time.monotonic()
+    last_reported = 0.0
+
+    try:
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,  # COLMAP logs progress to stderr
+            text=True,
+            bufsize=1,
+            start_new_session=os.name == "posix",  # Own process group, so children are terminated too
+        )
+    except OSError as e:
+        raise COLMAPError(f"COLMAP command '{name}' could not be started: {e}") from e
+    # Measured by the stage traced on this thread, if any, rather than by process-wide usage
+    tracked = track_process(process.pid)
+
+    stopped = threading.Event()
+    reason: list = []
+    watcher = None
+    if cancel_event is not None or timeout:
+        watcher = threading.Thread(target=_watch_process, args=(process, stopped, cancel_event, timeout, reason),
+                                   daemon=True, name=f"colmap-watch-{process.pid}")
+        watcher.start()
+
+    with process:
+        for line in process.stdout:
+            line = line.rstrip()
+            tail.append(line)
+            logging.debug(line)
+
+            if on_progress is None:
+                continue
+            progress = parse_progress_line(line, num_images)
+            if progress is None:
+                continue
+            fraction, detail = progress
+            if fraction - last_reported < PROGRESS_REPORT_STEP and fraction < 1.0:
+                continue
+            last_reported = fraction
+            elapsed = time.monotonic() - started_at
+            if 0 < fraction < 1:
+                detail += f", ETA {_format_eta(elapsed / fraction * (1 - fraction))}"
+            on_progress(fraction, detail)
+
+        if tracked:
+            _wait_unreaped(process)
+            sample_tracked_processes()
+        returncode = process.wait()
+
+    stopped.set()
+    if watcher is not None:
+        watcher.join()
+    if "cancelled" in reason:
+        raise COLMAPCancelled(f"COLMAP command '{name}' was cancelled")
+    if "timeout" in reason:
+        raise COLMAPTimeout(f"COLMAP command '{name}' exceeded its time limit of {timeout:g}s")
+
+    if returncode != 0:
+        output = "\n".join(tail)
+        logging.error(output)  # Log the end of the output
+        raise COLMAPError(
+            f"COLMAP command '{name}' failed with return code {returncode}: {output}")
+
+
+def get_database_image_names(database_path: str) -> List[str]:
+    """
+    Gets the names of the images that have been imported into a COLMAP database.
+
+    Args:
+        database_path: Path to the COLMAP database.
+
+    Returns:
+        Image names relative to the image directory, or an empty list if the database has none.
+    """
+    if not os.path.exists(database_path):
+        return []
+    try:
+        with sqlite3.connect(database_path) as conn:
+            return [row[0] for row in conn.execute("SELECT name FROM images ORDER BY image_id")]
+    except sqlite3.Error:
+        return []
+
+
+def _plan_incremental(image_dir: str, database_path: str, sparse_dir: str, stages: list) -> Optional[List[str]]:
+    """
+    Decides whether a run can extend the previous reconstruction.
+
+    Returns:
+        The names of the images to add, or None if a full run is required (no
+        previous model, changed extraction options or removed images).
+    """
+    checkpoint_dir = os.path.join(os.path.dirname(os.path.abspath(database_path)), CHECKPOINT_DIR_NAME)
+    checkpoints = [_read_checkpoint(checkpoint_dir, stage) for stage, _, _, _, _ in stages]
+    if not all(checkpoints) or not os.path.isdir(os.path.join(sparse_dir, "0")):
+        return None
+
+    # Features already in the database must have been extracted with the same settings
+    extraction_command = stages[0][2]
+    if checkpoints[0].get("command") != extraction_command:
+        return None
+
+    existing = set(get_database_image_names(database_path))
+    if not existing:
+        return None
+    current = set(list_image_names(image_dir))
+    if existing - current:
+        return None  # Images were removed; the model has to be rebuilt
+    return sorted(current - existing)
+
+
+def _stage_progress(
+    progress_callback: Optional[Callable[[float, str], None]],
+    name: str,
+    completed_weight: float,
+    weight: float,
+) -> Optional[Callable[[float, str], None]]:
+    """Maps progress within a stage onto the overall 0-100 progress scale."""
+    if progress_callback is None:
+        return None
+
+    def on_progress(fraction: float, detail: str) -> None:
+        progress_callback(completed_weight + weight * fraction, f"{name}: {detail}")
+
+    return on_progress
+
+
+def _run_incremental(
+    image_dir: str,
+    database_path: str,
+    sparse_dir: str,
+    stages: list,
+    new_images: List[str],
+    mapper_args: Optional[List[str]],
+    progress_callback: Optional[Callable[[float, str], None]],
+    cancel_event: Optional[threading.Event] = None,
+    stage_timeouts: Optional[dict] = None,
+    num_threads: Optional[int] = None,
+    tracer: Optional[Tracer] = None,
+    stage_options: Optional[dict] = None,
+    runner=None,
+) -> None:
+    """Extracts and matches features for new images only and extends the existing model."""
+    if runner is None:
+        from src.photogrammetry.engines import CLIEngine
+        runner = CLIEngine()
+    work_dir = os.path.dirname(os.path.abspath(database_path))
+    checkpoint_dir = os.path.join(work_dir, CHECKPOINT_DIR_NAME)
+    model_dir = os.path.join(sparse_dir, "0")
+    existing = get_database_image_names(database_path)
+
+    image_list_path = os.path.join(work_dir, "new_images.txt")
+    with open(image_list_path, "w") as f:
+        f.write("\n".join(new_images) + "\n")
+
+    # Match new images against every image, including each other
+    match_list_path = os.path.join(work_dir, "new_pairs.txt")
+    with open(match_list_path, "w") as f:
+        for i, new_image in enumerate(new_images):
+            for other in existing + new_images[i + 1:]:
+                f.write(f"{new_image} {other}\n")
+
+    extraction_command = stages[0][2] + ["--image_list_path", image_list_path]
+    incremental_commands = [
+        ("feature_extraction", f"Feature extraction ({len(new_images)} new images)", extraction_command, 10),
+        (
+            "feature_matching",
+            "Matching new images",
+            [
+                "colmap",
+                "matches_importer",
+                "--database_path",
+                database_path,
+                "--match_list_path",
+                match_list_path,
+                "--match_type",
+                "pairs",
+            ],
+            30,
+        ),
+        (
+            "mapping",
+            "Extending map",
+            [
+                "colmap",
+                "mapper",
+                "--database_path",
+                database_path,
+                "--image_path",
+                image_dir,
+                "--input_path",
+                model_dir,
+                "--output_path",
+                model_dir,
+                *(mapper_args or [])
+            ],
+            50,
+        ),
+        ("model_conversion", "Model to ply", stages[3][2], 10),
+        # Dense stages, if enabled, are redone in full for the extended model
+        *((stage, name, command, weight) for stage, name, command, weight, _ in stages[4:]),
+    ]
+    total_weight = sum(weight for _, _, _, weight in incremental_commands)
+    incremental_commands = [(stage, name, command, weight * 100 / total_weight)
+                            for stage, name, command, weight in incremental_commands]
+
+    # Markers are rewritten once the extended model is complete
+    for stage, _, _, _, _ in stages:
+        _clear_checkpoint(checkpoint_dir, stage)
+
+    completed_weight = 0
+    num_images = len(list_image_names(image_dir))
+    stage_outputs = {stage: outputs for stage, _, _, _, outputs in stages}
+    for stage, name, command, weight in incremental_commands:
+        if progress_callback:
+            progress_callback(completed_weight, f"Running {name}...")
+        if stage == "undistortion":
+            shutil.rmtree(os.path.dirname(dense_mesh_path(sparse_dir)), ignore_errors=True)
+        with trace_stage(tracer, stage, stage_outputs.get(stage, ()), command=command[1], engine=runner.name,
+                         num_images=num_images, new_images=len(new_images), incremental=True):
+            runner.run(stage, name, _with_threads(stage, command, num_threads),
+                       _stage_progress(progress_callback, name, completed_weight, weight), num_images,
+                       cancel_event, (stage_timeouts or {}).get(stage))
+        completed_weight += weight
+        if progress_callback:
+            progress_callback(completed_weight, f"Completed {name}.")
+
+    # The database and model now match what a full run would produce for these inputs
+    for (stage, _, command, _, _), fingerprint in zip(stages, _stage_fingerprints(image_dir, stages, stage_options)):
+        _write_checkpoint(checkpoint_dir, stage, fingerprint, command)
+
+
 def run_colmap(
     image_dir: str,
     database_path: str,
@@ -26,10 +1028,43 @@ def run_colmap(
     vocab_tree_path: Optional[str] = None,
     camera_model: str = "SIMPLE_RADIAL",
     progress_callback: Optional[Callable[[float, str], None]] = None,
+    mapper_args: Optional[List[str]] = None,
+    resume: bool = True,
+    incremental: bool = False,
+    matcher: str = "auto",
+    provenance: Optional[str] = None,
+    cancel_event: Optional[threading.Event] = None,
+    stage_timeouts: Optional[dict] = None,
+    num_threads: Optional[int] = None,
+    tracer: Optional[Tracer] = None,
+    merge_models: bool = False,
+    dense: bool = False,
+    dense_method: str = config.DENSE_METHOD,
+    dense_max_image_size: Optional[int] = config.DENSE_MAX_IMAGE_SIZE,
+    engine: Optional[str] = None,
+    max_image_size: Optional[int] = None,
 ) -> None:
     """
     Runs the COLMAP pipeline.
 
+    Each stage records a completion marker with a fingerprint of its inputs
+    (the command line, the upstream stage and, for feature extraction, the
+    image files).  With ``resume`` enabled, a stage whose fingerprint is
+    unchanged and whose outputs still exist is skipped, so a retried or
+    re-parameterized run only repeats the stages that are affected.
+
+    With ``incremental`` enabled and a completed previous run in the same
+    workspace, images added since then are processed on their own: features
+    are extracted for the new images only, they are matched against all
+    images, and the mapper continues from the existing sparse model.
+
+    When the mapper splits the scene into several models, the best one (see
+    ``select_sparse_model``) is moved to ``sparse_dir/0`` and exported.
+
+    With ``dense`` enabled, the sparse model is followed by dense
+    reconstruction and surface meshing (see ``_build_dense_stages``), which
+    write a mesh to ``dense_mesh_path(sparse_dir)``.
+
     Args:
         image_dir: Path to the directory containing the images.
         database_path: Path to the COLMAP database.
@@ -38,145 +1073,127 @@ def run_colmap(
         vocab_tree_path: Path to the vocabulary tree file (required for vocab_tree matching).
         camera_model: Camera model to use (e.g., "perspective", "radial").
         progress_callback: Optional callback function to report progress.  Takes a float (0-100) and a message string.
+        mapper_args: Extra command line options for the mapper (e.g. ["--Mapper.min_num_matches", "30"]).
+        resume: Skip stages whose inputs are unchanged since they last completed.
+        incremental: Extend the previous reconstruction with newly added images.
+        matcher: Matching strategy, one of ``MATCHERS``.  "auto" picks one from the image count and provenance.
+        provenance: "video", "gps" or "unordered"; inferred from the images if None.
+        cancel_event: Optional event; setting it terminates the running COLMAP process group.
+        stage_timeouts: Time limits in seconds keyed by stage (e.g. {"mapping": 3600}).  Defaults to
+            ``config.COLMAP_STAGE_TIMEOUTS``.
+        num_threads: Threads for feature extraction, matching and mapping.  COLMAP uses all cores if None.
+        tracer: Optional tracer recording the time, CPU, peak memory and output size of each command that runs.
+        merge_models: Merge sparse models that share images with ``model_merger`` before exporting.
+        dense: Run dense reconstruction and meshing after the sparse model.
+        dense_method: One of ``DENSE_METHODS``; "delaunay" runs without a GPU.
+        dense_max_image_size: Longest image side for dense reconstruction, or None for full resolution.
+        engine: How stages are executed, one of ``engines.ENGINES``.  Defaults to ``config.COLMAP_ENGINE``.
+        max_image_size: Longest image side features are extracted at; COLMAP's default (3200) if None.
 
     Raises:
+        COLMAPCancelled: If the run was cancelled through ``cancel_event``.
+        COLMAPTimeout: If a stage exceeded its time limit.
         COLMAPError: If any COLMAP command fails.
+        ValueError: If the engine is unknown.
     """
+    from src.photogrammetry.engines import create_engine  # engines builds on this module
+
+    if stage_timeouts is None:
+        stage_timeouts = config.COLMAP_STAGE_TIMEOUTS
+    runner = create_engine(engine)
+    # Merging changes the exported model, so it is part of the mapping fingerprint
+    stage_options = {"mapping": "merge_models"} if merge_models else None
 
     try:
-        # Feature extraction settings
-        feature_config = {
-            "sift": [],
-            "orb": ["--SiftExtraction.use_gpu", "0",  # Disable GPU for more consistent operation
-                    "--SiftExtraction.num_octaves", "3",
-                    "--SiftExtraction.first_octave", "0",
-                    "--SiftExtraction.peak_threshold", "0.01",
-                    "--SiftExtraction.edge_threshold", "10"]
-        }
-
-        feature_extractor_args = ["--ImageReader.camera_model", camera_model] + feature_config.get(feature_type, [])
-
-        if feature_type not in feature_config:
-            raise ValueError(f"Unsupported feature type: {feature_type}")
-
-        # Feature matching settings
-        feature_matcher_args = []
-        if vocab_tree_path:
-            feature_matcher_args += ["--VocabTreeMatching.vocab_tree_path",
-                                    str(vocab_tree_path)]
-            matcher_command = "vocab_tree_matcher"
-        else:
-            matcher_command = "exhaustive_matcher"
+        stages = _build_stages(image_dir, database_path, sparse_dir, feature_type,
+                               vocab_tree_path, camera_model, mapper_args, matcher, provenance, max_image_size)
+        if dense:
+            stages = _normalize_weights(
+                stages + _build_dense_stages(image_dir, sparse_dir, dense_method, dense_max_image_size))
 
-        # COLMAP commands
-        commands = [
-            (
-                "Feature extraction",
-                [
-                    "colmap",
-                    "feature_extractor",
-                    "--database_path",
-                    database_path,
-                    "--image_path",
-                    image_dir,
-                    *feature_extractor_args
-                ],
-                10, # Progress weight
-            ),
-            (
-                "Vocabulary tree matching" if vocab_tree_path else "Sequential matching",
-                [
-                    "colmap",
-                    matcher_command,
-                    "--database_path",
-                    database_path,
-                    *feature_matcher_args
-                ],
-                30, # Progress weight
-            ),
-            (
-                "Map creation",
-                [
-                    "colmap",
-                    "mapper",
-                    "--database_path",
-                    database_path,
-                    "--image_path",
-                    image_dir,
-                    "--output_path",
-                    sparse_dir,
-                ],
-                50, # Progress weight
-            ),
-            (
-                "Model to ply",
-                [
-                    "colmap",
-                    "model_converter",
-                    "--input_path",
-                    os.path.join(sparse_dir, "0"),
-                    "--output_path",
-                    os.path.join(sparse_dir, "model.ply"),
-                    "--output_type",
-                    "PLY"
-                ],
-                10, # Progress weight
-            ),
-        ]
+        if incremental:
+            new_images = _plan_incremental(image_dir, database_path, sparse_dir, stages)
+            if new_images:
+                logging.info(f"Incremental reconstruction with {len(new_images)} new images")
+                _run_incremental(image_dir, database_path, sparse_dir, stages, new_images,
+                                 mapper_args, progress_callback, cancel_event, stage_timeouts, num_threads, tracer,
+                                 stage_options, runner)
+                return
 
+        checkpoint_dir = os.path.join(os.path.dirname(os.path.abspath(database_path)), CHECKPOINT_DIR_NAME)
         completed_weight = 0
+        upstream_rerun = False
+        num_images = len(list_image_names(image_dir))
 
         # Execute COLMAP commands
-        for name, command, weight in commands:
-            logging.info(f"Running COLMAP command: {name}")
-            logging.info(f"Command: {' '.join(command)}")  # Log the full command
+        fingerprints = _stage_fingerprints(image_dir, stages, stage_options)
+        for (stage, name, command, weight, outputs), fingerprint in zip(stages, fingerprints):
+            checkpoint = _read_checkpoint(checkpoint_dir, stage)
+            if resume and not upstream_rerun and checkpoint and checkpoint.get("fingerprint") == fingerprint \
+                    and all(os.path.exists(output) for output in outputs):
+                logging.info(f"Skipping COLMAP command: {name} (inputs unchanged)")
+                completed_weight += weight
+                if progress_callback:
+                    progress_callback(completed_weight, f"Skipped {name} (inputs unchanged).")
+                continue
+
+            # This stage re-runs, so everything downstream must too
+            upstream_rerun = True
+            _clear_checkpoint(checkpoint_dir, stage)
+            if checkpoint and stage in STAGE_TABLES:
+                _reset_database_tables(database_path, STAGE_TABLES[stage])
+            if stage == "mapping":
+                # Drop models from a previous mapper run so stale components are not exported
+                for entry in os.listdir(sparse_dir) if os.path.isdir(sparse_dir) else []:
+                    if entry.isdigit():
+                        shutil.rmtree(os.path.join(sparse_dir, entry), ignore_errors=True)
+            if stage == "undistortion":
+                # Depth maps of a previous model would be fused with the new ones
+                shutil.rmtree(os.path.dirname(dense_mesh_path(sparse_dir)), ignore_errors=True)
 
             if progress_callback:
                 progress_callback(completed_weight, f"Running {name}...")
 
-            try:
-                result = subprocess.run(
-                    command,
-                    capture_output=True,
-                    text=True,
-                    check=True # Raise exception on non-zero exit code
-                )
-                if result.returncode != 0:
-                    logging.error(result.stderr)  # Log standard error
-                    raise COLMAPError(
-                        f"COLMAP command '{name}' failed with return code {result.returncode}: {result.stderr}")
-                logging.info(result.stdout)  # Log standard output
-                completed_weight += weight
-
-                if progress_callback:
-                    progress_callback(completed_weight, f"Completed {name}.")
+            with trace_stage(tracer, stage, outputs, command=command[1], engine=runner.name, num_images=num_images):
+                runner.run(stage, name, _with_threads(stage, command, num_threads),
+                           _stage_progress(progress_callback, name, completed_weight, weight),
+                           num_images, cancel_event, stage_timeouts.get(stage))
+            if stage == "mapping":
+                with trace_stage(tracer, "model_selection", [sparse_dir]) as record:
+                    models = select_sparse_model(sparse_dir, merge_models, cancel_event, stage_timeouts.get(stage),
+                                                 runner)
+                    record["labels"]["num_models"] = len(models)
+                if len(models) > 1:
+                    logging.info(f"Exporting model with {models[0]['registered_images']} of {num_images} images")
+            completed_weight += weight
+            _write_checkpoint(checkpoint_dir, stage, fingerprint, command)
 
-            except subprocess.CalledProcessError as e:
-                logging.error(e.stderr)  # Log standard error
-                raise COLMAPError(
-                    f"COLMAP command '{name}' failed with return code {e.returncode}: {e.stderr}") from e
+            if progress_callback:
+                progress_callback(completed_weight, f"Completed {name}.")
 
+    except (COLMAPCancelled, COLMAPTimeout):
+        raise
     except Exception as e:
         # Provide a default value for 'name' in case the loop didn't run
         # name = "unknown COLMAP command"  <--- Removed line that wasn't needed
         raise COLMAPError(f"An unexpected error occurred: {e}") from e
 
 
-def create_empty_colmap_database(database_path: str) -> None:
-    """Creates an empty COLMAP database."""
-    try:
-        result = subprocess.run(
-            ["colmap", "database_creator",
-                "--database_path", database_path],
-            capture_output=True,
-            text=True,
-        )
-        if result.returncode != 0:
-            raise COLMAPError(
-                f"Failed to create empty COLMAP database: {result.stderr}")
+def create_empty_colmap_database(database_path: str, engine: Optional[str] = None) -> None:
+    """
+    Creates an empty COLMAP database.
 
-    except subprocess.CalledProcessError as e:
-        raise COLMAPError(f"Failed to create empty COLMAP database: {e}")
+    Args:
+        database_path: Path of the database to create.
+        engine: Engine creating it, one of ``engines.ENGINES``.  Defaults to ``config.COLMAP_ENGINE``.
+
+    Raises:
+        COLMAPError: If the database could not be created.
+    """
+    from src.photogrammetry.engines import create_engine  # engines builds on this module
+
+    create_engine(engine).run("database_creation", "Database creation",
+                              ["colmap", "database_creator", "--database_path", database_path])
 
 
 def get_number_of_registered_images(sparse_dir: str) -> int:
@@ -184,34 +1201,15 @@ def get_number_of_registered_images(sparse_dir: str) -> int:
     Gets the number of registered images in the sparse reconstruction.
 
     Args:
-        sparse_dir: Path to the directory containing the sparse reconstruction.
+        sparse_dir: Path to the binary model, or to the mapper output containing it in ``0``.
 
     Returns:
-        The number of registered images.
+        The number of registered images, or 0 if there is no model.
     """
-    sparse_dir_path = Path(sparse_dir)
-    cameras_path = sparse_dir_path / "cameras.txt"
-    images_path = sparse_dir_path / "images.txt"
-
-    if not cameras_path.exists() or not images_path.exists():
+    model_dir = colmap_model.find_model_dir(sparse_dir)
+    if model_dir is None:
         return 0
-
-    num_registered_images = 0
-    with open(str(images_path), "r") as f:
-        for line in f:
-            if line.startswith("#"):
-                continue
-            parts = line.split()
-            if len(parts) < 2:
-                continue
-            try:
-                image_id = int(parts[0])
-                if image_id > 0:
-                    num_registered_images += 1
-            except ValueError:
-                continue
-
-    return num_registered_images
+    return colmap_model.ColmapModel(model_dir).num_registered_images
 
 
 def estimate_sparsity(sparse_dir: str) -> float:
@@ -219,35 +1217,23 @@ def estimate_sparsity(sparse_dir: str) -> float:
     Estimates the sparsity of the reconstructed model.
 
     Args:
-        sparse_dir: Path to the directory containing the sparse reconstruction.
+        sparse_dir: Path to the binary model, or to the mapper output containing it in ``0``.
 
     Returns:
-        The sparsity of the model (percentage of unregistered points).
+        The sparsity of the model (fraction of points observed in no image), 1.0 if there are no points.
     """
-    sparse_dir_path = Path(sparse_dir)
-    points3D_path = sparse_dir_path / "points3D.txt"
-
-    if not points3D_path.exists():
+    model_dir = colmap_model.find_model_dir(sparse_dir)
+    if model_dir is None or not os.path.exists(os.path.join(model_dir, "points3D.bin")):
         return 1.0  # Assume completely sparse if no points
 
-    total_points = 0
-    registered_points = 0
-    with open(str(points3D_path), "r") as f:
-        for line in f:
-            if line.startswith("#"):
-                continue
-            total_points += 1
-            parts = line.split()
-            if len(parts) > 8:
-                track_length = int(parts[7])
-                if track_length > 0:
-                    registered_points += 1
-
-    if total_points == 0:
+    track_lengths = colmap_model.ColmapModel(model_dir).points3D["track_length"]
+    if len(track_lengths) == 0:
         return 1.0
+    return float(1.0 - np.count_nonzero(track_lengths) / len(track_lengths))
+
 
-    sparsity = 1.0 - (registered_points / total_points)
-    return sparsity
+# Files of a COLMAP model, in the binary format the mapper writes and the text format
+MODEL_FILES = ["cameras.bin", "images.bin", "points3D.bin", "cameras.txt", "images.txt", "points3D.txt"]
 
 
 def copy_colmap_model(src_dir: str, dst_dir: str) -> None:
@@ -263,8 +1249,7 @@ def copy_colmap_model(src_dir: str, dst_dir: str) -> None:
 
     os.makedirs(dst_dir, exist_ok=True)
 
-    files_to_copy = ["cameras.txt", "images.txt", "points3D.txt"]
-    for file in files_to_copy:
+    for file in MODEL_FILES:
         src_file = src_dir_path / file
         dst_file = dst_dir_path / file
         if src_file.exists():
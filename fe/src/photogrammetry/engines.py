@@ -0,0 +1,286 @@
+"""
+Engines that execute the stages of the COLMAP pipeline.
+
+``run_colmap`` describes every stage as a ``colmap`` command line; the
+command is also what stage checkpoints are fingerprinted from.  An engine
+decides how a stage command is executed:
+
+- ``CLIEngine`` runs each command as a ``colmap`` process.
+- ``PycolmapEngine`` runs database creation, feature extraction, matching,
+  mapping and model export in-process through ``pycolmap``, so stages skip
+  process start-up and the reconstructions built by the mapper stay in
+  memory for the stages that follow.  Commands it has no binding for, such
+  as ``model_merger``, fall back to the CLI.
+
+Both engines read and write the same database and model files, so a run
+started with one can be resumed with the other.
+"""
+
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src import config
+from src.photogrammetry import colmap_wrapper
+from src.photogrammetry.colmap_wrapper import COLMAPCancelled, COLMAPError
+
+try:
+    import pycolmap
+except ImportError:  # pycolmap is optional; the CLI engine needs only the colmap executable
+    pycolmap = None
+
+ENGINES = ("cli", "pycolmap")
+
+
+def parse_value(value: str) -> Any:
+    """Converts a command line value to a bool, int or float where it looks like one."""
+    lowered = value.lower()
+    if lowered in ("true", "false"):
+        return lowered == "true"
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def parse_command(command: List[str]) -> Tuple[Dict[str, str], Dict[str, Dict[str, Any]]]:
+    """
+    Splits a COLMAP command line into plain arguments and sectioned options.
+
+    ``--database_path db`` becomes ``{"database_path": "db"}`` and
+    ``--SiftExtraction.num_threads 4`` becomes ``{"SiftExtraction": {"num_threads": 4}}``.
+
+    Returns:
+        Tuple of (plain arguments, options keyed by section).
+    """
+    arguments: Dict[str, str] = {}
+    sections: Dict[str, Dict[str, Any]] = {}
+    for flag, value in zip(command[2::2], command[3::2]):
+        name = flag.lstrip("-")
+        if "." in name:
+            section, option = name.split(".", 1)
+            sections.setdefault(section, {})[option] = parse_value(value)
+        else:
+            arguments[name] = value
+    return arguments, sections
+
+
+class CLIEngine:
+    """
+    Runs stages as ``colmap`` processes.
+
+    Args:
+        executable: The COLMAP executable, replacing ``colmap`` in stage commands.
+    """
+
+    name = "cli"
+
+    def __init__(self, executable: Optional[str] = None):
+        self.executable = executable or config.COLMAP_EXECUTABLE
+
+    def run(
+        self,
+        stage: str,
+        name: str,
+        command: List[str],
+        on_progress: Optional[Callable[[float, str], None]] = None,
+        num_images: Optional[int] = None,
+        cancel_event: Optional[threading.Event] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        """Runs a stage command; see ``colmap_wrapper._run_command`` for arguments and errors."""
+        if command and command[0] == "colmap" and self.executable != "colmap":
+            command = [self.executable, *command[1:]]
+        colmap_wrapper._run_command(name, command, on_progress, num_images, cancel_event, timeout)
+
+
+# pycolmap options classes for --Mapper.* options, by pycolmap version (newest first)
+_MAPPER_OPTIONS = ("IncrementalPipelineOptions", "IncrementalMapperOptions")
+
+
+class PycolmapEngine(CLIEngine):
+    """
+    Runs stages in-process with ``pycolmap``.
+
+    A running pycolmap call cannot be interrupted: cancellation is checked
+    between stages, and stage timeouts are not enforced.
+
+    Raises:
+        COLMAPError: On construction, if pycolmap is not installed.
+    """
+
+    name = "pycolmap"
+
+    def __init__(self, executable: Optional[str] = None):
+        super().__init__(executable)
+        if pycolmap is None:
+            raise COLMAPError("The pycolmap engine requires the pycolmap package")
+        # Reconstructions written by the mapper, keyed by the identity of their images.bin,
+        # which survives the renumbering of sparse models
+        self._reconstructions: Dict[Tuple[int, int], Any] = {}
+        self._handlers = {
+            "database_creator": self._create_database,
+            "feature_extractor": self._extract_features,
+            "exhaustive_matcher": self._match,
+            "sequential_matcher": self._match,
+            "spatial_matcher": self._match,
+            "vocab_tree_matcher": self._match,
+            "mapper": self._map,
+            "model_converter": self._convert_model,
+        }
+
+    def run(
+        self,
+        stage: str,
+        name: str,
+        command: List[str],
+        on_progress: Optional[Callable[[float, str], None]] = None,
+        num_images: Optional[int] = None,
+        cancel_event: Optional[threading.Event] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        arguments, sections = parse_command(command)
+        handler = self._handlers.get(command[1])
+        if handler is None or not handler(arguments, sections, dry_run=True):
+            super().run(stage, name, command, on_progress, num_images, cancel_event, timeout)
+            return
+
+        if cancel_event is not None and cancel_event.is_set():
+            raise COLMAPCancelled(f"COLMAP command '{name}' was cancelled")
+        if timeout:
+            logging.warning(f"Stage timeout of {timeout}s is not enforced for in-process stage: {name}")
+        logging.info(f"Running COLMAP stage in-process: {name}")
+        try:
+            handler(arguments, sections)
+        except COLMAPError:
+            raise
+        except Exception as e:
+            raise COLMAPError(f"COLMAP command '{name}' failed: {e}") from e
+        if cancel_event is not None and cancel_event.is_set():
+            raise COLMAPCancelled(f"COLMAP command '{name}' was cancelled")
+        if on_progress:
+            on_progress(1.0, "done")
+
+    @staticmethod
+    def _options(section: str, values: Dict[str, Any], class_names: Tuple[str, ...] = ()) -> Any:
+        """Builds a pycolmap options object for a command line section, or None if pycolmap has no such class."""
+        for class_name in class_names or (f"{section}Options",):
+            options_class = getattr(pycolmap, class_name, None)
+            if options_class is not None:
+                break
+        else:
+            return None
+        options = options_class()
+        for option, value in values.items():
+            if hasattr(options, option):
+                setattr(options, option, value)
+            else:
+                logging.warning(f"pycolmap {options_class.__name__} has no option {option}; ignored")
+        return options
+
+    def _create_database(self, arguments, sections, dry_run=False) -> bool:
+        database_class = getattr(pycolmap, "Database", None)
+        if dry_run:
+            return database_class is not None
+        # Opening a database creates its tables; Database.open replaced the constructor in newer pycolmap
+        database = database_class.open(arguments["database_path"]) if hasattr(database_class, "open") \
+            else database_class(arguments["database_path"])
+        if hasattr(database, "close"):
+            database.close()
+        return True
+
+    def _extract_features(self, arguments, sections, dry_run=False) -> bool:
+        if dry_run:
+            return True
+        kwargs = {}
+        if "image_list_path" in arguments:
+            with open(arguments["image_list_path"]) as f:
+                kwargs["image_list"] = [line.strip() for line in f if line.strip()]
+        reader = dict(sections.get("ImageReader", {}))
+        if "camera_model" in reader:
+            kwargs["camera_model"] = reader.pop("camera_model")
+        kwargs["reader_options"] = self._options("ImageReader", reader)
+        kwargs["sift_options"] = self._options("SiftExtraction", sections.get("SiftExtraction", {}))
+        pycolmap.extract_features(arguments["database_path"], arguments["image_path"],
+                                  **{key: value for key, value in kwargs.items() if value is not None})
+        return True
+
+    def _match(self, arguments, sections, dry_run=False) -> bool:
+        matching_sections = [section for section in sections if section.endswith("Matching")
+                             and section != "SiftMatching"]
+        section = matching_sections[0] if matching_sections else None
+        function_name = {
+            None: "match_exhaustive",
+            "ExhaustiveMatching": "match_exhaustive",
+            "SequentialMatching": "match_sequential",
+            "SpatialMatching": "match_spatial",
+            "VocabTreeMatching": "match_vocabtree",
+        }.get(section)
+        if dry_run:
+            return function_name is not None and hasattr(pycolmap, function_name)
+        kwargs = {
+            "sift_options": self._options("SiftMatching", sections.get("SiftMatching", {})),
+            "matching_options": self._options(section, sections[section]) if section else None,
+        }
+        getattr(pycolmap, function_name)(arguments["database_path"],
+                                         **{key: value for key, value in kwargs.items() if value is not None})
+        return True
+
+    def _map(self, arguments, sections, dry_run=False) -> bool:
+        if dry_run:
+            # Extending an existing model is left to the CLI
+            return "input_path" not in arguments
+        options = self._options("Mapper", sections.get("Mapper", {}), _MAPPER_OPTIONS)
+        output_path = arguments["output_path"]
+        os.makedirs(output_path, exist_ok=True)
+        reconstructions = pycolmap.incremental_mapping(
+            arguments["database_path"], arguments["image_path"], output_path,
+            **({"options": options} if options is not None else {}))
+        self._reconstructions.clear()
+        for index, reconstruction in reconstructions.items():
+            model_dir = os.path.join(output_path, str(index))
+            if not os.path.isfile(os.path.join(model_dir, "images.bin")):
+                os.makedirs(model_dir, exist_ok=True)
+                reconstruction.write(model_dir)
+            self._reconstructions[self._model_key(model_dir)] = reconstruction
+        return True
+
+    def _convert_model(self, arguments, sections, dry_run=False) -> bool:
+        if dry_run:
+            return arguments.get("output_type", "").upper() == "PLY"
+        input_path = arguments["input_path"]
+        reconstruction = self._reconstructions.get(self._model_key(input_path))
+        if reconstruction is None:
+            reconstruction = pycolmap.Reconstruction(input_path)
+        reconstruction.export_PLY(arguments["output_path"])
+        return True
+
+    @staticmethod
+    def _model_key(model_dir: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(os.path.join(model_dir, "images.bin"))
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+
+def create_engine(name: Optional[str] = None) -> CLIEngine:
+    """
+    Creates the engine for a pipeline run.
+
+    Args:
+        name: One of ``ENGINES``; ``config.COLMAP_ENGINE`` if None.
+
+    Raises:
+        ValueError: If the engine is unknown.
+        COLMAPError: If the pycolmap engine is requested without pycolmap installed.
+    """
+    name = name or config.COLMAP_ENGINE
+    if name == "cli":
+        return CLIEngine()
+    if name == "pycolmap":
+        return PycolmapEngine()
+    raise ValueError(f"Unknown COLMAP engine: {name}")
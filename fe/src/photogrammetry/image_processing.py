@@ -0,0 +1,207 @@
+"""
+Image preprocessing ahead of reconstruction.
+
+COLMAP's cost grows with the pixel count of its input: a 48 MP phone photo
+is decoded, kept in memory and searched for features at full size.
+``preprocess_images`` writes a working set in which every image is
+EXIF-oriented and downscaled to a target resolution, so feature
+extraction scales with that target instead of the camera sensor.  The
+originals stay untouched for texturing; the manifest written with the
+working set records the scale between each working image and its original.
+
+The working set is cached: images whose source file and settings are
+unchanged are not processed again, and files are never rewritten without
+need, so COLMAP stage checkpoints stay valid across runs.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Optional
+
+from src import config
+from src.photogrammetry.colmap_wrapper import list_image_names
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it images are processed with OpenCV, dropping EXIF
+    Image = None
+
+# Suffix of the manifest written next to (not into) a working set directory, which COLMAP reads in full
+MANIFEST_SUFFIX = ".json"
+
+# EXIF orientation tag id; 1 means the pixels are stored upright
+EXIF_ORIENTATION = 0x0112
+
+# Pillow formats by file extension
+_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG"}
+
+
+def scaled_size(width: int, height: int, max_size: Optional[int]) -> tuple:
+    """Size of an image downscaled so its longest side is at most ``max_size`` (never upscaled)."""
+    if not max_size or max(width, height) <= max_size:
+        return width, height
+    scale = max_size / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _link_or_copy(source: str, destination: str) -> None:
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def preprocess_image(source: str, destination: str, max_size: Optional[int],
+                     quality: int = config.PREPROCESS_JPEG_QUALITY) -> Dict[str, int]:
+    """
+    Write an upright copy of an image whose longest side is at most ``max_size``.
+
+    Images that are already upright and small enough are hardlinked rather
+    than re-encoded.  With Pillow, JPEGs are decoded at reduced scale where
+    possible and EXIF metadata (camera, focal length, GPS) is carried over.
+
+    Returns:
+        Dictionary with the "width" and "height" of the working image and the
+        "original_width" and "original_height" of the upright original.
+    """
+    root, extension = os.path.splitext(destination)
+    temp_path = f"{root}.part{extension}"
+    if os.path.exists(destination):
+        os.remove(destination)
+    if Image is not None:
+        with Image.open(source) as image:
+            orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+            # Orientations 5-8 swap width and height
+            swapped = orientation in (5, 6, 7, 8)
+            original_width, original_height = image.size[::-1] if swapped else image.size
+            width, height = scaled_size(original_width, original_height, max_size)
+            if orientation == 1 and (width, height) == (original_width, original_height):
+                _link_or_copy(source, destination)
+                return {"width": width, "height": height,
+                        "original_width": original_width, "original_height": original_height}
+
+            # Let the JPEG decoder skip resolution that would be discarded anyway
+            image.draft(image.mode, (height, width) if swapped else (width, height))
+            image = ImageOps.exif_transpose(image)
+            if image.size != (width, height):
+                image = image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            image_format = _FORMATS.get(extension.lower(), "JPEG")
+            options = {"quality": quality} if image_format == "JPEG" else {}
+            if image.info.get("exif"):
+                options["exif"] = image.info["exif"]
+            image.save(temp_path, image_format, **options)
+    else:
+        import cv2
+        # IMREAD_COLOR applies the EXIF orientation
+        image = cv2.imread(source, cv2.IMREAD_COLOR)
+        if image is None:
+            raise IOError(f"Could not read image: {source}")
+        original_height, original_width = image.shape[:2]
+        width, height = scaled_size(original_width, original_height, max_size)
+        if (width, height) != (original_width, original_height):
+            image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        if not cv2.imwrite(temp_path, image, [cv2.IMWRITE_JPEG_QUALITY, quality]):
+            raise IOError(f"Could not write image: {destination}")
+    os.replace(temp_path, destination)
+    return {"width": width, "height": height, "original_width": original_width, "original_height": original_height}
+
+
+def manifest_path(output_dir: str) -> str:
+    """Path of the manifest of a working set directory."""
+    return os.path.normpath(output_dir) + MANIFEST_SUFFIX
+
+
+def load_manifest(output_dir: str) -> Dict[str, Dict[str, Any]]:
+    """Read the manifest of a working set, keyed by image name (empty if there is none)."""
+    try:
+        with open(manifest_path(output_dir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(output_dir: str, manifest: Dict[str, Dict[str, Any]]) -> None:
+    path = manifest_path(output_dir)
+    with open(path + ".part", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".part", path)
+
+
+def preprocess_images(
+    image_dir: str,
+    output_dir: str,
+    max_size: Optional[int] = config.PREPROCESS_MAX_IMAGE_SIZE,
+    quality: int = config.PREPROCESS_JPEG_QUALITY,
+    num_workers: int = config.PREPROCESS_WORKERS,
+    progress_callback: Optional[Callable[[float, str], None]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Build or update the working set of the images in ``image_dir``.
+
+    Working images keep the names of their originals, so image names in the
+    reconstructed model refer to the originals as well.
+
+    Args:
+        image_dir: Directory of the original images.
+        output_dir: Directory of the working set.
+        max_size: Longest side of the working images, or None to keep the original resolution.
+        quality: JPEG quality of re-encoded images.
+        num_workers: Worker processes; images are processed in this process if 1.
+        progress_callback: Optional callback function to report progress.  Takes a float (0-100) and a message string.
+
+    Returns:
+        The manifest: for each working image, its size, the size of the upright
+        original and the state of the source file it was made from.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    previous = load_manifest(output_dir)
+    names = list_image_names(image_dir)
+
+    # Working images of removed originals would be reconstructed too
+    for entry in os.listdir(output_dir):
+        if entry not in names:
+            os.remove(os.path.join(output_dir, entry))
+
+    manifest: Dict[str, Dict[str, Any]] = {}
+    pending = {}
+    for name in names:
+        stat = os.stat(os.path.join(image_dir, name))
+        source_state = {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns,
+                        "max_size": max_size, "quality": quality}
+        entry = previous.get(name)
+        if entry and all(entry.get(key) == value for key, value in source_state.items()) \
+                and os.path.exists(os.path.join(output_dir, name)):
+            manifest[name] = entry
+        else:
+            pending[name] = source_state
+
+    logging.info(f"Preprocessing {len(pending)} of {len(names)} images to at most {max_size} px")
+
+    def finished(name, get_result, done):
+        try:
+            manifest[name] = {**pending[name], **get_result()}
+        except Exception as e:
+            logging.warning(f"Could not preprocess {name}, leaving it out: {e}")
+        if progress_callback:
+            progress_callback(done * 100 / len(pending), f"Preprocessed {done} of {len(pending)} images")
+
+    jobs = [(name, os.path.join(image_dir, name), os.path.join(output_dir, name)) for name in pending]
+    if num_workers > 1 and len(jobs) > 1:
+        # Spawned workers do not inherit the locks of threads running in this process
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(jobs)),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {executor.submit(preprocess_image, source, destination, max_size, quality): name
+                       for name, source, destination in jobs}
+            for done, future in enumerate(as_completed(futures), 1):
+                finished(futures[future], future.result, done)
+    else:
+        for done, (name, source, destination) in enumerate(jobs, 1):
+            finished(name, lambda: preprocess_image(source, destination, max_size, quality), done)
+
+    _write_manifest(output_dir, manifest)
+    return manifest
+
@@ -0,0 +1,150 @@
+"""Sharpness- and overlap-aware keyframe selection for video uploads."""
+
+import math
+import os
+from collections import deque
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from src import config
+from src.photogrammetry.video_extractor import FrameWriter, get_video_info, iter_frames
+
+# Width frames are downscaled to before scoring
+SCORING_WIDTH = 320
+
+# Side length of the thumbnail used to detect near-duplicate frames
+SIGNATURE_SIZE = 32
+
+
+def score_frame(frame: np.ndarray) -> Tuple[float, np.ndarray]:
+    """
+    Score a frame for sharpness and compute its redundancy signature.
+
+    Args:
+        frame: BGR frame as returned by OpenCV.
+
+    Returns:
+        Tuple of (Laplacian variance of the downscaled frame, zero-mean unit-norm thumbnail).
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    height, width = gray.shape
+    if width > SCORING_WIDTH:
+        scale = SCORING_WIDTH / width
+        gray = cv2.resize(gray, (SCORING_WIDTH, max(1, int(height * scale))),
+                          interpolation=cv2.INTER_AREA)
+
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+    thumbnail = cv2.resize(gray, (SIGNATURE_SIZE, SIGNATURE_SIZE),
+                           interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+    thumbnail -= thumbnail.mean()
+    norm = np.linalg.norm(thumbnail)
+    signature = thumbnail / norm if norm > 0 else thumbnail
+    return sharpness, signature
+
+
+def signature_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Normalized cross-correlation between two frame signatures (1.0 means identical)."""
+    if not a.any() or not b.any():
+        # Flat frames carry no structure; only treat them as duplicates of each other
+        return 1.0 if not a.any() and not b.any() else 0.0
+    return float(np.dot(a, b))
+
+
+def iter_keyframes(
+    video_path: str,
+    output_dir: str,
+    max_frames: int = config.DEFAULT_KEYFRAME_BUDGET,
+    candidate_fps: float = config.KEYFRAME_CANDIDATE_FPS,
+    max_similarity: float = 0.97,
+    min_sharpness: float = 0.0,
+    progress_callback: Optional[Callable[[float, str], None]] = None,
+    image_format: str = config.FRAME_IMAGE_FORMAT,
+    quality: Optional[int] = None,
+    num_workers: int = config.FRAME_ENCODE_WORKERS,
+) -> Iterator[str]:
+    """
+    Select keyframes from a video in a single decoding pass.
+
+    The video is split into ``max_frames`` equal windows.  Candidate frames
+    sampled at ``candidate_fps`` are scored by Laplacian variance and the
+    sharpest candidate of each window is kept, unless it is blurrier than
+    ``min_sharpness`` or too similar to the previously kept keyframe.
+
+    Args:
+        video_path: Path to the input video file.
+        output_dir: Directory to save the selected keyframes.
+        max_frames: Upper bound on the number of keyframes kept.
+        candidate_fps: Rate at which candidate frames are decoded and scored.
+        max_similarity: Signature similarity above which a frame is considered redundant.
+        min_sharpness: Minimum Laplacian variance for a frame to be kept.
+        progress_callback: Optional callback function to report progress.
+        image_format: Output image format ("jpg" or "png").
+        quality: JPEG quality (0-100) or PNG compression level (0-9).  Defaults to the config value.
+        num_workers: Number of encoding threads (0 encodes on the decode thread).
+
+    Yields:
+        Paths to the kept keyframes, in video order.
+    """
+    if max_frames < 1:
+        raise ValueError(f"max_frames must be at least 1, got {max_frames}")
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    _, total_frames = get_video_info(video_path)
+    window_size = max(1, math.ceil(total_frames / max_frames)) if total_frames > 0 else 1
+
+    last_signature: Optional[np.ndarray] = None
+    best = None  # (sharpness, frame_id, frame, signature) of the current window
+    current_window = 0
+    pending: deque = deque()
+
+    with FrameWriter(image_format, quality, num_workers) as writer:
+        def flush(candidate):
+            nonlocal last_signature
+            sharpness, frame_id, frame, signature = candidate
+            if sharpness < min_sharpness:
+                return
+            if last_signature is not None and \
+                    signature_similarity(signature, last_signature) > max_similarity:
+                return
+            frame_path = os.path.join(output_dir, f"frame_{frame_id:06d}.{writer.extension}")
+            pending.append(writer.submit(frame, frame_path))
+            last_signature = signature
+
+        for frame_id, frame in iter_frames(video_path, candidate_fps, progress_callback):
+            window = frame_id // window_size
+            if best is not None and window != current_window:
+                flush(best)
+                best = None
+            current_window = window
+
+            sharpness, signature = score_frame(frame)
+            if best is None or sharpness > best[0]:
+                best = (sharpness, frame_id, frame, signature)
+
+            while pending and pending[0].done():
+                yield pending.popleft().result()
+
+        if best is not None:
+            flush(best)
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def select_keyframes(
+    video_path: str,
+    output_dir: str,
+    max_frames: int = config.DEFAULT_KEYFRAME_BUDGET,
+    **kwargs,
+) -> List[str]:
+    """
+    Select keyframes from a video and return their paths.
+
+    See ``iter_keyframes`` for the available options.
+    """
+    return list(iter_keyframes(video_path, output_dir, max_frames, **kwargs))
@@ -1,36 +1,63 @@
 import os
 from typing import Callable, Optional
+from src import config
 from src.photogrammetry import colmap_wrapper  # Import colmap_wrapper
+from src.photogrammetry.image_processing import preprocess_images
+from src.instrumentation import trace_stage
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Name of the directory of downscaled working images, next to the database
+WORKING_IMAGES_DIR_NAME = "working_images"
 
-def run_reconstruction(image_dir: str, database_path: str, sparse_dir: str, progress_callback: Optional[Callable[[float, str], None]] = None) -> Optional[str]:
+
+def run_reconstruction(image_dir: str, database_path: str, sparse_dir: str, progress_callback: Optional[Callable[[float, str], None]] = None, max_image_size: Optional[int] = config.PREPROCESS_MAX_IMAGE_SIZE, **colmap_options) -> Optional[str]:
     """
     Runs the COLMAP reconstruction pipeline.
 
+    With ``max_image_size`` set, COLMAP runs on a working set of upright
+    images downscaled to that size (see ``image_processing.preprocess_images``),
+    kept in ``WORKING_IMAGES_DIR_NAME`` next to the database; the originals in
+    ``image_dir`` are left as they are.
+
     Args:
         image_dir: Path to the directory containing the images.
         database_path: Path to the COLMAP database.
         sparse_dir: Path to the directory where the sparse reconstruction will be stored.
         progress_callback: Optional callback function to report progress.
+        max_image_size: Longest image side COLMAP works on, or None to use the originals.
+        **colmap_options: Additional options passed to ``colmap_wrapper.run_colmap`` (e.g. feature_type, camera_model).
 
     Returns:
-        Path to the generated model.ply file, or None if reconstruction fails.
+        Path to the generated model.ply file, or to the dense mesh if ``dense`` is enabled;
+        None if reconstruction fails.
     """
-    ply_path = os.path.join(sparse_dir, "model.ply")
+    if colmap_options.get("dense"):
+        ply_path = colmap_wrapper.dense_mesh_path(sparse_dir)
+    else:
+        ply_path = os.path.join(sparse_dir, "model.ply")
 
     try:
         if progress_callback:
             progress_callback(0, "Creating empty COLMAP database...")
-        colmap_wrapper.create_empty_colmap_database(database_path)
+        with trace_stage(colmap_options.get("tracer"), "database_creation", [database_path]):
+            colmap_wrapper.create_empty_colmap_database(database_path, colmap_options.get("engine"))
+
+        if max_image_size:
+            working_dir = os.path.join(os.path.dirname(os.path.abspath(database_path)), WORKING_IMAGES_DIR_NAME)
+            with trace_stage(colmap_options.get("tracer"), "image_preprocessing", [working_dir],
+                             max_image_size=max_image_size):
+                preprocess_images(image_dir, working_dir, max_image_size, progress_callback=(
+                    (lambda p, msg: progress_callback(p / 10, msg)) if progress_callback else None))
+            image_dir = working_dir
+            colmap_options["max_image_size"] = max_image_size
 
         if progress_callback:
             progress_callback(10, "Running COLMAP reconstruction...")
-        colmap_wrapper.run_colmap(image_dir, database_path, sparse_dir, progress_callback=progress_callback)
+        colmap_wrapper.run_colmap(image_dir, database_path, sparse_dir, progress_callback=progress_callback, **colmap_options)
 
         if os.path.exists(ply_path):
             if progress_callback:
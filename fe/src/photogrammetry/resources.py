@@ -0,0 +1,59 @@
+"""Resource estimates for COLMAP reconstructions, used for task admission control."""
+
+import math
+import os
+from typing import Dict, Optional
+
+import psutil
+
+from src.image_store import read_image_info
+from src.photogrammetry.colmap_wrapper import list_image_names
+
+# COLMAP downscales images whose longest side exceeds this before extracting features
+SIFT_MAX_IMAGE_SIZE = 3200
+
+# Working memory of SIFT extraction per pixel and thread (float image, Gaussian and DoG pyramids)
+EXTRACTION_BYTES_PER_PIXEL = 48
+
+# Mapper memory per registered image (keypoints, descriptors, correspondences, tracks)
+MAPPER_BYTES_PER_IMAGE = 4 * 1024 ** 2
+
+# Fixed overhead of a COLMAP process
+BASE_MEMORY_BYTES = 256 * 1024 ** 2
+
+# Images per thread; small image sets gain nothing from more threads
+IMAGES_PER_THREAD = 10
+
+# Number of images whose dimensions are read to estimate the image size
+SIZE_SAMPLE = 20
+
+
+def estimate_reconstruction_resources(image_dir: str, max_image_size: Optional[int] = None) -> Dict[str, int]:
+    """
+    Estimate the cores and peak memory a COLMAP reconstruction of a directory needs.
+
+    Args:
+        image_dir: Path to the directory containing the images.
+        max_image_size: Longest side images are downscaled to before reconstruction, if smaller than
+            ``SIFT_MAX_IMAGE_SIZE``.
+
+    Returns:
+        A dictionary with "cores" (threads to run COLMAP with) and "memory" (bytes).
+    """
+    image_names = list_image_names(image_dir)
+    num_images = len(image_names)
+    cores = max(1, min(psutil.cpu_count() or 1, math.ceil(num_images / IMAGES_PER_THREAD)))
+
+    # Sample evenly so mixed-resolution sets are represented
+    step = max(1, num_images // SIZE_SAMPLE)
+    max_side = min(max_image_size or SIFT_MAX_IMAGE_SIZE, SIFT_MAX_IMAGE_SIZE)
+    max_pixels = 0
+    for name in image_names[::step][:SIZE_SAMPLE]:
+        info = read_image_info(os.path.join(image_dir, name))
+        if info["width"] and info["height"]:
+            scale = min(1.0, max_side / max(info["width"], info["height"]))
+            max_pixels = max(max_pixels, int(info["width"] * scale) * int(info["height"] * scale))
+
+    extraction_memory = cores * max_pixels * EXTRACTION_BYTES_PER_PIXEL
+    mapper_memory = num_images * MAPPER_BYTES_PER_IMAGE
+    return {"cores": cores, "memory": BASE_MEMORY_BYTES + max(extraction_memory, mapper_memory)}
@@ -1,9 +1,157 @@
 import cv2
 import os
-from typing import List
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
 
+import numpy as np
 
-def extract_frames(video_path: str, output_dir: str, fps: float = 1.0) -> List[str]:
+from src import config
+
+
+class FrameWriter:
+    """
+    Bounded pool that encodes frames and writes them to disk off the decode thread.
+
+    OpenCV releases the GIL while encoding, so JPEG/PNG compression scales
+    across threads.  At most ``max_pending`` frames are held in memory; the
+    producer blocks in ``submit`` once that many frames are waiting.
+    """
+
+    def __init__(
+        self,
+        image_format: str = config.FRAME_IMAGE_FORMAT,
+        quality: Optional[int] = None,
+        num_workers: int = config.FRAME_ENCODE_WORKERS,
+        max_pending: Optional[int] = None,
+    ):
+        image_format = image_format.lower().lstrip(".")
+        if image_format == "jpeg":
+            image_format = "jpg"
+        if image_format == "jpg":
+            self.params = [cv2.IMWRITE_JPEG_QUALITY,
+                           config.FRAME_JPEG_QUALITY if quality is None else quality]
+        elif image_format == "png":
+            self.params = [cv2.IMWRITE_PNG_COMPRESSION,
+                           config.FRAME_PNG_COMPRESSION if quality is None else quality]
+        else:
+            raise ValueError(f"Unsupported frame format: {image_format}")
+
+        self.extension = image_format
+        self.num_workers = num_workers
+        self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="frame-writer") \
+            if num_workers > 0 else None
+        self._slots = threading.BoundedSemaphore(max_pending or max(2, num_workers * 2))
+
+    def _write(self, frame: np.ndarray, frame_path: str) -> str:
+        try:
+            if not cv2.imwrite(frame_path, frame, self.params):
+                raise IOError(f"Could not write frame: {frame_path}")
+            return frame_path
+        finally:
+            self._slots.release()
+
+    def submit(self, frame: np.ndarray, frame_path: str) -> "Future[str]":
+        """Queue a frame for encoding, blocking while the pool is full."""
+        self._slots.acquire()
+        if self._executor is None:
+            future: "Future[str]" = Future()
+            try:
+                future.set_result(self._write(frame, frame_path))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self._executor.submit(self._write, frame, frame_path)
+
+    def close(self):
+        """Wait for queued frames to be written and stop the pool."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def get_video_info(video_path: str) -> Tuple[float, int]:
+    """
+    Read the frame rate and frame count of a video without decoding it.
+
+    Args:
+        video_path: Path to the input video file.
+
+    Returns:
+        Tuple of (frames per second, total number of frames).
+    """
+    video = cv2.VideoCapture(video_path)
+    if not video.isOpened():
+        raise ValueError(f"Could not open video: {video_path}")
+    try:
+        return video.get(cv2.CAP_PROP_FPS), int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        video.release()
+
+
+def iter_frames(
+    video_path: str,
+    fps: float = 1.0,
+    progress_callback: Optional[Callable[[float, str], None]] = None,
+) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Decode a video sequentially and yield frames at a specified frame rate.
+
+    Frames are advanced with ``grab()`` and only decoded with ``retrieve()``
+    when they are sampled, so no keyframe seek is needed per output frame.
+
+    Args:
+        video_path: Path to the input video file.
+        fps: Frames per second to yield.  Defaults to 1.0.
+        progress_callback: Optional callback function to report progress.  Takes a float (0-100) and a message string.
+
+    Yields:
+        Tuples of (frame index, decoded BGR frame).
+    """
+    video = cv2.VideoCapture(video_path)
+    if not video.isOpened():
+        raise ValueError(f"Could not open video: {video_path}")
+
+    try:
+        frame_rate = video.get(cv2.CAP_PROP_FPS) or fps
+        total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        frame_interval = max(frame_rate / fps, 1.0)
+
+        frame_id = 0
+        sample_count = 0
+        next_target = 0
+
+        while video.grab():
+            if frame_id == next_target:
+                success, frame = video.retrieve()
+                if success:
+                    yield frame_id, frame
+                    if progress_callback and total_frames > 0:
+                        progress_callback(
+                            min(100.0, 100.0 * (frame_id + 1) / total_frames),
+                            f"Extracted frame {frame_id} of {total_frames}")
+                sample_count += 1
+                next_target = int(round(sample_count * frame_interval))
+            frame_id += 1
+    finally:
+        video.release()
+
+
+def extract_frames(
+    video_path: str,
+    output_dir: str,
+    fps: float = 1.0,
+    progress_callback: Optional[Callable[[float, str], None]] = None,
+    image_format: str = config.FRAME_IMAGE_FORMAT,
+    quality: Optional[int] = None,
+    num_workers: int = config.FRAME_ENCODE_WORKERS,
+) -> List[str]:
     """
     Extract frames from a video at a specified frame rate.
 
@@ -11,40 +159,58 @@ def extract_frames(video_path: str, output_dir: str, fps: float = 1.0) -> List[s
         video_path: Path to the input video file.
         output_dir: Directory to save the extracted frames.
         fps: Frames per second to extract.  Defaults to 1.0.
+        progress_callback: Optional callback function to report progress.
+        image_format: Output image format ("jpg" or "png").
+        quality: JPEG quality (0-100) or PNG compression level (0-9).  Defaults to the config value.
+        num_workers: Number of encoding threads (0 encodes on the decode thread).
 
     Returns:
         A list of paths to the extracted frames.
     """
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    return list(iter_extracted_frames(video_path, output_dir, fps, progress_callback,
+                                      image_format=image_format, quality=quality,
+                                      num_workers=num_workers))
 
-    video = cv2.VideoCapture(video_path)
-    frame_rate = video.get(cv2.CAP_PROP_FPS)
-    total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
 
-    if not video.isOpened():
-        raise ValueError(f"Could not open video: {video_path}")
+def iter_extracted_frames(
+    video_path: str,
+    output_dir: str,
+    fps: float = 1.0,
+    progress_callback: Optional[Callable[[float, str], None]] = None,
+    image_format: str = config.FRAME_IMAGE_FORMAT,
+    quality: Optional[int] = None,
+    num_workers: int = config.FRAME_ENCODE_WORKERS,
+) -> Iterator[str]:
+    """
+    Extract frames from a video, yielding each frame path as soon as it is written.
 
-    frame_interval = frame_rate / fps
-    frame_count = 0
-    extracted_frames: List[str] = []
-    success = True
+    Decoding stays on the calling thread while encoding and disk writes run
+    on a ``FrameWriter`` pool.
 
-    while success:
-        frame_id = int(round(frame_count * frame_interval))
-        video.set(cv2.CAP_PROP_POS_FRAMES, frame_id)
-        success, frame = video.read()
+    Args:
+        video_path: Path to the input video file.
+        output_dir: Directory to save the extracted frames.
+        fps: Frames per second to extract.  Defaults to 1.0.
+        progress_callback: Optional callback function to report progress.
+        image_format: Output image format ("jpg" or "png").
+        quality: JPEG quality (0-100) or PNG compression level (0-9).  Defaults to the config value.
+        num_workers: Number of encoding threads (0 encodes on the decode thread).
 
-        if success:
-            frame_name = f"frame_{frame_id:06d}.jpg"
-            frame_path = os.path.join(output_dir, frame_name)
-            cv2.imwrite(frame_path, frame)
-            extracted_frames.append(frame_path)
+    Yields:
+        Paths to the extracted frames, in video order.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
 
-        frame_count += 1
+    pending: deque = deque()
+    with FrameWriter(image_format, quality, num_workers) as writer:
+        for frame_id, frame in iter_frames(video_path, fps, progress_callback):
+            frame_name = f"frame_{frame_id:06d}.{writer.extension}"
+            pending.append(writer.submit(frame, os.path.join(output_dir, frame_name)))
 
-        if frame_id >= total_frames - 1:
-            break
+            # Hand back frames that are already on disk without waiting for the rest
+            while pending and pending[0].done():
+                yield pending.popleft().result()
 
-    video.release()
-    return extracted_frames
+        while pending:
+            yield pending.popleft().result()
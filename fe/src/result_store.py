@@ -0,0 +1,206 @@
+"""
+Bounded store for task results.
+
+Results are kept in memory up to a byte budget.  Results larger than a
+threshold, and the least recently used results once the budget is
+exceeded, are spilled to disk: NumPy arrays as ``.npy`` files that are
+reloaded memory-mapped, everything else pickled.  Results that cannot be
+written to disk (e.g. unpicklable objects) stay in memory, over budget if
+need be, rather than being lost.
+"""
+
+import logging
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+import numpy as np
+
+from src import config
+
+
+def estimate_size(value: Any, _depth: int = 0) -> int:
+    """
+    Estimate the memory held by a result in bytes.
+
+    Arrays, bytes and strings are measured exactly; containers are summed
+    a few levels deep and other objects count their shallow size.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return sys.getsizeof(value)
+    size = sys.getsizeof(value)
+    if _depth < 3:
+        if isinstance(value, dict):
+            size += sum(estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in value.items())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            size += sum(estimate_size(item, _depth + 1) for item in value)
+    return size
+
+
+class ResultStore(MutableMapping):
+    """
+    Dictionary of task results with bounded memory use.
+
+    Args:
+        max_bytes: Memory budget for results held in memory.
+        spill_threshold: Results at least this large go straight to disk.
+        spill_dir: Directory for spilled results.  A temporary directory is created if None.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = config.RESULT_STORE_MAX_BYTES,
+        spill_threshold: int = config.RESULT_SPILL_THRESHOLD,
+        spill_dir: Optional[str] = config.RESULT_SPILL_DIR,
+    ):
+        self.max_bytes = max_bytes
+        self.spill_threshold = spill_threshold
+        self._spill_dir = spill_dir
+        # key -> (value, size) for results in memory, least recently used first
+        self._memory: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        # key -> path of spilled results
+        self._spilled: Dict[str, str] = {}
+        # Keys of in-memory results that failed to spill, so eviction does not retry them
+        self._unspillable: Set[str] = set()
+        self._memory_bytes = 0
+        self._lock = threading.RLock()
+
+    @property
+    def memory_bytes(self) -> int:
+        """Estimated bytes of the results held in memory"""
+        return self._memory_bytes
+
+    @property
+    def spill_dir(self) -> str:
+        """Directory spilled results are written to, created on first use"""
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="task-results-")
+        os.makedirs(self._spill_dir, exist_ok=True)
+        return self._spill_dir
+
+    def is_spilled(self, key: str) -> bool:
+        """Return True if a result is stored on disk"""
+        with self._lock:
+            return key in self._spilled
+
+    def _spill(self, key: str, value: Any) -> bool:
+        """
+        Write a result to disk; the caller holds the lock and keeps the result in memory on failure.
+
+        Returns:
+            True if the result was written, False if it could not be (the error is logged).
+        """
+        # Keys are task ids; keep file names safe regardless
+        name = "".join(c if c.isalnum() or c in "-_" else "_" for c in str(key))
+        array = isinstance(value, np.ndarray) and value.dtype != object
+        path = os.path.join(self.spill_dir, f"{name}.npy" if array else f"{name}.pkl")
+        try:
+            with open(path, "wb") as f:
+                if array:
+                    np.save(f, value)
+                else:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logging.warning(f"Could not spill task result {key}, keeping it in memory: {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return False
+        self._spilled[key] = path
+        logging.debug(f"Spilled task result {key} to {path}")
+        return True
+
+    @staticmethod
+    def _load(path: str) -> Any:
+        if path.endswith(".npy"):
+            # Memory-mapped, so large arrays are paged in only as they are read
+            return np.load(path, mmap_mode="r")
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def _discard(self, key: str):
+        """Remove a result from memory and disk; the caller holds the lock"""
+        if key in self._memory:
+            _, size = self._memory.pop(key)
+            self._memory_bytes -= size
+        self._unspillable.discard(key)
+        path = self._spilled.pop(key, None)
+        if path is not None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict(self):
+        """Spill least recently used results until memory use is within budget"""
+        for key in list(self._memory):
+            if self._memory_bytes <= self.max_bytes:
+                break
+            if key in self._unspillable:
+                continue
+            value, size = self._memory[key]
+            if self._spill(key, value):
+                del self._memory[key]
+                self._memory_bytes -= size
+            else:
+                self._unspillable.add(key)
+
+    def __setitem__(self, key: str, value: Any):
+        size = estimate_size(value)
+        with self._lock:
+            self._discard(key)
+            if size >= self.spill_threshold:
+                if self._spill(key, value):
+                    return
+                self._unspillable.add(key)
+            self._memory[key] = (value, size)
+            self._memory_bytes += size
+            self._evict()
+
+    def __getitem__(self, key: str) -> Any:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key][0]
+            if key in self._spilled:
+                return self._load(self._spilled[key])
+        raise KeyError(key)
+
+    def __delitem__(self, key: str):
+        with self._lock:
+            if key not in self._memory and key not in self._spilled:
+                raise KeyError(key)
+            self._discard(key)
+
+    def __contains__(self, key: object) -> bool:
+        with self._lock:
+            return key in self._memory or key in self._spilled
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._memory) + list(self._spilled))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._memory) + len(self._spilled)
+
+    def clear(self):
+        """Remove every result, including spilled files"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._unspillable.clear()
+            self._spilled.clear()
+            if self._spill_dir is not None:
+                shutil.rmtree(self._spill_dir, ignore_errors=True)
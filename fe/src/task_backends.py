@@ -0,0 +1,643 @@
+"""
+Task backends that run work outside the Streamlit process.
+
+``ProcessPoolBackend`` executes tasks in a pool of worker processes, so
+CPU-heavy tasks do not compete with the UI for the GIL.  ``SQLiteBackend``
+keeps the queue in a SQLite database that any number of worker processes,
+on this host or on others sharing the file, pull from::
+
+    python -m src.task_backends --db tasks.db --workers 4
+
+Both are selected through ``config.TASK_BACKEND`` and used through the
+functions of ``src.task_queue``.
+"""
+
+import argparse
+import importlib
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psutil
+
+from src import config
+from src import task_queue
+from src.instrumentation import Tracer
+from src.task_queue import (PRIORITY_NORMAL, FairTaskQueue, TaskBackend, ThreadBackend, default_pool_size,
+                            defer_task, normalize_dependencies, record_task_metrics, register_task,
+                            update_task_status, with_upstream_results)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Statuses after which a task no longer changes
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+def _inject_task_kwargs(func: Callable, kwargs: Dict[str, Any],
+                        progress_callback: Callable[[float, str], None], cancel_event,
+                        resources: Optional[Dict[str, float]] = None,
+                        on_metrics: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Add progress_callback, cancel_event, num_threads and tracer to kwargs if the function accepts them"""
+    parameters = inspect.signature(func).parameters
+    kwargs = dict(kwargs)
+    if "progress_callback" in parameters:
+        kwargs["progress_callback"] = progress_callback
+    if "cancel_event" in parameters:
+        kwargs["cancel_event"] = cancel_event
+    if "num_threads" in parameters and resources:
+        kwargs["num_threads"] = resources.get("cores")
+    if "tracer" in parameters and on_metrics is not None:
+        kwargs["tracer"] = Tracer(on_record=on_metrics)
+    return kwargs
+
+
+def _run_task_in_process(task_id: str, func: Callable, args: List, kwargs: Dict[str, Any],
+                         progress_queue, cancel_event, resources: Optional[Dict[str, float]] = None) -> Any:
+    """Entry point of a task in a pool process; progress and stage metrics are reported through progress_queue"""
+    if cancel_event.is_set():
+        return None
+    progress_queue.put(("progress", task_id, 0, "Task started"))
+
+    def progress_callback(p, msg=""):
+        progress_queue.put(("progress", task_id, p, msg))
+
+    def on_metrics(record):
+        progress_queue.put(("metrics", task_id, record))
+
+    return func(*args, **_inject_task_kwargs(func, kwargs, progress_callback, cancel_event, resources, on_metrics))
+
+
+class ProcessPoolBackend(ThreadBackend):
+    """
+    Runs tasks in a pool of worker processes.
+
+    Task state stays in the ``task_queue`` globals of the submitting process.
+    Tasks wait in a ``FairTaskQueue`` and a dispatcher thread hands them to
+    the pool only when a worker process is free and their resource estimate
+    is admitted, so priorities, the round-robin between sessions and the
+    admission control apply as with the thread backend.  Progress
+    reports travel back over a manager queue and cancellation is signalled
+    with a manager event per task.  Functions, arguments and results must be
+    picklable.
+    """
+
+    def __init__(self, num_workers: Optional[int] = None):
+        self.num_workers = num_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._progress_queue = None
+        self._futures: Dict[str, Future] = {}
+        self._remote_cancel_events: Dict[str, Any] = {}
+        self._queue = FairTaskQueue()
+        # Free worker processes; a task is only taken from the queue once one is available
+        self._free_slots: Optional[threading.Semaphore] = None
+        self._dispatcher: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start_workers(self, num_workers: Optional[int] = None) -> List[Any]:
+        num_workers = num_workers or default_pool_size()
+        with self._lock:
+            if self._executor is None:
+                # Spawn rather than fork: the Streamlit process runs many threads
+                context = multiprocessing.get_context("spawn")
+                self._manager = context.Manager()
+                self._progress_queue = self._manager.Queue()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.num_workers or num_workers, mp_context=context)
+                self._free_slots = threading.Semaphore(self.num_workers or num_workers)
+                threading.Thread(target=self._pump_progress, daemon=True, name="process-pool-progress").start()
+                self._dispatcher = threading.Thread(target=self._dispatch_queued, daemon=True,
+                                                    name="process-pool-dispatcher")
+                self._dispatcher.start()
+                logging.info(f"Started process pool with {self.num_workers or num_workers} workers")
+            return [self._executor]
+
+    def shutdown(self):
+        """Stop the pool, waiting for running tasks, and the progress manager"""
+        with self._lock:
+            if self._executor is not None:
+                # The dispatcher exits once the tasks queued before the shutdown signal are dispatched
+                self._queue.put(None)
+                self._dispatcher.join()
+                self._executor.shutdown(wait=True)
+                self._progress_queue.put(None)
+                self._manager.shutdown()
+                self._executor = None
+
+    def _dispatch_queued(self):
+        """Move queued tasks into the pool, one per free worker process, in fair order"""
+        while True:
+            self._free_slots.acquire()
+            task = self._queue.get()
+            if task is None:
+                self._free_slots.release()
+                self._queue.task_done()
+                break
+            with task_queue.status_lock:
+                cancel_event = task_queue.task_cancel_events.get(task["id"])
+            if cancel_event is not None and cancel_event.is_set():
+                logging.info(f"Skipping cancelled task: {task['id']}")
+                self._release(task)
+                continue
+            try:
+                task["dispatch"]()
+            except Exception as e:
+                logging.error(f"Could not dispatch task {task['id']}: {e}", exc_info=True)
+                update_task_status(task["id"], "failed", 0, f"Error: {str(e)}")
+                self._release(task)
+
+    def _release(self, task: Dict[str, Any]):
+        """Return the worker process and queue slot of a task taken by the dispatcher"""
+        self._queue.release(task)
+        self._queue.task_done()
+        self._free_slots.release()
+
+    def _pump_progress(self):
+        progress_queue = self._progress_queue
+        while True:
+            try:
+                item = progress_queue.get()
+            except (EOFError, OSError):
+                break
+            if item is None:
+                break
+            if item[0] == "metrics":
+                record_task_metrics(item[1], item[2])
+                continue
+            _, task_id, progress, message = item
+            status = self.get_status(task_id)
+            # Late reports must not overwrite a final or cancelling status
+            if status and status["status"] in ("queued", "running") and status["message"] != "Cancelling...":
+                update_task_status(task_id, "running", progress, message)
+
+    def submit(self, func: Callable, args: List, kwargs: Dict[str, Any], session_id: str,
+               priority: int = PRIORITY_NORMAL, resources: Optional[Dict[str, float]] = None,
+               depends_on=None) -> str:
+        dependencies = normalize_dependencies(depends_on)
+        self.start_workers()
+        task_id = task_queue.generate_task_id()
+        logging.info(f"Submitting task with id: {task_id} to process pool, function: {func.__name__}")
+
+        register_task(task_id, session_id, priority, resources)
+
+        def run_in_pool():
+            cancel_event = self._manager.Event()
+            future = self._executor.submit(_run_task_in_process, task_id, func, args,
+                                           with_upstream_results(func, kwargs, dependencies),
+                                           self._progress_queue, cancel_event, resources)
+            with self._lock:
+                self._futures[task_id] = future
+                self._remote_cancel_events[task_id] = cancel_event
+            future.add_done_callback(lambda f: self._finish(task, f))
+
+        # The queue holds back tasks whose resource estimate does not fit next to the running ones
+        task = {"id": task_id, "dispatch": run_in_pool, "session_id": session_id, "priority": priority,
+                "resources": resources}
+        defer_task(task_id, dependencies, lambda: self._queue.put(task))
+        return task_id
+
+    def _finish(self, task: Dict[str, Any], future: Future):
+        task_id = task["id"]
+        with self._lock:
+            self._futures.pop(task_id, None)
+            self._remote_cancel_events.pop(task_id, None)
+        with task_queue.status_lock:
+            local_event = task_queue.task_cancel_events.get(task_id)
+        cancelled = future.cancelled() or (local_event is not None and local_event.is_set())
+
+        try:
+            if cancelled:
+                update_task_status(task_id, "cancelled", 0, "Task cancelled")
+                logging.info(f"Task {task_id} cancelled.")
+            elif future.exception() is not None:
+                e = future.exception()
+                update_task_status(task_id, "failed", 0, f"Error: {str(e)}")
+                logging.error(f"Task {task_id} failed: {e}")
+            else:
+                # Not under status_lock; the result store has its own lock and may write to disk
+                task_queue.task_results[task_id] = future.result()
+                update_task_status(task_id, "completed", 100, "Task completed")
+                logging.info(f"Task {task_id} completed successfully.")
+        finally:
+            self._release(task)
+
+    def cancel(self, task_id: str) -> bool:
+        if not super().cancel(task_id):
+            return False
+        with self._lock:
+            future = self._futures.get(task_id)
+            cancel_event = self._remote_cancel_events.get(task_id)
+        if future is not None:
+            future.cancel()
+        if cancel_event is not None:
+            try:
+                cancel_event.set()
+            except (EOFError, OSError):
+                pass
+        return True
+
+
+def function_reference(func: Callable) -> str:
+    """
+    Return the "module:qualname" reference a worker imports a task function by.
+
+    Raises:
+        ValueError: If the function cannot be imported by name (lambdas, nested functions).
+    """
+    qualname = getattr(func, "__qualname__", "")
+    module = getattr(func, "__module__", None)
+    if not module or not qualname or "<" in qualname:
+        raise ValueError(f"Task functions must be importable module-level functions, got {func!r}")
+    return f"{module}:{qualname}"
+
+
+def resolve_function(reference: str) -> Callable:
+    """Import the function named by a ``function_reference`` string"""
+    module_name, qualname = reference.split(":", 1)
+    target: Any = importlib.import_module(module_name)
+    for attribute in qualname.split("."):
+        target = getattr(target, attribute)
+    return target
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """Open the task database, creating its schema if needed"""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id TEXT PRIMARY KEY,
+            func TEXT NOT NULL,
+            args BLOB NOT NULL,
+            kwargs BLOB NOT NULL,
+            status TEXT NOT NULL,
+            progress REAL NOT NULL DEFAULT 0,
+            message TEXT,
+            result BLOB,
+            session_id TEXT,
+            priority INTEGER NOT NULL DEFAULT 1,
+            resources TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            worker TEXT,
+            heartbeat_at REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0,
+            metrics TEXT,
+            host TEXT
+        )
+        """
+    )
+    # Databases created before stage metrics and worker hosts were recorded
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(tasks)")}
+    if "metrics" not in columns:
+        conn.execute("ALTER TABLE tasks ADD COLUMN metrics TEXT")
+    if "host" not in columns:
+        conn.execute("ALTER TABLE tasks ADD COLUMN host TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, created_at)")
+    return conn
+
+
+class SQLiteBackend(TaskBackend):
+    """
+    Durable task queue stored in a SQLite database.
+
+    Tasks survive restarts of the Streamlit process and are executed by
+    ``SQLiteWorker`` instances, started here with ``start_workers`` or in
+    separate processes with ``python -m src.task_backends``.  Task functions
+    must be importable module-level functions and their arguments and
+    results picklable.
+    """
+
+    def __init__(self, db_path: str = config.TASK_DB_PATH):
+        self.db_path = db_path
+        self._stop_event = threading.Event()
+        self._workers: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        connect(db_path).close()
+
+    def submit(self, func: Callable, args: List, kwargs: Dict[str, Any], session_id: str,
+               priority: int = PRIORITY_NORMAL, resources: Optional[Dict[str, float]] = None,
+               depends_on=None) -> str:
+        if depends_on:
+            raise ValueError("The SQLite task backend does not support task dependencies")
+        reference = function_reference(func)
+        task_id = task_queue.generate_task_id()
+        logging.info(f"Submitting task with id: {task_id} to {self.db_path}, function: {reference}")
+        now = time.time()
+        conn = connect(self.db_path)
+        try:
+            conn.execute(
+                "INSERT INTO tasks (id, func, args, kwargs, status, message, session_id, priority, resources, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, 'queued', 'Task queued', ?, ?, ?, ?, ?)",
+                (task_id, reference, pickle.dumps(list(args)), pickle.dumps(dict(kwargs)), session_id, priority,
+                 json.dumps(resources) if resources else None, now, now),
+            )
+        finally:
+            conn.close()
+        return task_id
+
+    def get_status(self, task_id: str) -> Optional[Dict[str, Any]]:
+        conn = connect(self.db_path)
+        try:
+            row = conn.execute(
+                "SELECT status, progress, message, created_at, updated_at, session_id, priority, worker, attempts, "
+                "version, metrics FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return {
+            "status": row["status"],
+            "progress": row["progress"],
+            "message": row["message"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "user_session_id": row["session_id"],
+            "priority": row["priority"],
+            "worker": row["worker"],
+            "attempts": row["attempts"],
+            "version": row["version"],
+            "metrics": json.loads(row["metrics"]) if row["metrics"] else [],
+        }
+
+    def get_result(self, task_id: str) -> Optional[Any]:
+        conn = connect(self.db_path)
+        try:
+            row = conn.execute("SELECT result FROM tasks WHERE id = ? AND status = 'completed'",
+                               (task_id,)).fetchone()
+        finally:
+            conn.close()
+        return pickle.loads(row["result"]) if row and row["result"] is not None else None
+
+    def cancel(self, task_id: str) -> bool:
+        now = time.time()
+        conn = connect(self.db_path)
+        try:
+            queued = conn.execute(
+                "UPDATE tasks SET status = 'cancelled', message = 'Task cancelled', progress = 0, "
+                "cancel_requested = 1, updated_at = ?, version = version + 1 WHERE id = ? AND status = 'queued'",
+                (now, task_id)).rowcount
+            running = conn.execute(
+                "UPDATE tasks SET cancel_requested = 1, message = 'Cancelling...', updated_at = ?, "
+                "version = version + 1 WHERE id = ? AND status = 'running'", (now, task_id)).rowcount
+        finally:
+            conn.close()
+        if queued or running:
+            logging.info(f"Cancelling task {task_id}")
+        return bool(queued or running)
+
+    def session_task_ids(self, session_id: str) -> List[str]:
+        conn = connect(self.db_path)
+        try:
+            rows = conn.execute("SELECT id FROM tasks WHERE session_id = ?", (session_id,)).fetchall()
+        finally:
+            conn.close()
+        return [row["id"] for row in rows]
+
+    def start_workers(self, num_workers: Optional[int] = None) -> List[Any]:
+        num_workers = num_workers or default_pool_size()
+        with self._lock:
+            self._workers = [t for t in self._workers if t.is_alive()]
+            for i in range(len(self._workers), num_workers):
+                sqlite_worker = SQLiteWorker(self.db_path, worker_id=f"{socket.gethostname()}:{os.getpid()}:{i}")
+                t = threading.Thread(target=sqlite_worker.run, args=(self._stop_event,),
+                                     daemon=True, name=f"sqlite-worker-{i}")
+                t.start()
+                self._workers.append(t)
+                logging.info(f"Started SQLite worker thread: {t.name}")
+            return list(self._workers)
+
+    def stop_workers(self):
+        """Ask worker threads started by this backend to exit after their current task"""
+        self._stop_event.set()
+
+    def cleanup(self, max_age_hours: float, session_id: Optional[str] = None):
+        cutoff = time.time() - max_age_hours * 3600
+        conn = connect(self.db_path)
+        try:
+            query = "DELETE FROM tasks WHERE status IN (?, ?, ?) AND updated_at < ?"
+            params: Tuple = (*FINISHED_STATUSES, cutoff)
+            if session_id is not None:
+                query += " AND session_id = ?"
+                params += (session_id,)
+            removed = conn.execute(query, params).rowcount
+        finally:
+            conn.close()
+        if removed:
+            logging.info(f"Cleaned up {removed} old tasks from {self.db_path}")
+
+
+class SQLiteWorker:
+    """
+    Executes tasks from a ``SQLiteBackend`` database.
+
+    A worker claims one queued task at a time inside an immediate
+    transaction, so concurrent workers never run the same task.  While a
+    task runs, a heartbeat keeps its lease alive and picks up cancellation
+    requests.  Tasks whose worker stopped heartbeating for ``lease_seconds``
+    are claimed again, up to ``max_attempts`` times.  Tasks with a resource
+    estimate are only claimed while this host has the cores and memory free:
+    the cores reserved are those of the tasks running on this host according
+    to the database, so all worker processes of a host share one budget.
+    """
+
+    def __init__(self, db_path: str = config.TASK_DB_PATH, worker_id: Optional[str] = None,
+                 poll_interval: float = 1.0, lease_seconds: float = 60.0, max_attempts: int = 3):
+        self.db_path = db_path
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.host = socket.gethostname()
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # Number of candidates considered per claim when the first ones do not fit this host
+        self.claim_candidates = 20
+
+    def claim(self) -> Optional[sqlite3.Row]:
+        """Claim the oldest runnable task, or return None if there is none"""
+        now = time.time()
+        stale = now - self.lease_seconds
+        conn = connect(self.db_path)
+        row = None
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Tasks cancelled while their worker was lost are not run again
+            conn.execute(
+                "UPDATE tasks SET status = 'cancelled', progress = 0, message = 'Task cancelled', "
+                "updated_at = ?, version = version + 1 WHERE status = 'running' AND heartbeat_at < ? "
+                "AND cancel_requested = 1",
+                (now, stale))
+            conn.execute(
+                "UPDATE tasks SET status = 'failed', message = 'Error: worker lost too many times', "
+                "updated_at = ?, version = version + 1 WHERE status = 'running' AND heartbeat_at < ? "
+                "AND attempts >= ?",
+                (now, stale, self.max_attempts))
+            # Highest priority first, then the session with the fewest running tasks, then oldest
+            candidates = conn.execute(
+                "SELECT * FROM tasks WHERE (status = 'queued' OR (status = 'running' AND heartbeat_at < ?)) "
+                "AND cancel_requested = 0 "
+                "ORDER BY priority, (SELECT COUNT(*) FROM tasks AS running WHERE running.status = 'running' "
+                "AND running.session_id = tasks.session_id AND running.heartbeat_at >= ?), created_at LIMIT ?",
+                (stale, stale, self.claim_candidates)).fetchall()
+            # Read inside the transaction, so workers of other processes on this host cannot overcommit it
+            reserved = [json.loads(running["resources"]) for running in conn.execute(
+                "SELECT resources FROM tasks WHERE status = 'running' AND host = ? AND heartbeat_at >= ? "
+                "AND resources IS NOT NULL", (self.host, stale))]
+            row = next((candidate for candidate in candidates if self._fits(candidate, reserved)), None)
+            if row is not None:
+                if row["status"] == "running":
+                    logging.warning(f"Reclaiming task {row['id']} from unresponsive worker {row['worker']}")
+                conn.execute(
+                    "UPDATE tasks SET status = 'running', progress = 0, message = 'Task started', worker = ?, metrics = NULL, "
+                    "host = ?, heartbeat_at = ?, updated_at = ?, attempts = attempts + 1, version = version + 1 "
+                    "WHERE id = ?",
+                    (self.worker_id, self.host, now, now, row["id"]))
+            conn.execute("COMMIT")
+            return row
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _fits(self, row: sqlite3.Row, reserved: List[Dict[str, float]]) -> bool:
+        """Return True if this host has the cores and memory a task estimates it needs, next to ``reserved``"""
+        if not row["resources"] or not reserved:
+            # A task larger than the host still runs, just on its own
+            return True
+        resources = json.loads(row["resources"])
+        reserved_cores = sum(r.get("cores", 0) for r in reserved)
+        cores_ok = reserved_cores + resources.get("cores", 0) <= (psutil.cpu_count() or 1)
+        return cores_ok and resources.get("memory", 0) <= psutil.virtual_memory().available
+
+    def _update(self, conn: sqlite3.Connection, task_id: str, **fields):
+        """Update a claimed task, unless another worker has taken it over"""
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        conn.execute(f"UPDATE tasks SET {assignments}, version = version + 1 WHERE id = ? AND worker = ?",
+                     (*fields.values(), task_id, self.worker_id))
+
+    def _heartbeat(self, task_id: str, cancel_event: threading.Event, done: threading.Event):
+        conn = connect(self.db_path)
+        try:
+            while not done.wait(min(self.poll_interval, self.lease_seconds / 3)):
+                conn.execute("UPDATE tasks SET heartbeat_at = ? WHERE id = ? AND worker = ?",
+                             (time.time(), task_id, self.worker_id))
+                row = conn.execute("SELECT cancel_requested FROM tasks WHERE id = ?", (task_id,)).fetchone()
+                if row is not None and row["cancel_requested"]:
+                    cancel_event.set()
+        except sqlite3.Error as e:
+            logging.error(f"Heartbeat for task {task_id} failed: {e}")
+        finally:
+            conn.close()
+
+    def run_one(self) -> Optional[str]:
+        """Claim and execute one task.  Returns its id, or None if the queue was empty."""
+        row = self.claim()
+        if row is None:
+            return None
+
+        task_id = row["id"]
+        logging.info(f"Worker {self.worker_id} started processing task: {task_id}, function: {row['func']}")
+        cancel_event = threading.Event()
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(task_id, cancel_event, done), daemon=True)
+        heartbeat.start()
+
+        conn = connect(self.db_path)
+        try:
+            def progress_callback(p, msg=""):
+                if not cancel_event.is_set():
+                    self._update(conn, task_id, progress=p, message=msg, heartbeat_at=time.time())
+
+            metrics = []
+
+            def on_metrics(record):
+                metrics.append(record)
+                self._update(conn, task_id, metrics=json.dumps(metrics, default=str))
+
+            try:
+                func = resolve_function(row["func"])
+                resources = json.loads(row["resources"]) if row["resources"] else None
+                kwargs = _inject_task_kwargs(func, pickle.loads(row["kwargs"]), progress_callback, cancel_event,
+                                             resources, on_metrics)
+                result = func(*pickle.loads(row["args"]), **kwargs)
+            except Exception as e:
+                if cancel_event.is_set():
+                    self._update(conn, task_id, status="cancelled", progress=0, message="Task cancelled")
+                    logging.info(f"Task {task_id} cancelled: {e}")
+                else:
+                    self._update(conn, task_id, status="failed", progress=0, message=f"Error: {str(e)}")
+                    logging.error(f"Task {task_id} failed: {e}", exc_info=True)
+            else:
+                if cancel_event.is_set():
+                    self._update(conn, task_id, status="cancelled", progress=0, message="Task cancelled")
+                    logging.info(f"Task {task_id} cancelled.")
+                else:
+                    self._update(conn, task_id, status="completed", progress=100, message="Task completed",
+                                 result=pickle.dumps(result))
+                    logging.info(f"Task {task_id} completed successfully.")
+        finally:
+            done.set()
+            heartbeat.join()
+            conn.close()
+        return task_id
+
+    def run(self, stop_event: Optional[threading.Event] = None):
+        """Execute tasks until stop_event is set, polling the database while it is empty"""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            try:
+                if self.run_one() is None:
+                    stop_event.wait(self.poll_interval)
+            except Exception as e:
+                logging.error(f"Worker error: {e}", exc_info=True)
+                stop_event.wait(self.poll_interval)
+
+
+def main(argv: Optional[List[str]] = None):
+    """Run SQLite task workers in this process until interrupted"""
+    parser = argparse.ArgumentParser(description="Run workers for the SQLite task queue.")
+    parser.add_argument("--db", default=config.TASK_DB_PATH, help="Path to the shared task database")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker threads")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between polls of an empty queue")
+    parser.add_argument("--lease", type=float, default=60.0,
+                        help="Seconds without heartbeat after which a running task is reclaimed")
+    args = parser.parse_args(argv)
+
+    stop_event = threading.Event()
+    threads = []
+    for i in range(args.workers):
+        sqlite_worker = SQLiteWorker(args.db, f"{socket.gethostname()}:{os.getpid()}:{i}",
+                                     poll_interval=args.poll_interval, lease_seconds=args.lease)
+        t = threading.Thread(target=sqlite_worker.run, args=(stop_event,), name=f"sqlite-worker-{i}")
+        t.start()
+        threads.append(t)
+    logging.info(f"Running {args.workers} workers on {args.db}")
+
+    try:
+        while any(t.is_alive() for t in threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logging.info("Stopping workers after their current tasks...")
+        stop_event.set()
+        for t in threads:
+            t.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,209 @@
 import streamlit as st
 import threading
-import queue
 import time
 import uuid
-from typing import Dict, Any, List, Optional, Callable
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, MutableMapping, Optional, Callable
 import logging
-import os
+
+import psutil
+
+from src import config
+from src.instrumentation import Tracer, to_json, to_prometheus
+from src.result_store import ResultStore
 
 # Configure logging
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Task priorities; lower values are scheduled first
+PRIORITY_HIGH = 0  # Short interactive tasks, e.g. frame extraction
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2  # Long-running tasks, e.g. reconstructions
+
+
+class FairTaskQueue:
+    """
+    Task queue that shares workers fairly between sessions and machine resources.
+
+    Tasks are served by priority first.  Within a priority level each
+    session has its own FIFO and sessions are served round-robin, so a
+    session with many queued tasks cannot starve the others.
+
+    Tasks may carry a "resources" estimate ({"cores": n, "memory": bytes}).
+    Such a task is only handed out while the cores and memory reserved by
+    running tasks, plus its own, fit the machine (checked against live
+    ``psutil`` readings); otherwise smaller tasks behind it may run first,
+    until it has waited ``config.ADMISSION_BACKFILL_LIMIT`` seconds.  Workers
+    return reservations with ``release``.
+
+    ``None`` is accepted as a worker shutdown signal and handed out once no
+    runnable tasks are left.  Supports the ``put``/``get``/``task_done``/``join``
+    subset of ``queue.Queue`` used by the workers.
+    """
+
+    def __init__(self):
+        self._levels: Dict[int, "OrderedDict[str, deque]"] = {}
+        self._reservations: Dict[str, Dict[str, float]] = {}
+        self._shutdown_signals = 0
+        self._unfinished = 0
+        self._size = 0
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+        self._all_done = threading.Condition(self._mutex)
+
+    def put(self, task: Optional[Dict[str, Any]]):
+        """Queue a task dict (keys "session_id", "priority" and "resources" are optional) or a shutdown signal"""
+        with self._mutex:
+            if task is None:
+                self._shutdown_signals += 1
+            else:
+                task.setdefault("queued_at", time.monotonic())
+                sessions = self._levels.setdefault(task.get("priority", PRIORITY_NORMAL), OrderedDict())
+                sessions.setdefault(task.get("session_id", "unknown"), deque()).append(task)
+                self._size += 1
+            self._unfinished += 1
+            self._not_empty.notify()
+
+    def _fits(self, resources: Optional[Dict[str, float]]) -> bool:
+        """Return True if a task with the given estimate can start now"""
+        if not resources or not self._reservations:
+            # A task larger than the machine still runs, just on its own
+            return True
+        reserved_cores = sum(r.get("cores", 0) for r in self._reservations.values())
+        reserved_memory = sum(r.get("memory", 0) for r in self._reservations.values())
+        memory = psutil.virtual_memory()
+        cores_ok = reserved_cores + resources.get("cores", 0) <= (psutil.cpu_count() or 1)
+        memory_ok = reserved_memory + resources.get("memory", 0) <= memory.total * config.ADMISSION_MEMORY_FRACTION \
+            and resources.get("memory", 0) <= memory.available
+        return cores_ok and memory_ok
+
+    def _next_task(self) -> Optional[Dict[str, Any]]:
+        """Remove and return the next admissible task, or None if none can start now"""
+        now = time.monotonic()
+        for level in sorted(self._levels):
+            sessions = self._levels[level]
+            for session_id, tasks in list(sessions.items()):
+                task = tasks[0]
+                if not self._fits(task.get("resources")):
+                    if now - task["queued_at"] > config.ADMISSION_BACKFILL_LIMIT:
+                        # Hold resources back for a task that has waited too long
+                        return None
+                    continue
+                tasks.popleft()
+                # Move the session to the back of the rotation, or drop it once it has nothing queued
+                del sessions[session_id]
+                if tasks:
+                    sessions[session_id] = tasks
+                self._size -= 1
+                if task.get("resources"):
+                    self._reservations[task["id"]] = task["resources"]
+                return task
+        return None
+
+    def get(self) -> Optional[Dict[str, Any]]:
+        """Remove and return the next task, blocking until one is available and admissible"""
+        with self._not_empty:
+            while True:
+                task = self._next_task() if self._size else None
+                if task is not None:
+                    return task
+                if self._shutdown_signals:
+                    self._shutdown_signals -= 1
+                    return None
+                # Memory readings change without notification, so re-check periodically
+                self._not_empty.wait(config.ADMISSION_POLL_INTERVAL if self._size else None)
+
+    def release(self, task: Dict[str, Any]):
+        """Return the resources reserved for a task handed out by ``get``"""
+        with self._mutex:
+            if self._reservations.pop(task.get("id"), None) is not None:
+                self._not_empty.notify_all()
+
+    def task_done(self):
+        """Mark a task returned by ``get`` as processed"""
+        with self._all_done:
+            self._unfinished -= 1
+            if self._unfinished <= 0:
+                self._all_done.notify_all()
+
+    def join(self):
+        """Block until every queued task has been processed"""
+        with self._all_done:
+            while self._unfinished:
+                self._all_done.wait()
+
+    def qsize(self) -> int:
+        """Return the number of queued tasks"""
+        with self._mutex:
+            return self._size
+
+    def empty(self) -> bool:
+        """Return True if no tasks are queued"""
+        return self.qsize() == 0
+
+
 # Global task queue
-task_queue = queue.Queue()
+task_queue = FairTaskQueue()
+
+# Process-wide worker pool shared by all sessions
+_workers: List[threading.Thread] = []
+_workers_lock = threading.Lock()
 
-# Task status tracking
+# Background thread expiring finished tasks of all sessions
+_janitor: Optional[threading.Thread] = None
+
+# Task status tracking.  Status entries are copy-on-write: writers replace an entry
+# with a new dict under status_lock and never mutate it, so readers need no lock.
 task_status: Dict[str, Dict[str, Any]] = {}
-task_results: Dict[str, Any] = {}
+# Bounded in memory; large and least recently used results are spilled to disk
+task_results: MutableMapping = ResultStore()
+
+# Cancellation flags, passed to tasks that accept a cancel_event argument
+task_cancel_events: Dict[str, threading.Event] = {}
 
-# Lock for synchronizing access to task_status and task_results
+# Lock serializing writers of task_status and task_results
 status_lock = threading.Lock()
 
+# Notified whenever a status entry is replaced
+status_changed = threading.Condition(status_lock)
+
+# Tasks waiting for upstream tasks: task id -> {"depends_on": {alias: task id}, "dispatch": callable}
+waiting_tasks: Dict[str, Dict[str, Any]] = {}
+
+# Statuses after which a task no longer changes
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
 
 def generate_task_id() -> str:
     """Generate a unique task ID"""
     return str(uuid.uuid4())
 
 
-def submit_task(func: Callable, args: List, kwargs: Dict[str, Any]) -> str:
-    """
-    Submit a task to the background queue
+def current_session_id() -> str:
+    """Return the Streamlit session id of the caller, or "unknown" outside a session"""
+    return st.session_state.session_id if "session_id" in st.session_state else "unknown"
 
-    Args:
-        func: Function to execute
-        args: Positional arguments
-        kwargs: Keyword arguments
 
-    Returns:
-        task_id: Unique ID for tracking the task
+def default_pool_size() -> int:
+    """
+    Return the number of workers the process-wide pool is sized to.
+
+    Uses ``config.WORKER_POOL_SIZE`` when set, otherwise one worker per CPU
+    core, capped so each worker has ``config.WORKER_MEMORY_PER_TASK`` bytes
+    of the currently available memory.
     """
-    task_id = generate_task_id()
-    logging.info(f"Submitting task with id: {task_id}, function: {func.__name__}")
+    if config.WORKER_POOL_SIZE:
+        return config.WORKER_POOL_SIZE
+    cpu_limit = psutil.cpu_count(logical=False) or psutil.cpu_count() or 1
+    memory_limit = psutil.virtual_memory().available // config.WORKER_MEMORY_PER_TASK
+    return max(1, min(cpu_limit, memory_limit))
 
+
+def register_task(task_id: str, session_id: str, priority: int = PRIORITY_NORMAL,
+                  resources: Optional[Dict[str, float]] = None):
+    """Create the status entry and cancel event of a newly submitted task"""
     with status_lock:
         task_status[task_id] = {
             "status": "queued",
@@ -49,53 +211,142 @@ def submit_task(func: Callable, args: List, kwargs: Dict[str, Any]) -> str:
             "message": "Task queued",
             "created_at": time.time(),
             # Track user session
-            "user_session_id": st.session_state.session_id if "session_id" in st.session_state else "unknown"
+            "user_session_id": session_id,
+            "priority": priority,
+            "resources": resources,
+            # Per-stage timing and resource records, see src.instrumentation
+            "metrics": [],
+            "version": 0
         }
-
-    task_queue.put({
-        "id": task_id,
-        "func": func,
-        "args": args,
-        "kwargs": kwargs
-    })
-
-    return task_id
+        task_cancel_events[task_id] = threading.Event()
+        status_changed.notify_all()
 
 
 def update_task_status(task_id: str, status: str, progress: float, message: str):
     """Update the status of a task"""
+    finished = False
     with status_lock:
-        if task_id in task_status:
-            logging.info(f"Updating task {task_id} status to: {status}, progress: {progress}, message: {message}")
-            task_status[task_id].update({
+        previous = task_status.get(task_id)
+        if previous is not None:
+            finished = status in FINISHED_STATUSES and previous["status"] not in FINISHED_STATUSES
+            # Progress reports are frequent; only log transitions at INFO
+            level = logging.INFO if previous["status"] != status else logging.DEBUG
+            logging.log(level, f"Updating task {task_id} status to: {status}, progress: {progress}, message: {message}")
+            task_status[task_id] = {
+                **previous,
                 "status": status,
                 "progress": progress,
                 "message": message,
-                "updated_at": time.time()
-            })
+                "updated_at": time.time(),
+                "version": previous.get("version", 0) + 1
+            }
+            status_changed.notify_all()
+    if finished:
+        _resolve_dependents(task_id, status)
 
 
-def get_task_status(task_id: str) -> Optional[Dict[str, Any]]:
-    """Get the current status of a task"""
+def record_task_metrics(task_id: str, record: Dict[str, Any]):
+    """Append a stage record from ``src.instrumentation`` to the metrics of a task"""
     with status_lock:
-        status = task_status.get(task_id)
-        logging.info(f"Getting task status for {task_id}: {status}")
-        return status
+        previous = task_status.get(task_id)
+        if previous is not None:
+            task_status[task_id] = {
+                **previous,
+                "metrics": [*previous.get("metrics", ()), record],
+                "version": previous.get("version", 0) + 1
+            }
+            status_changed.notify_all()
 
 
-def get_task_result(task_id: str) -> Optional[Any]:
-    """Get the result of a completed task"""
+def normalize_dependencies(depends_on) -> Dict[str, str]:
+    """
+    Return dependencies as {alias: task id}.
+
+    Args:
+        depends_on: Task ids, or a mapping of the names upstream results are passed under to task ids.
+
+    Raises:
+        ValueError: If a dependency is not a known task.
+    """
+    dependencies = dict(depends_on) if isinstance(depends_on, dict) else {dep: dep for dep in depends_on or ()}
+    unknown = [dep for dep in dependencies.values() if dep not in task_status]
+    if unknown:
+        raise ValueError(f"Unknown upstream tasks: {unknown}")
+    return dependencies
+
+
+def with_upstream_results(func: Callable, kwargs: Dict[str, Any], dependencies: Dict[str, str]) -> Dict[str, Any]:
+    """Add the results of upstream tasks as ``upstream_results``, if the function accepts it"""
+    import inspect
+    if dependencies and "upstream_results" in inspect.signature(func).parameters:
+        kwargs = {**kwargs, "upstream_results": {alias: task_results.get(dep) for alias, dep in dependencies.items()}}
+    return kwargs
+
+
+def defer_task(task_id: str, dependencies: Dict[str, str], dispatch: Callable[[], None]):
+    """
+    Dispatch a registered task once all its dependencies completed.
+
+    If a dependency failed or was cancelled, the task is cancelled instead,
+    which in turn cancels its own dependents.
+    """
     with status_lock:
-        result = task_results.get(task_id)
-        logging.info(f"Getting task result for {task_id}: {result}")
-        return result
+        upstream = {dep: task_status[dep]["status"] for dep in dependencies.values() if dep in task_status}
+        broken = next((dep for dep, status in upstream.items() if status in ("failed", "cancelled")), None)
+        ready = broken is None and all(status == "completed" for status in upstream.values())
+        if broken is None and not ready:
+            waiting_tasks[task_id] = {"depends_on": dependencies, "dispatch": dispatch}
+            # Set under the lock, so a dispatch racing with this cannot be overwritten
+            pending = sum(status != "completed" for status in upstream.values())
+            previous = task_status[task_id]
+            task_status[task_id] = {**previous, "message": f"Waiting for {pending} upstream tasks",
+                                    "version": previous.get("version", 0) + 1}
+            status_changed.notify_all()
+
+    if broken is not None:
+        _cancel_dependent(task_id, broken, upstream[broken])
+    elif ready:
+        dispatch()
+
+
+def _cancel_dependent(task_id: str, upstream_id: str, upstream_status: str):
+    with status_lock:
+        task_cancel_events.setdefault(task_id, threading.Event()).set()
+    logging.info(f"Cancelling task {task_id}: upstream task {upstream_id} {upstream_status}")
+    update_task_status(task_id, "cancelled", 0, f"Cancelled: upstream task {upstream_id} {upstream_status}")
+
+
+def _resolve_dependents(task_id: str, status: str):
+    """Dispatch or cancel the tasks waiting for a task that just finished"""
+    to_dispatch = []
+    to_cancel = []
+    with status_lock:
+        waiting_tasks.pop(task_id, None)
+        for dependent_id, waiting in list(waiting_tasks.items()):
+            if task_id not in waiting["depends_on"].values():
+                continue
+            if status != "completed":
+                to_cancel.append(dependent_id)
+                del waiting_tasks[dependent_id]
+            elif all(task_status.get(dep, {}).get("status") == "completed"
+                     for dep in waiting["depends_on"].values()):
+                to_dispatch.append(waiting["dispatch"])
+                del waiting_tasks[dependent_id]
+
+    for dependent_id in to_cancel:
+        _cancel_dependent(dependent_id, task_id, status)
+    for dispatch in to_dispatch:
+        dispatch()
 
 
 def worker():
     """Worker thread to process tasks from the queue"""
     while True:
+        # Tests and backends may swap the queue; finish each task on the queue it came from
+        current_queue = task_queue
+        task = None
         try:
-            task = task_queue.get()
+            task = current_queue.get()
             if task is None:
                 logging.info("Worker received shutdown signal.")
                 break  # Shutdown signal
@@ -105,64 +356,438 @@ def worker():
             args = task["args"]
             kwargs = task["kwargs"]
 
+            with status_lock:
+                cancel_event = task_cancel_events.setdefault(task_id, threading.Event())
+            if cancel_event.is_set():
+                logging.info(f"Skipping cancelled task: {task_id}")
+                continue
+
             logging.info(f"Worker started processing task: {task_id}, function: {func.__name__}")
 
             # Update status to running
             update_task_status(task_id, "running", 0, "Task started")
 
             try:
-                # Add progress callback to kwargs, if the function accepts it
+                # Add progress callback and cancel event to kwargs, if the function accepts them
                 import inspect
-                if 'progress_callback' in inspect.signature(func).parameters:
+                parameters = inspect.signature(func).parameters
+                if 'progress_callback' in parameters:
                     def progress_callback(p, msg=""):
-                        update_task_status(task_id, "running", p, msg)
+                        if not cancel_event.is_set():
+                            update_task_status(task_id, "running", p, msg)
 
                     kwargs["progress_callback"] = progress_callback
+                if 'cancel_event' in parameters:
+                    kwargs["cancel_event"] = cancel_event
+                if 'num_threads' in parameters and task.get("resources"):
+                    kwargs["num_threads"] = task["resources"].get("cores")
+                if 'tracer' in parameters:
+                    kwargs["tracer"] = Tracer(on_record=lambda record: record_task_metrics(task_id, record))
 
                 # Execute the task
                 result = func(*args, **kwargs)
 
-                # Store result
-                with status_lock:
+                if cancel_event.is_set():
+                    update_task_status(task_id, "cancelled", 0, "Task cancelled")
+                    logging.info(f"Task {task_id} cancelled.")
+                else:
+                    # Store the result outside status_lock: the result store may write it, or
+                    # older results, to disk, which must not stall status updates and waiters
                     task_results[task_id] = result
-                update_task_status(task_id, "completed", 100, "Task completed")
-                logging.info(f"Task {task_id} completed successfully.")
+                    update_task_status(task_id, "completed", 100, "Task completed")
+                    logging.info(f"Task {task_id} completed successfully.")
 
             except Exception as e:
-                # Handle errors
-                update_task_status(task_id, "failed", 0, f"Error: {str(e)}")
-                # Add logging for debugging
-                logging.error(f"Task {task_id} failed: {e}", exc_info=True)
+                if cancel_event.is_set():
+                    update_task_status(task_id, "cancelled", 0, "Task cancelled")
+                    logging.info(f"Task {task_id} cancelled: {e}")
+                else:
+                    # Handle errors
+                    update_task_status(task_id, "failed", 0, f"Error: {str(e)}")
+                    # Add logging for debugging
+                    logging.error(f"Task {task_id} failed: {e}", exc_info=True)
 
         except Exception as e:
             logging.error(f"Worker error: {e}", exc_info=True)
         finally:
-            task_queue.task_done()
+            if task is not None and isinstance(current_queue, FairTaskQueue):
+                current_queue.release(task)
+            current_queue.task_done()
+
+
+class TaskBackend(ABC):
+    """
+    Execution backend behind submit_task, get_task_status and get_task_result.
+
+    Status dictionaries carry at least "status" ("queued", "running",
+    "completed", "failed" or "cancelled"), "progress", "message",
+    "created_at" and "user_session_id".  Subclasses implement every
+    abstract method, so an incomplete backend fails when it is created.
+    """
+
+    @abstractmethod
+    def submit(self, func: Callable, args: List, kwargs: Dict[str, Any], session_id: str,
+               priority: int = PRIORITY_NORMAL, resources: Optional[Dict[str, float]] = None,
+               depends_on=None) -> str:
+        """Queue a task and return its id.  See ``submit_task`` for the arguments."""
+        ...
+
+    @abstractmethod
+    def get_status(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Return the status of a task, or None if it is unknown"""
+        ...
+
+    @abstractmethod
+    def get_result(self, task_id: str) -> Optional[Any]:
+        """Return the result of a completed task, or None"""
+        ...
+
+    @abstractmethod
+    def cancel(self, task_id: str) -> bool:
+        """Cancel a queued or running task.  Returns False if it already finished or is unknown"""
+        ...
+
+    @abstractmethod
+    def session_task_ids(self, session_id: str) -> List[str]:
+        """Return the ids of the tasks submitted by a session"""
+        ...
+
+    @abstractmethod
+    def start_workers(self, num_workers: Optional[int] = None) -> List[Any]:
+        """
+        Ensure the process-wide workers are running and return handles to them.
+
+        Repeated calls (e.g. one per session) do not add workers beyond
+        ``num_workers``, which defaults to ``default_pool_size()``.
+        """
+        ...
+
+    @abstractmethod
+    def cleanup(self, max_age_hours: float, session_id: Optional[str] = None):
+        """Forget finished tasks older than max_age_hours, of one session or of all sessions"""
+        ...
+
+    def wait_for_change(self, task_id: str, version: int, timeout: Optional[float]) -> Optional[Dict[str, Any]]:
+        """
+        Block until the status version of a task exceeds ``version`` or the timeout expires.
+
+        This default implementation polls ``get_status``.
+
+        Returns:
+            The current status, or None if the task is unknown.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            status = self.get_status(task_id)
+            if status is None or status.get("version", 0) > version:
+                return status
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return status
+            time.sleep(config.STATUS_POLL_INTERVAL if remaining is None else min(config.STATUS_POLL_INTERVAL, remaining))
+
+
+class ThreadBackend(TaskBackend):
+    """Runs tasks on worker threads of this process, keeping their state in the module globals"""
+
+    def submit(self, func: Callable, args: List, kwargs: Dict[str, Any], session_id: str,
+               priority: int = PRIORITY_NORMAL, resources: Optional[Dict[str, float]] = None,
+               depends_on=None) -> str:
+        dependencies = normalize_dependencies(depends_on)
+        task_id = generate_task_id()
+        logging.info(f"Submitting task with id: {task_id}, function: {func.__name__}")
+
+        register_task(task_id, session_id, priority, resources)
+
+        def dispatch():
+            task_queue.put({
+                "id": task_id,
+                "func": func,
+                "args": args,
+                "kwargs": with_upstream_results(func, kwargs, dependencies),
+                "session_id": session_id,
+                "priority": priority,
+                "resources": resources
+            })
+
+        defer_task(task_id, dependencies, dispatch)
+        return task_id
 
-def start_workers(num_workers=2):
-    """Start worker threads"""
-    workers = []
-    for i in range(num_workers):
-        t = threading.Thread(target=worker, daemon=True, name=f"worker-{i}")
-        t.start()
-        workers.append(t)
-        logging.info(f"Started worker thread: {t.name}")
-    return workers
+    def get_status(self, task_id: str) -> Optional[Dict[str, Any]]:
+        # Entries are replaced, never mutated, so a plain lookup is a consistent snapshot
+        status = task_status.get(task_id)
+        logging.debug(f"Getting task status for {task_id}: {status}")
+        return status
+
+    def get_result(self, task_id: str) -> Optional[Any]:
+        result = task_results.get(task_id)
+        logging.debug(f"Getting task result for {task_id}: {result}")
+        return result
+
+    def wait_for_change(self, task_id: str, version: int, timeout: Optional[float]) -> Optional[Dict[str, Any]]:
+        with status_changed:
+            status_changed.wait_for(
+                lambda: task_status.get(task_id) is None or task_status[task_id].get("version", 0) > version,
+                timeout)
+            return task_status.get(task_id)
+
+    def cancel(self, task_id: str) -> bool:
+        with status_lock:
+            status = task_status.get(task_id)
+            if status is None or status["status"] not in ("queued", "running"):
+                return False
+            event = task_cancel_events.setdefault(task_id, threading.Event())
+            event.set()
+            was_queued = status["status"] == "queued"
+
+        logging.info(f"Cancelling task {task_id}")
+        if was_queued:
+            update_task_status(task_id, "cancelled", 0, "Task cancelled")
+        else:
+            update_task_status(task_id, "running", status["progress"], "Cancelling...")
+        return True
+
+    def session_task_ids(self, session_id: str) -> List[str]:
+        return [task_id for task_id, status in list(task_status.items())
+                if status.get("user_session_id") == session_id]
+
+    def start_workers(self, num_workers: Optional[int] = None) -> List[Any]:
+        num_workers = num_workers or default_pool_size()
+        with _workers_lock:
+            # Workers exit on a shutdown signal; replace them instead of counting them
+            _workers[:] = [t for t in _workers if t.is_alive()]
+            for i in range(len(_workers), num_workers):
+                t = threading.Thread(target=worker, daemon=True, name=f"worker-{i}")
+                t.start()
+                _workers.append(t)
+                logging.info(f"Started worker thread: {t.name}")
+            return list(_workers)
+
+    def cleanup(self, max_age_hours: float, session_id: Optional[str] = None):
+        current_time = time.time()
+        with status_lock:
+            for task_id in list(task_status.keys()):
+                status = task_status[task_id]
+                if status["status"] in ["completed", "failed", "cancelled"]:
+                    task_age = current_time - \
+                        status.get("updated_at", current_time)
+                    if task_age > max_age_hours * 3600:
+                        # Remove old tasks
+                        if session_id is None or status.get("user_session_id") == session_id:
+                            task_status.pop(task_id, None)
+                            task_results.pop(task_id, None)
+                            task_cancel_events.pop(task_id, None)
+                            logging.info(f"Cleaned up old task: {task_id}")
+            status_changed.notify_all()
+
+
+# Backend used by the module-level functions, created from config.TASK_BACKEND on first use
+_backend: Optional[TaskBackend] = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name: str) -> TaskBackend:
+    """Create a task backend by name: "thread", "process" or "sqlite" """
+    if name == "thread":
+        return ThreadBackend()
+    # Imported here because the other backends build on this module
+    from src import task_backends
+    if name == "process":
+        return task_backends.ProcessPoolBackend()
+    if name == "sqlite":
+        return task_backends.SQLiteBackend(config.TASK_DB_PATH)
+    raise ValueError(f"Unknown task backend: {name}")
+
+
+def get_backend() -> TaskBackend:
+    """Return the active task backend"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend(config.TASK_BACKEND)
+        return _backend
+
+
+def set_backend(backend: Optional[TaskBackend]):
+    """Replace the active task backend.  None restores the configured backend on next use."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def submit_task(func: Callable, args: List, kwargs: Dict[str, Any], priority: int = PRIORITY_NORMAL,
+                resources: Optional[Dict[str, float]] = None, depends_on=None) -> str:
+    """
+    Submit a task to the background queue
+
+    Args:
+        func: Function to execute
+        args: Positional arguments
+        kwargs: Keyword arguments
+        priority: PRIORITY_HIGH for short tasks, PRIORITY_LOW for long-running ones
+        resources: Estimated {"cores": n, "memory": bytes} the task needs.  The task is only
+            started when they are available, and receives ``num_threads`` if it accepts it.
+        depends_on: Ids of tasks that must complete first, or a mapping of names to such ids.  The
+            task stays queued until they complete and receives their results as ``upstream_results``
+            ({name or id: result}) if it accepts it.  If one of them fails or is cancelled, the task
+            is cancelled too.
+
+    Returns:
+        task_id: Unique ID for tracking the task
+    """
+    return get_backend().submit(func, args, kwargs, current_session_id(), priority, resources, depends_on)
+
+
+def submit_task_graph(graph: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Submit a graph of tasks that depend on each other.
+
+    Independent branches run in parallel; each task starts once the tasks
+    it depends on completed, and a failure cancels only the tasks
+    downstream of it.
+
+    Args:
+        graph: Task specifications keyed by node name.  Each has "func" and optionally "args",
+            "kwargs", "priority", "resources" and "depends_on" (a list of node names, whose
+            results are passed by node name as ``upstream_results``).
+
+    Returns:
+        The task id of each node.
+
+    Raises:
+        ValueError: If the graph refers to unknown nodes or has a cycle.
+    """
+    unknown = {dep for node in graph.values() for dep in node.get("depends_on", ())} - set(graph)
+    if unknown:
+        raise ValueError(f"Unknown task graph nodes: {sorted(unknown)}")
+
+    # Order the nodes so each comes after its dependencies, before submitting any of them
+    order: List[str] = []
+    remaining = dict(graph)
+    while remaining:
+        ready = [name for name, node in remaining.items()
+                 if all(dep in order for dep in node.get("depends_on", ()))]
+        if not ready:
+            raise ValueError(f"Task graph has a cycle among: {sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        order.extend(ready)
+
+    task_ids: Dict[str, str] = {}
+    for name in order:
+        node = graph[name]
+        task_ids[name] = submit_task(
+            node["func"], node.get("args", []), node.get("kwargs", {}),
+            priority=node.get("priority", PRIORITY_NORMAL), resources=node.get("resources"),
+            depends_on={dep: task_ids[dep] for dep in node.get("depends_on", ())})
+    return task_ids
+
+
+def get_task_status(task_id: str) -> Optional[Dict[str, Any]]:
+    """Get the current status of a task"""
+    return get_backend().get_status(task_id)
+
+
+def get_task_result(task_id: str) -> Optional[Any]:
+    """Get the result of a completed task"""
+    return get_backend().get_result(task_id)
+
+
+def wait_for_status_change(task_id: str, version: int, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """
+    Wait for a task's status to change.
+
+    Args:
+        task_id: Task to watch.
+        version: The "version" of the last status seen; use -1 to return immediately.
+        timeout: Maximum seconds to wait, or None to wait indefinitely.
+
+    Returns:
+        The current status, which is unchanged if the timeout expired, or None if the task is unknown.
+    """
+    return get_backend().wait_for_change(task_id, version, timeout)
+
+
+def export_task_metrics(task_ids: Optional[List[str]] = None, fmt: str = "json") -> str:
+    """
+    Export the per-stage metrics of tasks.
+
+    Args:
+        task_ids: Tasks to export; all tasks of the current session if None.
+        fmt: "json" or "prometheus".  Records are labelled with their task id.
+
+    Raises:
+        ValueError: If the format is unknown.
+    """
+    if fmt not in ("json", "prometheus"):
+        raise ValueError(f"Unknown metrics format: {fmt}")
+    backend = get_backend()
+    if task_ids is None:
+        task_ids = backend.session_task_ids(current_session_id())
+    records = []
+    for task_id in task_ids:
+        status = backend.get_status(task_id)
+        for record in (status or {}).get("metrics", ()):
+            records.append({**record, "labels": {"task_id": task_id, **record.get("labels", {})}})
+    return to_json(records) if fmt == "json" else to_prometheus(records)
+
+
+def cancel_task(task_id: str) -> bool:
+    """
+    Cancel a queued or running task.
+
+    A queued task is marked cancelled and never started.  A running task is
+    signalled through its cancel event; tasks accepting a ``cancel_event``
+    argument are expected to stop promptly (e.g. by terminating COLMAP).
+
+    Returns:
+        True if the task was queued or running, False otherwise.
+    """
+    return get_backend().cancel(task_id)
+
+
+def cancel_session_tasks(session_id: str) -> List[str]:
+    """Cancel every queued or running task submitted by a session.  Returns the cancelled task ids."""
+    backend = get_backend()
+    return [task_id for task_id in backend.session_task_ids(session_id) if backend.cancel(task_id)]
+
+
+def start_workers(num_workers=None):
+    """Start the process-wide worker pool if it is not running yet"""
+    return get_backend().start_workers(num_workers)
+
+
+def _janitor_loop(interval: float, max_age_hours: float, stop_event: threading.Event):
+    while not stop_event.wait(interval):
+        try:
+            get_backend().cleanup(max_age_hours, None)
+        except Exception as e:
+            logging.error(f"Task janitor error: {e}", exc_info=True)
+
+
+def start_janitor(interval: float = config.TASK_CLEANUP_INTERVAL,
+                  max_age_hours: float = config.TASK_MAX_AGE_HOURS,
+                  stop_event: Optional[threading.Event] = None) -> threading.Thread:
+    """
+    Start the background thread that forgets finished tasks of every session, if it is not running yet.
+
+    Args:
+        interval: Seconds between cleanups.
+        max_age_hours: Age after which finished tasks and their results are removed.
+        stop_event: Optional event that stops the janitor when set.
+    """
+    global _janitor
+    with _workers_lock:
+        if _janitor is None or not _janitor.is_alive():
+            _janitor = threading.Thread(target=_janitor_loop,
+                                        args=(interval, max_age_hours, stop_event or threading.Event()),
+                                        daemon=True, name="task-janitor")
+            _janitor.start()
+            logging.info("Started task janitor thread")
+        return _janitor
 
 
 def cleanup_old_tasks(max_age_hours=24):
     """Clean up old completed tasks"""
-    current_time = time.time()
-    with status_lock:
-        for task_id in list(task_status.keys()):
-            status = task_status[task_id]
-            if status["status"] in ["completed", "failed"]:
-                task_age = current_time - \
-                    status.get("updated_at", current_time)
-                if task_age > max_age_hours * 3600:
-                    # Remove old tasks
-                    # Only clean up tasks associated with the current session
-                    if status.get("user_session_id") == st.session_state.get("session_id"):
-                        task_status.pop(task_id, None)
-                        task_results.pop(task_id, None)
-                        logging.info(f"Cleaned up old task: {task_id}")
+    # Only clean up tasks associated with the current session
+    get_backend().cleanup(max_age_hours, st.session_state.get("session_id"))
@@ -0,0 +1,202 @@
+"""
+Tests for the binary COLMAP model reader and sparse model selection.
+"""
+
+import os
+import struct
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from src.photogrammetry import colmap_model, colmap_wrapper
+
+
+def write_model(model_dir, cameras, images, points):
+    """
+    Write a binary COLMAP model.
+
+    Args:
+        cameras: List of (camera_id, model_id, width, height, params).
+        images: List of (image_id, qvec, tvec, camera_id, name, [(x, y, point3D_id), ...]).
+        points: List of (point3D_id, xyz, rgb, error, [(image_id, point2D_idx), ...]).
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    with open(os.path.join(model_dir, "cameras.bin"), "wb") as f:
+        f.write(struct.pack("<Q", len(cameras)))
+        for camera_id, model_id, width, height, params in cameras:
+            f.write(struct.pack("<iiQQ", camera_id, model_id, width, height))
+            f.write(struct.pack(f"<{len(params)}d", *params))
+    with open(os.path.join(model_dir, "images.bin"), "wb") as f:
+        f.write(struct.pack("<Q", len(images)))
+        for image_id, qvec, tvec, camera_id, name, points2D in images:
+            f.write(struct.pack("<i4d3di", image_id, *qvec, *tvec, camera_id))
+            f.write(name.encode() + b"\0")
+            f.write(struct.pack("<Q", len(points2D)))
+            for x, y, point3D_id in points2D:
+                f.write(struct.pack("<ddq", x, y, point3D_id))
+    with open(os.path.join(model_dir, "points3D.bin"), "wb") as f:
+        f.write(struct.pack("<Q", len(points)))
+        for point3D_id, xyz, rgb, error, track in points:
+            f.write(struct.pack("<Q3d3BdQ", point3D_id, *xyz, *rgb, error, len(track)))
+            for image_id, point2D_idx in track:
+                f.write(struct.pack("<ii", image_id, point2D_idx))
+
+
+class TestColmapModel(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.sparse_dir = self.temp_dir.name
+        self.model_dir = os.path.join(self.sparse_dir, "0")
+        write_model(
+            self.model_dir,
+            cameras=[(1, 2, 640, 480, [500.0, 320.0, 240.0, 0.01]), (2, 1, 800, 600, [600.0, 610.0, 400.0, 300.0])],
+            images=[
+                (1, (1, 0, 0, 0), (0, 0, 0), 1, "frame_0001.jpg", [(10.5, 20.5, 1), (30.0, 40.0, -1)]),
+                (2, (0.7, 0.7, 0, 0), (1, 2, 3), 2, "frame_0002.jpg", [(11.0, 21.0, 1), (31.0, 41.0, 2)]),
+                (5, (1, 0, 0, 0), (0, 0, 1), 1, "frame_0005.jpg", []),
+            ],
+            points=[
+                (1, (0.1, 0.2, 0.3), (255, 0, 0), 0.5, [(1, 0), (2, 0)]),
+                (2, (1.0, 2.0, 3.0), (0, 255, 0), 2.0, [(2, 1), (5, 0), (1, 1)]),
+                (3, (4.0, 5.0, 6.0), (0, 0, 255), 1.0, []),
+            ],
+        )
+        self.model = colmap_model.ColmapModel(self.model_dir)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_cameras(self):
+        cameras = self.model.cameras
+        self.assertEqual(cameras["camera_id"].tolist(), [1, 2])
+        self.assertEqual(cameras["width"].tolist(), [640, 800])
+        self.assertEqual(cameras["num_params"].tolist(), [4, 4])
+        np.testing.assert_array_equal(cameras["params"][0, :4], [500.0, 320.0, 240.0, 0.01])
+        self.assertTrue(np.isnan(cameras["params"][0, 4:]).all())
+
+    def test_images_and_lazy_observations(self):
+        images = self.model.images
+        self.assertEqual(self.model.num_registered_images, 3)
+        self.assertEqual(images["image_id"].tolist(), [1, 2, 5])
+        np.testing.assert_array_equal(images["tvec"][1], [1, 2, 3])
+        self.assertEqual(self.model.image_names[2], "frame_0002.jpg")
+
+        points2D = self.model.points2D(2)
+        np.testing.assert_array_equal(points2D["xy"], [[11.0, 21.0], [31.0, 41.0]])
+        self.assertEqual(points2D["point3D_id"].tolist(), [1, 2])
+        self.assertEqual(len(self.model.points2D(5)), 0)
+        with self.assertRaises(KeyError):
+            self.model.points2D(3)
+
+    def test_points_and_tracks(self):
+        points = self.model.points3D
+        self.assertEqual(self.model.num_points3D, 3)
+        self.assertEqual(points["point3D_id"].tolist(), [1, 2, 3])
+        np.testing.assert_array_equal(points["xyz"][1], [1.0, 2.0, 3.0])
+        np.testing.assert_array_equal(points["rgb"][2], [0, 0, 255])
+        self.assertEqual(points["track_length"].tolist(), [2, 3, 0])
+
+        tracks = self.model.tracks
+        self.assertEqual(tracks["image_id"].tolist(), [1, 2, 2, 5, 1])
+        self.assertEqual(tracks["point2D_idx"].tolist(), [0, 0, 1, 0, 1])
+        self.assertEqual(self.model.track_starts.tolist(), [0, 2, 5])
+
+    def test_statistics(self):
+        self.assertEqual(self.model.track_length_histogram().tolist(), [1, 0, 1, 1])
+        self.assertAlmostEqual(self.model.mean_reprojection_error(), (0.5 * 2 + 2.0 * 3) / 5)
+        self.assertEqual(self.model.observations_per_image(), {1: 2, 2: 2, 5: 1})
+
+    def test_wrapper_helpers_read_mapper_output(self):
+        self.assertEqual(colmap_model.find_model_dir(self.sparse_dir), self.model_dir)
+        self.assertEqual(colmap_wrapper.get_number_of_registered_images(self.sparse_dir), 3)
+        self.assertEqual(colmap_wrapper.get_number_of_registered_images(self.model_dir), 3)
+        self.assertAlmostEqual(colmap_wrapper.estimate_sparsity(self.sparse_dir), 1 / 3)
+
+        with tempfile.TemporaryDirectory() as empty_dir:
+            self.assertIsNone(colmap_model.find_model_dir(empty_dir))
+            self.assertEqual(colmap_wrapper.get_number_of_registered_images(empty_dir), 0)
+            self.assertEqual(colmap_wrapper.estimate_sparsity(empty_dir), 1.0)
+
+    def test_copy_binary_model(self):
+        with tempfile.TemporaryDirectory() as copy_dir:
+            colmap_wrapper.copy_colmap_model(self.model_dir, copy_dir)
+            self.assertEqual(colmap_wrapper.get_number_of_registered_images(copy_dir), 3)
+
+
+def write_component(model_dir, image_names, num_points):
+    """Write a model registering the given images, with points observed in all of them."""
+    images = [(i + 1, (1, 0, 0, 0), (0, 0, i), 1, name, []) for i, name in enumerate(image_names)]
+    track = [(i + 1, 0) for i in range(len(image_names))]
+    points = [(j + 1, (0, 0, j), (0, 0, 0), 1.0, track) for j in range(num_points)]
+    write_model(model_dir, [(1, 0, 640, 480, [500.0, 320.0, 240.0])], images, points)
+
+
+class TestModelSelection(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.sparse_dir = self.temp_dir.name
+        # The mapper numbers components in the order it builds them, not by size
+        write_component(os.path.join(self.sparse_dir, "0"), ["a.jpg", "b.jpg"], 5)
+        write_component(os.path.join(self.sparse_dir, "1"), [f"{i}.jpg" for i in range(6)], 50)
+        write_component(os.path.join(self.sparse_dir, "2"), ["3.jpg", "4.jpg", "5.jpg", "x.jpg"], 20)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _registered(self, name):
+        return set(colmap_model.ColmapModel(os.path.join(self.sparse_dir, name)).image_names.values())
+
+    def test_best_model_moves_to_zero(self):
+        models = colmap_wrapper.select_sparse_model(self.sparse_dir)
+
+        self.assertEqual([m["registered_images"] for m in models], [6, 4, 2])
+        self.assertEqual([m["points"] for m in models], [50, 20, 5])
+        self.assertEqual([os.path.basename(m["path"]) for m in models], ["0", "1", "2"])
+        self.assertEqual(self._registered("0"), {f"{i}.jpg" for i in range(6)})
+        self.assertEqual(self._registered("2"), {"a.jpg", "b.jpg"})
+        self.assertEqual(sorted(os.listdir(self.sparse_dir)), ["0", "1", "2"])
+
+    def test_ties_are_broken_by_points(self):
+        ranked = colmap_wrapper.rank_models([
+            {"path": "0", "registered_images": 4, "points": 10},
+            {"path": "1", "registered_images": 4, "points": 30},
+        ])
+        self.assertEqual([m["path"] for m in ranked], ["1", "0"])
+
+    @patch("src.photogrammetry.colmap_wrapper._run_command")
+    def test_overlapping_models_are_merged(self, mock_run):
+        def fake_merger(name, command, *args, **kwargs):
+            inputs = [command[command.index(flag) + 1] for flag in ("--input_path1", "--input_path2")]
+            names = set().union(*(colmap_model.ColmapModel(path).image_names.values() for path in inputs))
+            write_component(command[command.index("--output_path") + 1], sorted(names), 60)
+        mock_run.side_effect = fake_merger
+
+        models = colmap_wrapper.select_sparse_model(self.sparse_dir, merge=True)
+
+        # Only the model sharing at least MODEL_MERGE_MIN_SHARED_IMAGES images is merged
+        self.assertEqual(mock_run.call_count, 1)
+        self.assertEqual(models[0]["registered_images"], 7)
+        self.assertEqual(self._registered("0"), {f"{i}.jpg" for i in range(6)} | {"x.jpg"})
+        self.assertEqual(len(models), 4)
+        self.assertEqual(sorted(os.listdir(self.sparse_dir)), ["0", "1", "2", "3"])
+
+    @patch("src.photogrammetry.colmap_wrapper._run_command",
+           side_effect=colmap_wrapper.COLMAPError("no consistent transform"))
+    def test_failed_merge_keeps_best_model(self, mock_run):
+        models = colmap_wrapper.select_sparse_model(self.sparse_dir, merge=True)
+        self.assertEqual(models[0]["registered_images"], 6)
+        self.assertEqual(len(models), 3)
+
+    def test_merging_changes_mapping_fingerprint(self):
+        stages = [("mapping", "Map creation", ["colmap", "mapper"], 50, [])]
+        image_dir = os.path.join(self.sparse_dir, "0")
+        self.assertNotEqual(colmap_wrapper._stage_fingerprints(image_dir, stages),
+                            colmap_wrapper._stage_fingerprints(image_dir, stages, {"mapping": "merge_models"}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -16,6 +16,9 @@ class TestConfig(unittest.TestCase):
     def test_default_video_fps(self):
         self.assertEqual(config.DEFAULT_VIDEO_FPS, 1)
 
+    def test_default_keyframe_budget(self):
+        self.assertEqual(config.DEFAULT_KEYFRAME_BUDGET, 120)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,263 @@
+"""
+Tests for the engines that execute COLMAP stages.
+"""
+
+import os
+import threading
+import types
+import unittest
+from unittest.mock import Mock, patch
+
+from src import config
+from src.instrumentation import Tracer
+from src.photogrammetry import colmap_model, colmap_wrapper, engines
+from tests.test_colmap_model import write_component
+from tests.test_photogrammetry import ColmapWorkspaceTestCase, FakePopen
+
+
+class TestCommandParsing(unittest.TestCase):
+
+    def test_arguments_and_sections(self):
+        arguments, sections = engines.parse_command([
+            "colmap", "feature_extractor",
+            "--database_path", "db.db",
+            "--ImageReader.single_camera", "1",
+            "--ImageReader.camera_model", "SIMPLE_RADIAL",
+            "--SiftExtraction.use_gpu", "false",
+            "--SiftExtraction.peak_threshold", "0.004",
+        ])
+        self.assertEqual(arguments, {"database_path": "db.db"})
+        self.assertEqual(sections, {
+            "ImageReader": {"single_camera": 1, "camera_model": "SIMPLE_RADIAL"},
+            "SiftExtraction": {"use_gpu": False, "peak_threshold": 0.004},
+        })
+
+
+class TestEngineSelection(ColmapWorkspaceTestCase):
+
+    def test_default_engine_is_configured(self):
+        self.assertEqual(engines.create_engine().name, config.COLMAP_ENGINE)
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            engines.create_engine("colmap-server")
+        with self.assertRaises(ValueError):
+            colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir, engine="colmap-server")
+
+    @unittest.skipIf(engines.pycolmap is not None, "pycolmap is installed")
+    def test_pycolmap_engine_requires_pycolmap(self):
+        with self.assertRaises(colmap_wrapper.COLMAPError):
+            engines.create_engine("pycolmap")
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_cli_engine_runs_configured_executable(self, mock_run):
+        mock_run.side_effect = self._fake_colmap
+        tracer = Tracer()
+        with patch.object(config, "COLMAP_EXECUTABLE", "/opt/colmap/bin/colmap"):
+            colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir, engine="cli",
+                                      tracer=tracer)
+
+        self.assertEqual({c.args[0][0] for c in mock_run.call_args_list}, {"/opt/colmap/bin/colmap"})
+        self.assertEqual({record["labels"]["engine"] for record in tracer.records
+                          if "command" in record["labels"]}, {"cli"})
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_database_creation_and_merging_run_configured_executable(self, mock_run):
+        mock_run.side_effect = self._fake_colmap
+        write_overlapping_models(self.sparse_dir)
+        with patch.object(config, "COLMAP_EXECUTABLE", "/opt/colmap/bin/colmap"):
+            colmap_wrapper.create_empty_colmap_database(self.database_path, "cli")
+            models = colmap_wrapper.select_sparse_model(self.sparse_dir, merge=True,
+                                                        runner=engines.create_engine("cli"))
+
+        self.assertEqual(self._commands(mock_run), ["database_creator", "model_merger"])
+        self.assertEqual({c.args[0][0] for c in mock_run.call_args_list}, {"/opt/colmap/bin/colmap"})
+        self.assertEqual(models[0]["registered_images"], 7)
+
+    def _fake_colmap(self, command, **kwargs):
+        if command[1] == "model_merger":
+            # Writes the union of the two input models
+            names = set()
+            for flag in ("--input_path1", "--input_path2"):
+                model_dir = command[command.index(flag) + 1]
+                names.update(colmap_model.ColmapModel(model_dir).image_names.values())
+            write_component(command[command.index("--output_path") + 1], sorted(names), 60)
+            return FakePopen(command)
+        return super()._fake_colmap(command, **kwargs)
+
+
+def write_overlapping_models(sparse_dir):
+    """Write two mapper models sharing three images, which select_sparse_model merges."""
+    write_component(os.path.join(sparse_dir, "0"), [f"{i}.jpg" for i in range(6)], 50)
+    write_component(os.path.join(sparse_dir, "1"), ["3.jpg", "4.jpg", "5.jpg", "x.jpg"], 20)
+
+
+def options_class(name, **defaults):
+    """A pycolmap options class with the given options and default values."""
+    return type(name, (), defaults)
+
+
+class StubReconstruction:
+    """Stands in for pycolmap.Reconstruction, writing a small two-image model."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.exported_to = None
+
+    def write(self, model_dir):
+        write_component(model_dir, ["a.jpg", "b.jpg"], 10)
+
+    def export_PLY(self, path):
+        self.exported_to = path
+        with open(path, "w") as f:
+            f.write("ply\n")
+
+
+def stub_pycolmap():
+    """A pycolmap module with the functions and option classes the engine uses."""
+    def incremental_mapping(database_path, image_path, output_path, options=None):
+        return {0: StubReconstruction()}
+
+    return types.SimpleNamespace(
+        Database=Mock(),
+        extract_features=Mock(),
+        match_exhaustive=Mock(),
+        match_sequential=Mock(),
+        incremental_mapping=Mock(side_effect=incremental_mapping),
+        Reconstruction=Mock(side_effect=StubReconstruction),
+        ImageReaderOptions=options_class("ImageReaderOptions", single_camera=False),
+        SiftExtractionOptions=options_class("SiftExtractionOptions", max_image_size=3200, num_threads=-1),
+        SiftMatchingOptions=options_class("SiftMatchingOptions", num_threads=-1),
+        ExhaustiveMatchingOptions=options_class("ExhaustiveMatchingOptions", block_size=50),
+        SequentialMatchingOptions=options_class("SequentialMatchingOptions", overlap=10, loop_detection=False),
+        IncrementalPipelineOptions=options_class("IncrementalPipelineOptions", min_num_matches=15, num_threads=-1),
+    )
+
+
+class TestPycolmapEngine(ColmapWorkspaceTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.pycolmap = stub_pycolmap()
+        patcher = patch.object(engines, "pycolmap", self.pycolmap)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_stages_run_in_process(self, mock_run):
+        mock_run.side_effect = self._fake_colmap
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir, engine="pycolmap",
+                                  matcher="sequential", num_threads=2, max_image_size=1600,
+                                  mapper_args=["--Mapper.min_num_matches", "30"])
+        self.assertEqual(mock_run.call_count, 0)
+
+        extract = self.pycolmap.extract_features.call_args
+        self.assertEqual(extract.args, (self.database_path, self.image_dir))
+        self.assertEqual(extract.kwargs["camera_model"], "SIMPLE_RADIAL")
+        self.assertIsInstance(extract.kwargs["reader_options"], self.pycolmap.ImageReaderOptions)
+        self.assertEqual(extract.kwargs["sift_options"].max_image_size, 1600)
+        self.assertEqual(extract.kwargs["sift_options"].num_threads, 2)
+
+        match = self.pycolmap.match_sequential.call_args
+        self.assertEqual(match.args, (self.database_path,))
+        self.assertEqual(match.kwargs["sift_options"].num_threads, 2)
+        self.assertEqual(match.kwargs["matching_options"].overlap, config.SEQUENTIAL_MATCHING_OVERLAP)
+        self.assertFalse(self.pycolmap.match_exhaustive.called)
+
+        mapping = self.pycolmap.incremental_mapping.call_args
+        self.assertEqual(mapping.args, (self.database_path, self.image_dir, self.sparse_dir))
+        self.assertEqual(mapping.kwargs["options"].min_num_matches, 30)
+        self.assertEqual(mapping.kwargs["options"].num_threads, 2)
+
+        # The mapped reconstruction is exported from memory, not read back from disk
+        self.assertFalse(self.pycolmap.Reconstruction.called)
+        self.assertTrue(os.path.exists(os.path.join(self.sparse_dir, "model.ply")))
+
+    def test_feature_extraction_options(self):
+        image_list = os.path.join(self.temp_dir.name, "images.txt")
+        with open(image_list, "w") as f:
+            f.write("a.jpg\n\nb.jpg\n")
+        engine = engines.create_engine("pycolmap")
+        with self.assertLogs(level="WARNING") as logs:
+            engine.run("feature_extraction", "Feature extraction", [
+                "colmap", "feature_extractor", "--database_path", self.database_path, "--image_path", self.image_dir,
+                "--image_list_path", image_list, "--ImageReader.single_camera", "1",
+                "--SiftExtraction.estimate_affine_shape", "true",
+            ])
+
+        kwargs = self.pycolmap.extract_features.call_args.kwargs
+        self.assertEqual(kwargs["image_list"], ["a.jpg", "b.jpg"])
+        self.assertNotIn("camera_model", kwargs)
+        self.assertTrue(kwargs["reader_options"].single_camera)
+        self.assertFalse(hasattr(kwargs["sift_options"], "estimate_affine_shape"))
+        self.assertIn("estimate_affine_shape", logs.output[0])
+
+    def test_model_conversion_reads_model_from_disk(self):
+        model_dir = os.path.join(self.sparse_dir, "0")
+        os.makedirs(model_dir)
+        output_path = os.path.join(self.sparse_dir, "model.ply")
+        engines.create_engine("pycolmap").run("model_conversion", "Model conversion", [
+            "colmap", "model_converter", "--input_path", model_dir, "--output_path", output_path,
+            "--output_type", "PLY",
+        ])
+        self.pycolmap.Reconstruction.assert_called_once_with(model_dir)
+        self.assertTrue(os.path.exists(output_path))
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_commands_without_binding_use_cli(self, mock_run):
+        mock_run.side_effect = self._fake_colmap
+        engine = engines.create_engine("pycolmap")
+        commands = [
+            # Extending an existing model, a matcher pycolmap lacks and a non-PLY export
+            ["colmap", "mapper", "--database_path", self.database_path, "--image_path", self.image_dir,
+             "--input_path", self.sparse_dir, "--output_path", self.sparse_dir],
+            ["colmap", "spatial_matcher", "--database_path", self.database_path, "--SpatialMatching.is_gps", "1"],
+            ["colmap", "model_converter", "--input_path", self.sparse_dir, "--output_path", self.sparse_dir,
+             "--output_type", "TXT"],
+        ]
+        for command in commands:
+            engine.run("stage", command[1], command)
+
+        self.assertEqual([c.args[0][1:] for c in mock_run.call_args_list], [command[1:] for command in commands])
+        self.assertFalse(self.pycolmap.incremental_mapping.called)
+        self.assertFalse(self.pycolmap.Reconstruction.called)
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_database_creation_in_process(self, mock_run):
+        colmap_wrapper.create_empty_colmap_database(self.database_path, "pycolmap")
+        self.pycolmap.Database.open.assert_called_once_with(self.database_path)
+        self.pycolmap.Database.open.return_value.close.assert_called_once_with()
+        self.assertFalse(mock_run.called)
+
+        # Without a Database binding the database is created by the CLI
+        del self.pycolmap.Database
+        mock_run.side_effect = self._fake_colmap
+        colmap_wrapper.create_empty_colmap_database(self.database_path, "pycolmap")
+        self.assertEqual(self._commands(mock_run), ["database_creator"])
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_merging_uses_cli(self, mock_run):
+        mock_run.side_effect = lambda command, **kwargs: FakePopen(command, returncode=1)
+        write_overlapping_models(self.sparse_dir)
+        with patch.object(config, "COLMAP_EXECUTABLE", "/opt/colmap/bin/colmap"):
+            models = colmap_wrapper.select_sparse_model(self.sparse_dir, merge=True,
+                                                        runner=engines.create_engine("pycolmap"))
+
+        self.assertEqual([c.args[0][:2] for c in mock_run.call_args_list],
+                         [["/opt/colmap/bin/colmap", "model_merger"]])
+        # The failed merge keeps the best model
+        self.assertEqual(models[0]["registered_images"], 6)
+
+    def test_cancelled_before_stage(self):
+        cancel_event = threading.Event()
+        cancel_event.set()
+        with self.assertRaises(colmap_wrapper.COLMAPCancelled):
+            engines.create_engine("pycolmap").run(
+                "feature_extraction", "Feature extraction",
+                ["colmap", "feature_extractor", "--database_path", self.database_path, "--image_path", self.image_dir],
+                cancel_event=cancel_event)
+        self.assertFalse(self.pycolmap.extract_features.called)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+"""
+Tests for the image_store module.
+"""
+
+import io
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from PIL import Image
+
+from src import image_store
+
+
+def _jpeg_bytes(color, size=(32, 24), make=None, model=None):
+    """Encode a solid-color JPEG, optionally tagged with EXIF camera info."""
+    image = Image.new("RGB", size, color)
+    exif = Image.Exif()
+    if make:
+        exif[image_store.EXIF_MAKE] = make
+    if model:
+        exif[image_store.EXIF_MODEL] = model
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+class TestImageStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = image_store.ImageStore(os.path.join(self.temp_dir.name, "store"))
+        self.session_dir = Path(self.temp_dir.name) / "session" / "images"
+        self.session_dir.mkdir(parents=True)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_identical_bytes_stored_once(self):
+        data = _jpeg_bytes((255, 0, 0))
+        first = self.store.add_bytes(data, "a.jpg")
+        blob = self.store.blob_path(first, ".jpg")
+        mtime = blob.stat().st_mtime_ns
+
+        second = self.store.add_bytes(data, "b.JPG")
+        self.assertEqual(first, second)
+        self.assertEqual(blob.stat().st_mtime_ns, mtime)
+        self.assertEqual(len(list(self.store.blob_dir.rglob("*.jpg"))), 1)
+
+    def test_concurrent_writers_on_separate_instances(self):
+        # Large enough that the writes of different threads overlap
+        data = _jpeg_bytes((0, 0, 255)) + bytes(16 * 2 ** 20)
+        root = os.path.join(self.temp_dir.name, "shared")
+        # One store per session, as the upload page creates them
+        stores = [image_store.ImageStore(root) for _ in range(8)]
+        barrier = threading.Barrier(len(stores))
+        digests, errors = [], []
+
+        def upload(store):
+            barrier.wait()
+            try:
+                digests.append(store.add_bytes(data, "same.jpg"))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=upload, args=(store,)) for store in stores]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(set(digests), {image_store.hash_bytes(data)})
+        blob = stores[0].blob_path(digests[0], ".jpg")
+        self.assertEqual(image_store.hash_file(blob), digests[0])
+        self.assertEqual([path.name for path in blob.parent.iterdir()], [blob.name])
+
+    def test_index_records_size_dimensions_and_camera(self):
+        data = _jpeg_bytes((0, 255, 0), size=(40, 30), make="Acme", model="Phone 9")
+        digest = self.store.add_bytes(data, "photo.jpeg")
+
+        info = self.store.get_info(digest)
+        self.assertEqual(info["size"], len(data))
+        self.assertEqual((info["width"], info["height"]), (40, 30))
+        self.assertEqual(info["camera_make"], "Acme")
+        self.assertEqual(info["camera_model"], "Phone 9")
+        self.assertIsNone(self.store.get_info("0" * 64))
+
+    def test_link_into_session_shares_inode(self):
+        digest = self.store.add_bytes(_jpeg_bytes((0, 0, 255)), "c.jpg")
+        linked = self.store.link_into(digest, self.session_dir, "c.jpg")
+
+        self.assertTrue(linked.exists())
+        self.assertTrue(os.path.samefile(linked, self.store.blob_path(digest, ".jpg")))
+        # Linking again is a no-op
+        self.assertEqual(self.store.link_into(digest, self.session_dir, "c.jpg"), linked)
+
+    def test_link_into_replaces_different_content(self):
+        old = self.store.add_bytes(_jpeg_bytes((10, 10, 10)), "d.jpg")
+        new = self.store.add_bytes(_jpeg_bytes((200, 200, 200)), "d.jpg")
+        self.store.link_into(old, self.session_dir, "d.jpg")
+        linked = self.store.link_into(new, self.session_dir, "d.jpg")
+        self.assertEqual(image_store.hash_file(linked), new)
+
+    def test_link_unknown_digest(self):
+        with self.assertRaises(KeyError):
+            self.store.link_into("f" * 64, self.session_dir, "missing.jpg")
+
+    def test_hash_file_matches_hash_bytes(self):
+        data = _jpeg_bytes((1, 2, 3))
+        path = Path(self.temp_dir.name) / "e.jpg"
+        path.write_bytes(data)
+        self.assertEqual(image_store.hash_file(path), image_store.hash_bytes(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+Tests for the instrumentation module.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from src import instrumentation
+from src.instrumentation import Tracer, trace_stage
+from src.photogrammetry import colmap_wrapper
+
+
+class TestTracer(unittest.TestCase):
+
+    def test_records_stage_metrics(self):
+        received = []
+        tracer = Tracer(on_record=received.append, sample_interval=0.01)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output = os.path.join(temp_dir, "model.ply")
+            with tracer.stage("model_conversion", [output, os.path.join(temp_dir, "missing")], num_images=5):
+                with open(output, "wb") as f:
+                    f.write(b"x" * 1000)
+                # CPU time of tracked child processes is included
+                child = subprocess.Popen([sys.executable, "-c", "sum(range(10 ** 6))"])
+                self.assertTrue(instrumentation.track_process(child.pid))
+                child.wait()
+
+        self.assertEqual(received, tracer.records)
+        record = tracer.records[0]
+        self.assertEqual(record["stage"], "model_conversion")
+        self.assertEqual(record["status"], "completed")
+        self.assertEqual(record["labels"], {"num_images": 5})
+        self.assertEqual(record["output_bytes"], 1000)
+        self.assertGreater(record["wall_time"], 0)
+        self.assertGreater(record["cpu_time"], 0)
+        self.assertGreater(record["peak_rss"], 0)
+
+    def test_other_work_is_not_attributed(self):
+        stop = threading.Event()
+
+        def busy():
+            while not stop.is_set():
+                sum(range(10 ** 4))
+
+        other_task = threading.Thread(target=busy)
+        other_task.start()
+        tracer = Tracer(sample_interval=0.01)
+        try:
+            with tracer.stage("mapping"):
+                # Neither another thread nor an untracked child process counts towards the stage
+                subprocess.run([sys.executable, "-c", "sum(range(3 * 10 ** 7))"], check=True)
+        finally:
+            stop.set()
+            other_task.join()
+        record = tracer.records[0]
+        self.assertLess(record["cpu_time"], record["wall_time"] / 2)
+
+    def test_colmap_command_is_measured(self):
+        tracer = Tracer(sample_interval=0.01)
+        with tracer.stage("feature_extraction"):
+            colmap_wrapper._run_command(
+                "busy", [sys.executable, "-c", "x = bytearray(50 * 2 ** 20); sum(range(10 ** 7))"])
+        record = tracer.records[0]
+        self.assertGreater(record["cpu_time"], 0.1)
+        self.assertGreater(record["peak_rss"], 50 * 2 ** 20)
+        self.assertFalse(instrumentation.track_process(os.getpid()))
+
+    def test_failed_stage_is_recorded(self):
+        tracer = Tracer()
+        with self.assertRaises(RuntimeError):
+            with tracer.stage("mapping"):
+                raise RuntimeError("mapper crashed")
+        self.assertEqual(tracer.records[0]["status"], "failed")
+
+    def test_trace_stage_without_tracer(self):
+        with trace_stage(None, "mapping", num_images=3) as record:
+            record["labels"]["extra"] = 1
+        self.assertEqual(record["stage"], "mapping")
+
+    def test_directory_output_size(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.makedirs(os.path.join(temp_dir, "0"))
+            for name in ("cameras.bin", os.path.join("0", "points3D.bin")):
+                with open(os.path.join(temp_dir, name), "wb") as f:
+                    f.write(b"x" * 10)
+            self.assertEqual(instrumentation.path_size(temp_dir), 20)
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.records = [{"stage": "mapping", "status": "completed", "started_at": 0.0, "wall_time": 1.5,
+                         "cpu_time": 3.0, "peak_rss": 1024, "output_bytes": 10,
+                         "labels": {"num_images": 12, "command": 'say "hi"'}}]
+
+    def test_json(self):
+        self.assertEqual(json.loads(instrumentation.to_json(self.records)), self.records)
+
+    def test_prometheus(self):
+        text = instrumentation.to_prometheus(self.records)
+        self.assertIn("# TYPE stitchsketch_stage_wall_seconds gauge", text)
+        self.assertIn('stitchsketch_stage_wall_seconds{stage="mapping",status="completed",num_images="12",'
+                      'command="say \\"hi\\""} 1.5', text)
+        self.assertIn("stitchsketch_stage_peak_rss_bytes{", text)
+        self.assertTrue(text.endswith("\n"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+"""
+Tests for mesh and point cloud loading and automatic segmentation.
+"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import trimesh
+
+from src.mesh import analysis
+from src.mesh import io as mesh_io
+
+
+def write_colmap_ply(path, vertices, normals, colors, byte_order="<"):
+    """Write a point cloud the way COLMAP's model_converter does."""
+    dtype = np.dtype([(name, byte_order + "f4") for name in ("x", "y", "z", "nx", "ny", "nz")]
+                     + [(name, "u1") for name in ("red", "green", "blue")])
+    records = np.empty(len(vertices), dtype)
+    for i, name in enumerate("xyz"):
+        records[name] = vertices[:, i]
+    for i, name in enumerate(("nx", "ny", "nz")):
+        records[name] = normals[:, i]
+    for i, name in enumerate(("red", "green", "blue")):
+        records[name] = colors[:, i]
+    ply_format = "binary_little_endian" if byte_order == "<" else "binary_big_endian"
+    header = [
+        "ply", f"format {ply_format} 1.0", f"element vertex {len(vertices)}",
+        "property float x", "property float y", "property float z",
+        "property float nx", "property float ny", "property float nz",
+        "property uchar red", "property uchar green", "property uchar blue", "end_header",
+    ]
+    with open(path, "wb") as f:
+        f.write(("\n".join(header) + "\n").encode())
+        records.tofile(f)
+
+
+class TestMeshIO(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        self.vertices = rng.normal(size=(100, 3)).astype(np.float32)
+        self.normals = rng.normal(size=(100, 3)).astype(np.float32)
+        self.colors = rng.integers(0, 255, (100, 3), dtype=np.uint8)
+        mesh_io.clear_mesh_cache()
+
+    def tearDown(self):
+        mesh_io.clear_mesh_cache()
+        self.temp_dir.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def test_colmap_point_cloud(self):
+        path = self._path("model.ply")
+        write_colmap_ply(path, self.vertices, self.normals, self.colors)
+
+        for mmap in (False, True):
+            mesh = mesh_io.read_mesh(path, mmap=mmap)
+            self.assertTrue(mesh.is_point_cloud)
+            self.assertEqual(mesh.vertices.dtype, np.float32)
+            self.assertTrue(mesh.vertices.flags.c_contiguous)
+            np.testing.assert_array_equal(mesh.vertices, self.vertices)
+            np.testing.assert_array_equal(mesh.normals, self.normals)
+            np.testing.assert_array_equal(mesh.colors, self.colors)
+            self.assertEqual(isinstance(mesh.vertex_data, np.memmap), mmap)
+
+    def test_big_endian(self):
+        path = self._path("model.ply")
+        write_colmap_ply(path, self.vertices, self.normals, self.colors, byte_order=">")
+        mesh = mesh_io.read_mesh(path)
+        np.testing.assert_array_equal(mesh.vertices, self.vertices)
+        np.testing.assert_array_equal(mesh.colors, self.colors)
+
+    def test_triangle_mesh_round_trip(self):
+        faces = np.array([[0, 1, 2], [2, 3, 0], [4, 5, 6]])
+        path = self._path("mesh.ply")
+        mesh_io.write_ply(path, mesh_io.Mesh(self.vertices, faces))
+
+        mesh = mesh_io.read_mesh(path, mmap=True)
+        self.assertEqual(mesh.faces.dtype, np.int32)
+        self.assertTrue(mesh.faces.flags.c_contiguous)
+        np.testing.assert_array_equal(mesh.faces, faces)
+        np.testing.assert_array_equal(mesh.vertices, self.vertices)
+        self.assertIsNone(mesh.colors)
+
+    def test_polygons_and_other_formats_use_trimesh(self):
+        quad_path = self._path("quad.ply")
+        with open(quad_path, "w") as f:
+            f.write("ply\nformat ascii 1.0\nelement vertex 4\nproperty float x\nproperty float y\n"
+                    "property float z\nelement face 1\nproperty list uchar int vertex_indices\nend_header\n"
+                    "0 0 0\n1 0 0\n1 1 0\n0 1 0\n4 0 1 2 3\n")
+        obj_path = self._path("quad.obj")
+        with open(obj_path, "w") as f:
+            f.write("v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\nf 1 2 3 4\n")
+
+        for path in (quad_path, obj_path):
+            mesh = mesh_io.read_mesh(path)
+            self.assertEqual(mesh.num_vertices, 4)
+            self.assertEqual(mesh.num_faces, 2)
+            self.assertEqual(mesh.faces.dtype, np.int32)
+
+    def test_truncated_file(self):
+        path = self._path("model.ply")
+        write_colmap_ply(path, self.vertices, self.normals, self.colors)
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 10)
+        with self.assertRaises(ValueError):
+            mesh_io.read_mesh(path)
+
+    def test_load_mesh_caches_by_modification_time(self):
+        path = self._path("model.ply")
+        write_colmap_ply(path, self.vertices, self.normals, self.colors)
+
+        first = mesh_io.load_mesh(path)
+        self.assertIs(mesh_io.load_mesh(path), first)
+        with self.assertRaises(ValueError):
+            first.vertices[0, 0] = 1.0  # Shared with every caller
+
+        write_colmap_ply(path, self.vertices[:50], self.normals[:50], self.colors[:50])
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(mesh_io.load_mesh(path).num_vertices, 50)
+
+
+class TestAutomaticSegmentation(unittest.TestCase):
+
+    def setUp(self):
+        box = trimesh.creation.box(extents=(1, 2, 3)).subdivide().subdivide()
+        self.box = mesh_io.Mesh(box.vertices, box.faces)
+        cylinder = trimesh.creation.cylinder(radius=1, height=2, sections=64)
+        self.cylinder = mesh_io.Mesh(cylinder.vertices, cylinder.faces)
+
+    def test_face_geometry(self):
+        normals, areas = analysis.face_normals_and_areas(self.box)
+        self.assertAlmostEqual(float(areas.sum()), 2 * (1 * 2 + 1 * 3 + 2 * 3), places=4)
+        np.testing.assert_allclose(np.linalg.norm(normals, axis=1), 1, rtol=1e-6)
+
+        face_a, face_b, lengths = analysis.face_adjacency(self.box)
+        # A closed triangle mesh has 3 / 2 edges per face, each shared by two faces
+        self.assertEqual(len(face_a), self.box.num_faces * 3 // 2)
+        angles = analysis.dihedral_angles(normals, face_a, face_b)
+        self.assertEqual(set(np.round(angles).astype(int).tolist()), {0, 90})
+        self.assertTrue((lengths > 0).all())
+
+    def test_connected_components(self):
+        labels = analysis.connected_components(7, np.array([5, 1, 3, 6]), np.array([1, 0, 4, 4]))
+        self.assertEqual(labels.tolist(), [0, 0, 1, 2, 2, 0, 2])
+
+    def test_box_sides_are_regions(self):
+        regions = analysis.select_regions(self.box, "automatic")
+        self.assertEqual(len(regions), 6)
+        self.assertEqual(sorted(np.concatenate(regions).tolist()), list(range(self.box.num_faces)))
+        normals, _ = analysis.face_normals_and_areas(self.box)
+        for region in regions:
+            self.assertEqual(region.dtype, np.int32)
+            np.testing.assert_allclose(normals[region], normals[region[:1]].repeat(len(region), axis=0), atol=1e-6)
+
+    def test_creases_and_orientation(self):
+        # The smooth side is one region when orientation is not clustered; the caps are split off at the rim
+        labels = analysis.segment_faces(self.cylinder, num_directions=1)
+        self.assertEqual(np.bincount(labels).tolist(), [128, 64, 64])
+        self.assertGreater(len(analysis.select_regions(self.cylinder, "automatic")), 3)
+
+    def test_small_regions_are_merged(self):
+        labels = analysis.segment_faces(self.cylinder, num_directions=1, min_region_area=0.3)
+        self.assertEqual(labels.max(), 0)
+
+    def test_mesh_file_and_point_cloud(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "box.ply")
+            mesh_io.write_ply(path, self.box)
+            self.assertEqual(len(analysis.select_regions(path, "automatic")), 6)
+
+            mesh_io.write_ply(path, mesh_io.Mesh(self.box.vertices))
+            with self.assertRaises(ValueError):
+                analysis.select_regions(mesh_io.read_mesh(path), "automatic")
+        with self.assertRaises(ValueError):
+            analysis.select_regions(self.box, "spectral")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,22 +1,58 @@
 import unittest
 from unittest.mock import patch, call
+from src import config
 from src.photogrammetry import colmap_wrapper
 from src.photogrammetry import reconstruction
+from src.photogrammetry import video_extractor
+from src.photogrammetry import keyframes
+from src.photogrammetry import cache
+from src.photogrammetry import resources
+from src.photogrammetry import image_processing
+import cv2
+import numpy as np
 import tempfile
 import os
 import subprocess
+import io
+import sys
+import threading
+import time
+import sqlite3
+from PIL import Image
+
+class FakePopen:
+    """Stands in for subprocess.Popen, replaying canned COLMAP output."""
+
+    def __init__(self, command, output="", returncode=0, **kwargs):
+        self.args = command
+        self.stdout = io.StringIO(output)
+        self.returncode = returncode
+        self.pid = 12345
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+    def poll(self):
+        return self.returncode
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stdout.close()
+
+
+def _popen_kwargs():
+    return dict(stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1,
+                start_new_session=os.name == "posix")
+
 
 class TestColmapWrapper(unittest.TestCase):
 
-    @patch('src.photogrammetry.colmap_wrapper.subprocess.run')
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
     def test_run_colmap_sift(self, mock_run):
         # Configure mock to return success for all calls
-        mock_run.side_effect = [
-            subprocess.CompletedProcess(args=[], returncode=0, stdout="", stderr=""),  # feature_extractor
-            subprocess.CompletedProcess(args=[], returncode=0, stdout="", stderr=""),  # exhaustive_matcher
-            subprocess.CompletedProcess(args=[], returncode=0, stdout="", stderr=""),  # mapper
-            subprocess.CompletedProcess(args=[], returncode=0, stdout="", stderr="")   # model_converter
-        ]
+        mock_run.side_effect = lambda command, **kwargs: FakePopen(command)
 
         with tempfile.TemporaryDirectory() as image_dir, \
              tempfile.TemporaryDirectory() as sparse_dir:
@@ -24,34 +60,29 @@ class TestColmapWrapper(unittest.TestCase):
 
             colmap_wrapper.run_colmap(image_dir, database_path, sparse_dir)
 
-            # Assert that subprocess.run was called with the correct arguments
+            # Assert that subprocess.Popen was called with the correct arguments
             calls = [
                 call([
                     'colmap', 'feature_extractor', '--database_path', database_path, '--image_path', image_dir, '--ImageReader.camera_model', 'SIMPLE_RADIAL'
-                ], capture_output=True, text=True, check=True),
+                ], **_popen_kwargs()),
                 call([
                     'colmap', 'exhaustive_matcher', '--database_path', database_path
-                ], capture_output=True, text=True, check=True),
+                ], **_popen_kwargs()),
                 call([
                     'colmap', 'mapper', '--database_path', database_path, '--image_path', image_dir, '--output_path', sparse_dir
-                ], capture_output=True, text=True, check=True),
+                ], **_popen_kwargs()),
                 call([
                     'colmap', 'model_converter', '--input_path', os.path.join(sparse_dir, '0'), '--output_path', os.path.join(sparse_dir, 'model.ply'), '--output_type', 'PLY'
-                ], capture_output=True, text=True, check=True)
+                ], **_popen_kwargs())
             ]
             mock_run.assert_has_calls(calls, any_order=False)
             self.assertEqual(mock_run.call_count, 4)
 
 
-    @patch('src.photogrammetry.colmap_wrapper.subprocess.run')
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
     def test_run_colmap_orb(self, mock_run):
         # Configure mock to return success for all calls
-        mock_run.side_effect = [
-            subprocess.CompletedProcess(args=[], returncode=0, stdout="", stderr=""),  # feature_extractor
-            subprocess.CompletedProcess(args=[], returncode=0, stdout="", stderr=""),  # exhaustive_matcher
-            subprocess.CompletedProcess(args=[], returncode=0, stdout="", stderr=""),  # mapper
-            subprocess.CompletedProcess(args=[], returncode=0, stdout="", stderr="")   # model_converter
-        ]
+        mock_run.side_effect = lambda command, **kwargs: FakePopen(command)
 
         with tempfile.TemporaryDirectory() as image_dir, \
              tempfile.TemporaryDirectory() as sparse_dir:
@@ -59,48 +90,436 @@ class TestColmapWrapper(unittest.TestCase):
 
             colmap_wrapper.run_colmap(image_dir, database_path, sparse_dir, feature_type="orb")
 
-            # Assert that subprocess.run was called with the correct arguments
+            # Assert that subprocess.Popen was called with the correct arguments
             calls = [
                 call([
                     'colmap', 'feature_extractor', '--database_path', database_path, '--image_path', image_dir, '--ImageReader.camera_model', 'SIMPLE_RADIAL', '--SiftExtraction.use_gpu', '0', '--SiftExtraction.num_octaves', '3', '--SiftExtraction.first_octave', '0', '--SiftExtraction.peak_threshold', '0.01', '--SiftExtraction.edge_threshold', '10'
-                ], capture_output=True, text=True, check=True),
+                ], **_popen_kwargs()),
                 call([
                     'colmap', 'exhaustive_matcher', '--database_path', database_path
-                ], capture_output=True, text=True, check=True),
+                ], **_popen_kwargs()),
                 call([
                     'colmap', 'mapper', '--database_path', database_path, '--image_path', image_dir, '--output_path', sparse_dir
-                ], capture_output=True, text=True, check=True),
+                ], **_popen_kwargs()),
                 call([
                     'colmap', 'model_converter', '--input_path', os.path.join(sparse_dir, '0'), '--output_path', os.path.join(sparse_dir, 'model.ply'), '--output_type', 'PLY'
-                ], capture_output=True, text=True, check=True)
+                ], **_popen_kwargs())
             ]
             mock_run.assert_has_calls(calls, any_order=False)
             self.assertEqual(mock_run.call_count, 4)
 
 
-    @patch('src.photogrammetry.colmap_wrapper.subprocess.run')
-    def test_create_empty_colmap_database(self, mock_run):
-        # Configure mock to return success
-        mock_run.return_value = subprocess.CompletedProcess(
-            args=[],
-            returncode=0,
-            stdout="",
-            stderr=""
-        )
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_create_empty_colmap_database(self, mock_popen):
+        mock_popen.side_effect = lambda command, **kwargs: FakePopen(command)
 
         with tempfile.TemporaryDirectory() as temp_dir:
             database_path = os.path.join(temp_dir, "database.db")
-            colmap_wrapper.create_empty_colmap_database(database_path)
+            colmap_wrapper.create_empty_colmap_database(database_path, "cli")
+
+            mock_popen.assert_called_once_with(
+                ["colmap", "database_creator", "--database_path", database_path], **_popen_kwargs())
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_create_empty_colmap_database_failure(self, mock_popen):
+        mock_popen.side_effect = lambda command, **kwargs: FakePopen(command, "cannot open database", returncode=1)
+
+        with self.assertRaises(colmap_wrapper.COLMAPError):
+            colmap_wrapper.create_empty_colmap_database("database.db", "cli")
+
+class TestColmapOutputStreaming(unittest.TestCase):
+    def test_parse_feature_extraction(self):
+        fraction, detail = colmap_wrapper.parse_progress_line("I0101 12:00:00 feature_extraction.cc:259] Processed file [3/12]")
+        self.assertAlmostEqual(fraction, 0.25)
+        self.assertEqual(detail, "extracted features for image 3/12")
+
+    def test_parse_matching(self):
+        fraction, _ = colmap_wrapper.parse_progress_line("Matching block [2/2, 1/2] in 0.5s")
+        self.assertAlmostEqual(fraction, 0.75)
+        fraction, _ = colmap_wrapper.parse_progress_line("Matching image [40/80] in 0.1s")
+        self.assertAlmostEqual(fraction, 0.5)
+
+    def test_parse_mapper_registration(self):
+        fraction, detail = colmap_wrapper.parse_progress_line("Registering image #17 (5)", num_images=20)
+        self.assertAlmostEqual(fraction, 0.25)
+        self.assertEqual(detail, "registered 5/20 images")
+        self.assertIsNone(colmap_wrapper.parse_progress_line("Registering image #17 (5)"))
+
+    def test_parse_unrelated_line(self):
+        self.assertIsNone(colmap_wrapper.parse_progress_line("Elapsed time: 0.010 [minutes]"))
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_progress_is_reported_within_stages(self, mock_popen):
+        outputs = {
+            "feature_extractor": "Processed file [1/2]\nProcessed file [2/2]\n",
+            "exhaustive_matcher": "Matching block [1/1, 1/1]\n",
+            "mapper": "Registering image #1 (1)\nRegistering image #2 (2)\n",
+        }
+        mock_popen.side_effect = lambda command, **kwargs: FakePopen(command, outputs.get(command[1], ""))
+
+        with tempfile.TemporaryDirectory() as image_dir, \
+             tempfile.TemporaryDirectory() as sparse_dir:
+            for name in ["a.jpg", "b.jpg"]:
+                open(os.path.join(image_dir, name), "wb").close()
+            progress = []
+            colmap_wrapper.run_colmap(image_dir, os.path.join(sparse_dir, "database.db"), sparse_dir,
+                                      progress_callback=lambda p, msg: progress.append((p, msg)))
+
+        self.assertIn((5, "Feature extraction: extracted features for image 1/2, ETA 0s"), progress)
+        self.assertIn((10, "Feature extraction: extracted features for image 2/2"), progress)
+        self.assertIn((65, "Map creation: registered 1/2 images, ETA 0s"), progress)
+        values = [p for p, _ in progress]
+        self.assertEqual(values, sorted(values))
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_failure_reports_output_tail(self, mock_popen):
+        output = "".join(f"line {i}\n" for i in range(500))
+        mock_popen.side_effect = lambda command, **kwargs: FakePopen(command, output, returncode=1)
+
+        with tempfile.TemporaryDirectory() as image_dir, \
+             tempfile.TemporaryDirectory() as sparse_dir:
+            with self.assertRaises(colmap_wrapper.COLMAPError) as context:
+                colmap_wrapper.run_colmap(image_dir, os.path.join(sparse_dir, "database.db"), sparse_dir)
+
+        message = str(context.exception)
+        self.assertIn("line 499", message)
+        self.assertNotIn("line 400\n", message)
+
 
-            mock_run.assert_called_once()
-            args, kwargs = mock_run.call_args
-            command = args[0]
+class TestColmapCancellation(unittest.TestCase):
+    SLEEP_COMMAND = [sys.executable, "-c", "import time; print('started', flush=True); time.sleep(30)"]
+
+    def test_cancel_event_terminates_running_command(self):
+        cancel_event = threading.Event()
+        threading.Timer(0.3, cancel_event.set).start()
+
+        started = time.monotonic()
+        with self.assertRaises(colmap_wrapper.COLMAPCancelled):
+            colmap_wrapper._run_command("sleep", self.SLEEP_COMMAND, cancel_event=cancel_event)
+        self.assertLess(time.monotonic() - started, 10)
+
+    def test_timeout_terminates_running_command(self):
+        started = time.monotonic()
+        with self.assertRaises(colmap_wrapper.COLMAPTimeout):
+            colmap_wrapper._run_command("sleep", self.SLEEP_COMMAND, timeout=0.3)
+        self.assertLess(time.monotonic() - started, 10)
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_cancelled_run_starts_no_further_stages(self, mock_popen):
+        cancel_event = threading.Event()
+
+        def cancel_after_extraction(command, **kwargs):
+            cancel_event.set()
+            return FakePopen(command)
+
+        mock_popen.side_effect = cancel_after_extraction
+        with tempfile.TemporaryDirectory() as image_dir, \
+             tempfile.TemporaryDirectory() as sparse_dir:
+            with self.assertRaises(colmap_wrapper.COLMAPCancelled):
+                colmap_wrapper.run_colmap(image_dir, os.path.join(sparse_dir, "database.db"), sparse_dir,
+                                          cancel_event=cancel_event)
+        self.assertEqual(mock_popen.call_count, 1)
+
+
+class ColmapWorkspaceTestCase(unittest.TestCase):
+    """Base class for tests that simulate COLMAP runs in a temporary workspace."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.image_dir = os.path.join(self.temp_dir.name, "images")
+        self.sparse_dir = os.path.join(self.temp_dir.name, "sparse")
+        os.makedirs(self.image_dir)
+        os.makedirs(self.sparse_dir)
+        self.database_path = os.path.join(self.temp_dir.name, "database.db")
+        with open(os.path.join(self.image_dir, "a.jpg"), "wb") as f:
+            f.write(b"image")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _fake_colmap(self, command, **kwargs):
+        """Simulates the files each COLMAP command produces."""
+        if command[1] in ("feature_extractor", "exhaustive_matcher"):
+            open(self.database_path, "a").close()
+        elif command[1] == "mapper":
+            os.makedirs(os.path.join(self.sparse_dir, "0"), exist_ok=True)
+        elif command[1] == "model_converter":
+            open(os.path.join(self.sparse_dir, "model.ply"), "w").close()
+        return FakePopen(command)
+
+    def _commands(self, mock_run):
+        return [c.args[0][1] for c in mock_run.call_args_list]
+
+
+class TestColmapCheckpoints(ColmapWorkspaceTestCase):
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_unchanged_run_skips_all_stages(self, mock_run):
+        mock_run.side_effect = self._fake_colmap
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir)
+        mock_run.reset_mock()
+
+        progress = []
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir,
+                                  progress_callback=lambda p, msg: progress.append((p, msg)))
+        self.assertEqual(mock_run.call_count, 0)
+        self.assertEqual(progress[-1][0], 100)
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_changed_mapper_options_rerun_mapper_only(self, mock_run):
+        mock_run.side_effect = self._fake_colmap
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir)
+        mock_run.reset_mock()
+
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir,
+                                  mapper_args=["--Mapper.min_num_matches", "30"])
+        self.assertEqual(self._commands(mock_run), ["mapper", "model_converter"])
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_failed_stage_resumes_from_failure(self, mock_run):
+        def fail_mapper(command, **kwargs):
+            if command[1] == "mapper":
+                return FakePopen(command, output="mapper crashed\n", returncode=1)
+            return self._fake_colmap(command, **kwargs)
+
+        mock_run.side_effect = fail_mapper
+        with self.assertRaises(colmap_wrapper.COLMAPError):
+            colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir)
+
+        mock_run.reset_mock()
+        mock_run.side_effect = self._fake_colmap
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir)
+        self.assertEqual(self._commands(mock_run), ["mapper", "model_converter"])
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_new_images_rerun_every_stage(self, mock_run):
+        mock_run.side_effect = self._fake_colmap
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir)
+        mock_run.reset_mock()
+
+        with open(os.path.join(self.image_dir, "b.jpg"), "wb") as f:
+            f.write(b"another image")
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir)
+        self.assertEqual(mock_run.call_count, 4)
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_thread_count_is_passed_without_invalidating_stages(self, mock_run):
+        mock_run.side_effect = self._fake_colmap
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir, num_threads=3)
+        commands = {c.args[0][1]: c.args[0] for c in mock_run.call_args_list}
+        self.assertEqual(commands["feature_extractor"][-2:], ["--SiftExtraction.num_threads", "3"])
+        self.assertEqual(commands["exhaustive_matcher"][-2:], ["--SiftMatching.num_threads", "3"])
+        self.assertEqual(commands["mapper"][-2:], ["--Mapper.num_threads", "3"])
+        self.assertNotIn("--Mapper.num_threads", commands["model_converter"])
+        mock_run.reset_mock()
+
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir, num_threads=1)
+        self.assertEqual(mock_run.call_count, 0)
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_resume_disabled_runs_every_stage(self, mock_run):
+        mock_run.side_effect = self._fake_colmap
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir)
+        mock_run.reset_mock()
+
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir, resume=False)
+        self.assertEqual(mock_run.call_count, 4)
+
+
+class TestDenseReconstruction(ColmapWorkspaceTestCase):
+
+    def _fake_dense_colmap(self, command, **kwargs):
+        """Simulates the dense commands on top of the sparse ones."""
+        dense_dir = os.path.dirname(colmap_wrapper.dense_mesh_path(self.sparse_dir))
+        if command[1] == "image_undistorter":
+            os.makedirs(os.path.join(dense_dir, "sparse"), exist_ok=True)
+        elif command[1] == "patch_match_stereo":
+            os.makedirs(os.path.join(dense_dir, "stereo", "depth_maps"), exist_ok=True)
+        elif command[1] == "stereo_fusion":
+            open(os.path.join(dense_dir, "fused.ply"), "w").close()
+        elif command[1] in ("poisson_mesher", "delaunay_mesher"):
+            open(colmap_wrapper.dense_mesh_path(self.sparse_dir), "w").close()
+        return self._fake_colmap(command, **kwargs)
+
+    def test_dense_stages(self):
+        stages = colmap_wrapper._build_dense_stages(self.image_dir, self.sparse_dir, "patch_match", 800)
+        self.assertEqual([s[0] for s in stages], ["undistortion", "dense_stereo", "stereo_fusion", "poisson_meshing"])
+        self.assertIn("--PatchMatchStereo.max_image_size", stages[1][2])
+        self.assertEqual(stages[1][2][stages[1][2].index("--PatchMatchStereo.max_image_size") + 1], "800")
+        self.assertEqual(stages[3][4], [colmap_wrapper.dense_mesh_path(self.sparse_dir)])
+
+        stages = colmap_wrapper._build_dense_stages(self.image_dir, self.sparse_dir, "delaunay", None)
+        self.assertEqual([s[2][1] for s in stages], ["image_undistorter", "delaunay_mesher"])
+        self.assertNotIn("--max_image_size", stages[0][2])
+
+        with self.assertRaises(ValueError):
+            colmap_wrapper.resolve_dense_method("nerf")
+        with patch("src.photogrammetry.colmap_wrapper.shutil.which", return_value=None):
+            self.assertEqual(colmap_wrapper.resolve_dense_method("auto"), "delaunay")
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_dense_run_meshes_after_sparse_model(self, mock_run):
+        mock_run.side_effect = self._fake_dense_colmap
+        progress = []
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir, dense=True,
+                                  dense_method="patch_match",
+                                  progress_callback=lambda p, msg: progress.append(p))
+        self.assertEqual(self._commands(mock_run), [
+            "feature_extractor", "exhaustive_matcher", "mapper", "model_converter",
+            "image_undistorter", "patch_match_stereo", "stereo_fusion", "poisson_mesher"])
+        self.assertAlmostEqual(progress[-1], 100)
+        self.assertEqual(progress, sorted(progress))
+
+        # Switching the meshing method reuses the sparse model and the undistorted images
+        mock_run.reset_mock()
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir, dense=True,
+                                  dense_method="delaunay")
+        self.assertEqual(self._commands(mock_run), ["delaunay_mesher"])
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_dense_stages_follow_finished_sparse_run(self, mock_run):
+        mock_run.side_effect = self._fake_dense_colmap
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir)
+        mock_run.reset_mock()
+
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir, dense=True,
+                                  dense_method="delaunay", dense_max_image_size=500)
+        self.assertEqual(self._commands(mock_run), ["image_undistorter", "delaunay_mesher"])
+
+    @patch('src.photogrammetry.colmap_wrapper.run_colmap')
+    @patch('src.photogrammetry.colmap_wrapper.create_empty_colmap_database')
+    def test_reconstruction_returns_dense_mesh(self, mock_create, mock_run_colmap):
+        mesh_path = colmap_wrapper.dense_mesh_path(self.sparse_dir)
+        os.makedirs(os.path.dirname(mesh_path))
+        open(mesh_path, "w").close()
+        result = reconstruction.run_reconstruction(self.image_dir, self.database_path, self.sparse_dir, dense=True)
+        self.assertEqual(result, mesh_path)
+
+
+class TestColmapIncremental(ColmapWorkspaceTestCase):
+    def _import_images(self, names):
+        """Simulates the images table COLMAP's feature extractor fills."""
+        with sqlite3.connect(self.database_path) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS images (image_id INTEGER PRIMARY KEY, name TEXT)")
+            conn.executemany("INSERT INTO images (name) VALUES (?)", [(name,) for name in names])
+
+    def _add_image(self, name):
+        with open(os.path.join(self.image_dir, name), "wb") as f:
+            f.write(name.encode())
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_added_images_are_processed_incrementally(self, mock_run):
+        mock_run.side_effect = self._fake_colmap
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir, incremental=True)
+        self._import_images(["a.jpg"])
+        mock_run.reset_mock()
+
+        self._add_image("b.jpg")
+        self._add_image("c.jpg")
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir, incremental=True)
+
+        self.assertEqual(self._commands(mock_run),
+                         ["feature_extractor", "matches_importer", "mapper", "model_converter"])
+        extractor, importer, mapper, _ = [c.args[0] for c in mock_run.call_args_list]
+
+        image_list_path = extractor[extractor.index("--image_list_path") + 1]
+        with open(image_list_path) as f:
+            self.assertEqual(f.read().split(), ["b.jpg", "c.jpg"])
+
+        match_list_path = importer[importer.index("--match_list_path") + 1]
+        with open(match_list_path) as f:
+            pairs = [tuple(line.split()) for line in f]
+        self.assertEqual(pairs, [("b.jpg", "a.jpg"), ("b.jpg", "c.jpg"), ("c.jpg", "a.jpg")])
+
+        model_dir = os.path.join(self.sparse_dir, "0")
+        self.assertEqual(mapper[mapper.index("--input_path") + 1], model_dir)
+        self.assertEqual(mapper[mapper.index("--output_path") + 1], model_dir)
+
+        # The extended model is checkpointed like a full run
+        mock_run.reset_mock()
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir)
+        self.assertEqual(mock_run.call_count, 0)
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_removed_images_force_full_run(self, mock_run):
+        mock_run.side_effect = self._fake_colmap
+        self._add_image("b.jpg")
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir)
+        self._import_images(["a.jpg", "b.jpg"])
+        mock_run.reset_mock()
+
+        os.remove(os.path.join(self.image_dir, "b.jpg"))
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir, incremental=True)
+        self.assertEqual(self._commands(mock_run),
+                         ["feature_extractor", "exhaustive_matcher", "mapper", "model_converter"])
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_changed_feature_options_force_full_run(self, mock_run):
+        mock_run.side_effect = self._fake_colmap
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir)
+        self._import_images(["a.jpg"])
+        mock_run.reset_mock()
+
+        self._add_image("b.jpg")
+        colmap_wrapper.run_colmap(self.image_dir, self.database_path, self.sparse_dir,
+                                  feature_type="orb", incremental=True)
+        self.assertEqual(self._commands(mock_run),
+                         ["feature_extractor", "exhaustive_matcher", "mapper", "model_converter"])
+
+
+class TestMatchingPlan(unittest.TestCase):
+    def test_video_frames_match_sequentially(self):
+        command, args, _ = colmap_wrapper.plan_matching(500, "video")
+        self.assertEqual(command, "sequential_matcher")
+        self.assertNotIn("--SequentialMatching.loop_detection", args)
+
+    def test_video_frames_use_loop_detection_with_vocab_tree(self):
+        command, args, _ = colmap_wrapper.plan_matching(500, "video", vocab_tree_path="tree.bin")
+        self.assertEqual(command, "sequential_matcher")
+        self.assertEqual(args[args.index("--SequentialMatching.vocab_tree_path") + 1], "tree.bin")
+
+    def test_small_sets_match_exhaustively(self):
+        command, _, _ = colmap_wrapper.plan_matching(50, "unordered", vocab_tree_path="tree.bin")
+        self.assertEqual(command, "exhaustive_matcher")
+
+    def test_large_sets_use_spatial_or_vocab_tree(self):
+        self.assertEqual(colmap_wrapper.plan_matching(500, "gps")[0], "spatial_matcher")
+        self.assertEqual(colmap_wrapper.plan_matching(500, "unordered", "tree.bin")[0], "vocab_tree_matcher")
+        self.assertEqual(colmap_wrapper.plan_matching(500, "unordered")[0], "exhaustive_matcher")
+
+    def test_explicit_matcher(self):
+        self.assertEqual(colmap_wrapper.plan_matching(5, "unordered", matcher="sequential")[0], "sequential_matcher")
+        with self.assertRaises(ValueError):
+            colmap_wrapper.plan_matching(5, "unordered", matcher="vocab_tree")
+        with self.assertRaises(ValueError):
+            colmap_wrapper.plan_matching(5, "unordered", matcher="unknown")
+
+    def test_infer_provenance_from_frame_names(self):
+        with tempfile.TemporaryDirectory() as image_dir:
+            for name in ["frame_000000.jpg", "frame_000030.jpg"]:
+                open(os.path.join(image_dir, name), "wb").close()
+            self.assertEqual(colmap_wrapper.infer_image_provenance(image_dir), "video")
+
+            open(os.path.join(image_dir, "IMG_0001.jpg"), "wb").close()
+            self.assertEqual(colmap_wrapper.infer_image_provenance(image_dir), "unordered")
+
+    @patch('src.photogrammetry.colmap_wrapper.subprocess.Popen')
+    def test_run_colmap_reports_matching_plan(self, mock_run):
+        mock_run.side_effect = lambda command, **kwargs: FakePopen(command)
+        with tempfile.TemporaryDirectory() as image_dir, \
+             tempfile.TemporaryDirectory() as sparse_dir:
+            for i in range(3):
+                open(os.path.join(image_dir, f"frame_{i:06d}.jpg"), "wb").close()
+            database_path = os.path.join(sparse_dir, "database.db")
+
+            messages = []
+            colmap_wrapper.run_colmap(image_dir, database_path, sparse_dir,
+                                      progress_callback=lambda p, msg: messages.append(msg))
+
+            commands = [c.args[0][1] for c in mock_run.call_args_list]
+            self.assertEqual(commands[1], "sequential_matcher")
+            self.assertIn("Running Feature matching (sequential matching of 3 video images)...", messages)
 
-            self.assertEqual(command[0], "colmap")
-            self.assertEqual(command[1], "database_creator")
-            self.assertIn("--database_path", command)
-            self.assertIn(database_path, command)
-            self.assertEqual(command[2], "--database_path")
 
 class TestReconstruction(unittest.TestCase):
     @patch('src.photogrammetry.colmap_wrapper.create_empty_colmap_database')
@@ -120,10 +539,12 @@ class TestReconstruction(unittest.TestCase):
             self.assertIsNone(result)
 
             # Assert that create_empty_colmap_database was called
-            mock_create_db.assert_called_once_with(database_path)
+            mock_create_db.assert_called_once_with(database_path, None)
 
             # Assert that run_colmap was called with the correct arguments
-            mock_run_colmap.assert_called_once_with(image_dir, database_path, sparse_dir, progress_callback=None)
+            working_dir = os.path.join(image_dir, reconstruction.WORKING_IMAGES_DIR_NAME)
+            mock_run_colmap.assert_called_once_with(working_dir, database_path, sparse_dir, progress_callback=None,
+                                                    max_image_size=config.PREPROCESS_MAX_IMAGE_SIZE)
 
     @patch('src.photogrammetry.colmap_wrapper.create_empty_colmap_database')
     @patch('src.photogrammetry.colmap_wrapper.run_colmap')
@@ -142,10 +563,12 @@ class TestReconstruction(unittest.TestCase):
             self.assertIsNone(result)
 
             # Assert that create_empty_colmap_database was called
-            mock_create_db.assert_called_once_with(database_path)
+            mock_create_db.assert_called_once_with(database_path, None)
 
             # Assert that run_colmap was called with the correct arguments
-            mock_run_colmap.assert_called_once_with(image_dir, database_path, sparse_dir, progress_callback=None)
+            working_dir = os.path.join(image_dir, reconstruction.WORKING_IMAGES_DIR_NAME)
+            mock_run_colmap.assert_called_once_with(working_dir, database_path, sparse_dir, progress_callback=None,
+                                                    max_image_size=config.PREPROCESS_MAX_IMAGE_SIZE)
 
     @patch('src.photogrammetry.reconstruction.os.path.exists')
     @patch('src.photogrammetry.colmap_wrapper.create_empty_colmap_database')
@@ -168,10 +591,12 @@ class TestReconstruction(unittest.TestCase):
             self.assertEqual(result, ply_path)
 
             # Assert that create_empty_colmap_database was called
-            mock_create_db.assert_called_once_with(database_path)
+            mock_create_db.assert_called_once_with(database_path, None)
 
             # Assert that run_colmap was called with the correct arguments
-            mock_run_colmap.assert_called_once_with(image_dir, database_path, sparse_dir, progress_callback=None)
+            working_dir = os.path.join(image_dir, reconstruction.WORKING_IMAGES_DIR_NAME)
+            mock_run_colmap.assert_called_once_with(working_dir, database_path, sparse_dir, progress_callback=None,
+                                                    max_image_size=config.PREPROCESS_MAX_IMAGE_SIZE)
 
     @patch('src.photogrammetry.reconstruction.os.path.exists')
     @patch('src.photogrammetry.colmap_wrapper.create_empty_colmap_database')
@@ -193,7 +618,379 @@ class TestReconstruction(unittest.TestCase):
             self.assertIsNone(result)
 
             # Assert that create_empty_colmap_database was called
-            mock_create_db.assert_called_once_with(database_path)
+            mock_create_db.assert_called_once_with(database_path, None)
 
             # Assert that run_colmap was called with the correct arguments
-            mock_run_colmap.assert_called_once_with(image_dir, database_path, sparse_dir, progress_callback=None)
+            working_dir = os.path.join(image_dir, reconstruction.WORKING_IMAGES_DIR_NAME)
+            mock_run_colmap.assert_called_once_with(working_dir, database_path, sparse_dir, progress_callback=None,
+                                                    max_image_size=config.PREPROCESS_MAX_IMAGE_SIZE)
+
+
+def _write_test_video(path, num_frames=30, frame_rate=10.0, size=(64, 48)):
+    """Writes a small MJPG video whose frames encode their index in the pixel values."""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), frame_rate, size)
+    for i in range(num_frames):
+        frame = np.full((size[1], size[0], 3), (i * 8) % 256, dtype=np.uint8)
+        writer.write(frame)
+    writer.release()
+
+
+class TestVideoExtractor(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.video_path = os.path.join(self.temp_dir.name, "clip.avi")
+        _write_test_video(self.video_path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_iter_frames_samples_without_seeking(self):
+        frame_ids = [frame_id for frame_id, _ in video_extractor.iter_frames(self.video_path, fps=2)]
+        self.assertEqual(frame_ids, [0, 5, 10, 15, 20, 25])
+
+    def test_iter_frames_reports_progress(self):
+        progress = []
+        list(video_extractor.iter_frames(self.video_path, fps=2,
+                                         progress_callback=lambda p, msg="": progress.append(p)))
+        self.assertEqual(len(progress), 6)
+        self.assertEqual(progress, sorted(progress))
+        self.assertLessEqual(progress[-1], 100)
+
+    def test_extract_frames_writes_files(self):
+        output_dir = os.path.join(self.temp_dir.name, "frames")
+        frames = video_extractor.extract_frames(self.video_path, output_dir, fps=1)
+        self.assertEqual([os.path.basename(f) for f in frames],
+                         ["frame_000000.jpg", "frame_000010.jpg", "frame_000020.jpg"])
+        for frame_path in frames:
+            self.assertTrue(os.path.exists(frame_path))
+
+    def test_extract_frames_png_on_thread_pool(self):
+        output_dir = os.path.join(self.temp_dir.name, "frames")
+        frames = video_extractor.extract_frames(self.video_path, output_dir, fps=1,
+                                                image_format="png", num_workers=2)
+        self.assertEqual([os.path.basename(f) for f in frames],
+                         ["frame_000000.png", "frame_000010.png", "frame_000020.png"])
+        for frame_path in frames:
+            self.assertIsNotNone(cv2.imread(frame_path))
+
+    def test_extract_frames_serial_and_parallel_match(self):
+        serial = video_extractor.extract_frames(
+            self.video_path, os.path.join(self.temp_dir.name, "serial"), fps=5, num_workers=0)
+        parallel = video_extractor.extract_frames(
+            self.video_path, os.path.join(self.temp_dir.name, "parallel"), fps=5, num_workers=4)
+        self.assertEqual([os.path.basename(f) for f in serial],
+                         [os.path.basename(f) for f in parallel])
+
+    def test_frame_writer_rejects_unknown_format(self):
+        with self.assertRaises(ValueError):
+            video_extractor.FrameWriter(image_format="gif")
+
+    def test_iter_frames_invalid_video(self):
+        with self.assertRaises(ValueError):
+            list(video_extractor.iter_frames(os.path.join(self.temp_dir.name, "missing.mp4")))
+
+
+class TestImagePreprocessing(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.image_dir = os.path.join(self.temp_dir.name, "images")
+        self.working_dir = os.path.join(self.temp_dir.name, "working")
+        os.makedirs(self.image_dir)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _write_photo(self, name, size, orientation=1):
+        """Writes a JPEG stored sideways as phones do, with camera and orientation EXIF tags."""
+        image = Image.fromarray(np.random.default_rng(0).integers(0, 255, (size[1], size[0], 3), dtype=np.uint8))
+        exif = Image.Exif()
+        exif[image_processing.EXIF_ORIENTATION] = orientation
+        exif[0x010F] = "PhoneMaker"
+        image.save(os.path.join(self.image_dir, name), exif=exif.tobytes())
+
+    def test_large_photo_is_oriented_and_downscaled(self):
+        self._write_photo("photo.jpg", (400, 200), orientation=6)
+        manifest = image_processing.preprocess_images(self.image_dir, self.working_dir, max_size=100, num_workers=1)
+
+        self.assertEqual(manifest["photo.jpg"]["original_width"], 200)
+        self.assertEqual(manifest["photo.jpg"]["original_height"], 400)
+        with Image.open(os.path.join(self.working_dir, "photo.jpg")) as working:
+            self.assertEqual(working.size, (50, 100))
+            exif = working.getexif()
+            self.assertEqual(exif.get(image_processing.EXIF_ORIENTATION, 1), 1)
+            self.assertEqual(exif[0x010F], "PhoneMaker")
+        self.assertEqual(image_processing.load_manifest(self.working_dir), manifest)
+
+    def test_small_upright_photo_is_linked(self):
+        self._write_photo("frame.jpg", (80, 60))
+        image_processing.preprocess_images(self.image_dir, self.working_dir, max_size=100, num_workers=1)
+        self.assertTrue(os.path.samefile(os.path.join(self.image_dir, "frame.jpg"),
+                                         os.path.join(self.working_dir, "frame.jpg")))
+
+    def test_working_set_is_cached(self):
+        self._write_photo("a.jpg", (400, 300))
+        self._write_photo("b.jpg", (400, 300))
+        image_processing.preprocess_images(self.image_dir, self.working_dir, max_size=100, num_workers=1)
+        working_a = os.path.join(self.working_dir, "a.jpg")
+        mtime = os.stat(working_a).st_mtime_ns
+
+        with patch.object(image_processing, "preprocess_image") as mock_preprocess:
+            image_processing.preprocess_images(self.image_dir, self.working_dir, max_size=100, num_workers=1)
+        mock_preprocess.assert_not_called()
+        self.assertEqual(os.stat(working_a).st_mtime_ns, mtime)
+
+        os.remove(os.path.join(self.image_dir, "b.jpg"))
+        manifest = image_processing.preprocess_images(self.image_dir, self.working_dir, max_size=200, num_workers=1)
+        self.assertEqual(os.listdir(self.working_dir), ["a.jpg"])
+        self.assertEqual(manifest["a.jpg"]["width"], 200)
+
+    def test_process_pool_matches_serial(self):
+        for i in range(3):
+            self._write_photo(f"{i}.jpg", (300, 200), orientation=8)
+        progress = []
+        parallel = image_processing.preprocess_images(self.image_dir, self.working_dir, max_size=150, num_workers=2,
+                                                      progress_callback=lambda p, msg: progress.append(p))
+        serial = image_processing.preprocess_images(
+            self.image_dir, os.path.join(self.temp_dir.name, "serial"), max_size=150, num_workers=1)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(progress[-1], 100)
+
+    def test_unreadable_image_is_left_out(self):
+        self._write_photo("good.jpg", (400, 300))
+        with open(os.path.join(self.image_dir, "broken.jpg"), "wb") as f:
+            f.write(b"not an image")
+        manifest = image_processing.preprocess_images(self.image_dir, self.working_dir, max_size=100, num_workers=1)
+        self.assertEqual(list(manifest), ["good.jpg"])
+        self.assertEqual(os.listdir(self.working_dir), ["good.jpg"])
+
+    def test_feature_extraction_size_is_limited(self):
+        stages = colmap_wrapper._build_stages(self.image_dir, "db.db", "sparse", "sift", None, "SIMPLE_RADIAL",
+                                              None, provenance="unordered", max_image_size=1600)
+        command = stages[0][2]
+        self.assertEqual(command[command.index("--SiftExtraction.max_image_size") + 1], "1600")
+
+
+class TestKeyframes(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = os.path.join(self.temp_dir.name, "frames")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _write_video(self, frames, frame_rate=10.0):
+        path = os.path.join(self.temp_dir.name, "clip.avi")
+        height, width = frames[0].shape[:2]
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), frame_rate, (width, height))
+        for frame in frames:
+            writer.write(frame)
+        writer.release()
+        return path
+
+    def _textured_frame(self, shift):
+        rng = np.random.default_rng(0)
+        texture = (rng.random((48, 256)) * 255).astype(np.uint8)
+        texture = cv2.resize(texture, (1024, 192), interpolation=cv2.INTER_NEAREST)
+        crop = texture[:, shift:shift + 256]
+        return cv2.cvtColor(crop, cv2.COLOR_GRAY2BGR)
+
+    def test_score_frame_prefers_sharp_frames(self):
+        sharp = self._textured_frame(0)
+        blurry = cv2.GaussianBlur(sharp, (15, 15), 5)
+        self.assertGreater(keyframes.score_frame(sharp)[0], keyframes.score_frame(blurry)[0])
+
+    def test_static_video_collapses_to_one_keyframe(self):
+        video_path = self._write_video([self._textured_frame(0)] * 40)
+        frames = keyframes.select_keyframes(video_path, self.output_dir, max_frames=10)
+        self.assertEqual(len(frames), 1)
+
+    def test_moving_video_respects_budget(self):
+        video_path = self._write_video([self._textured_frame(i * 16) for i in range(40)])
+        frames = keyframes.select_keyframes(video_path, self.output_dir, max_frames=5)
+        self.assertGreater(len(frames), 1)
+        self.assertLessEqual(len(frames), 5)
+        for frame_path in frames:
+            self.assertTrue(os.path.exists(frame_path))
+
+    def test_sharpest_candidate_in_window_is_kept(self):
+        frames = [cv2.GaussianBlur(self._textured_frame(0), (15, 15), 5)] * 20
+        frames[10] = self._textured_frame(0)
+        video_path = self._write_video(frames)
+        selected = keyframes.select_keyframes(video_path, self.output_dir, max_frames=1, candidate_fps=10)
+        self.assertEqual([os.path.basename(f) for f in selected], ["frame_000010.jpg"])
+
+    def test_invalid_budget(self):
+        video_path = self._write_video([self._textured_frame(0)] * 5)
+        with self.assertRaises(ValueError):
+            keyframes.select_keyframes(video_path, self.output_dir, max_frames=0)
+
+
+class TestReconstructionCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.image_dir = os.path.join(self.temp_dir.name, "images")
+        self.sparse_dir = os.path.join(self.temp_dir.name, "sparse")
+        os.makedirs(self.image_dir)
+        os.makedirs(self.sparse_dir)
+        self.database_path = os.path.join(self.temp_dir.name, "database.db")
+        for i in range(3):
+            with open(os.path.join(self.image_dir, f"img_{i}.jpg"), "wb") as f:
+                f.write(bytes([i]) * 16)
+        self.cache = cache.ReconstructionCache(os.path.join(self.temp_dir.name, "cache"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _fake_reconstruction(self, image_dir, database_path, sparse_dir, progress_callback=None, **options):
+        ply_path = os.path.join(sparse_dir, "model.ply")
+        with open(ply_path, "w") as f:
+            f.write("ply\n")
+        return ply_path
+
+    @patch('src.photogrammetry.reconstruction.run_reconstruction')
+    def test_second_run_is_served_from_cache(self, mock_run_reconstruction):
+        mock_run_reconstruction.side_effect = self._fake_reconstruction
+
+        first = self.cache.run(self.image_dir, self.database_path, self.sparse_dir, feature_type="sift")
+        second = self.cache.run(self.image_dir, self.database_path, self.sparse_dir)
+
+        self.assertEqual(first, second)
+        self.assertTrue(os.path.exists(first))
+        mock_run_reconstruction.assert_called_once_with(
+            self.image_dir, self.database_path, self.sparse_dir, progress_callback=None, feature_type="sift")
+
+    @patch('src.photogrammetry.reconstruction.run_reconstruction')
+    def test_changed_options_or_images_miss(self, mock_run_reconstruction):
+        mock_run_reconstruction.side_effect = self._fake_reconstruction
+
+        self.cache.run(self.image_dir, self.database_path, self.sparse_dir)
+        self.cache.run(self.image_dir, self.database_path, self.sparse_dir, feature_type="orb")
+        with open(os.path.join(self.image_dir, "img_3.png"), "wb") as f:
+            f.write(b"new image")
+        self.cache.run(self.image_dir, self.database_path, self.sparse_dir)
+
+        self.assertEqual(mock_run_reconstruction.call_count, 3)
+
+    @patch('src.photogrammetry.reconstruction.run_reconstruction')
+    def test_thread_count_is_not_part_of_the_key(self, mock_run_reconstruction):
+        mock_run_reconstruction.side_effect = self._fake_reconstruction
+
+        self.cache.run(self.image_dir, self.database_path, self.sparse_dir, num_threads=4)
+        self.cache.run(self.image_dir, self.database_path, self.sparse_dir, num_threads=1)
+        self.assertEqual(mock_run_reconstruction.call_count, 1)
+
+    def test_fingerprint_ignores_names_and_non_images(self):
+        before = self.cache.fingerprint(cache.list_images(self.image_dir), {})
+        os.rename(os.path.join(self.image_dir, "img_0.jpg"), os.path.join(self.image_dir, "renamed.jpg"))
+        with open(os.path.join(self.image_dir, "clip.mp4"), "wb") as f:
+            f.write(b"video")
+        after = self.cache.fingerprint(cache.list_images(self.image_dir), {})
+        self.assertEqual(before, after)
+
+    def test_fingerprint_includes_provenance_of_auto_matcher(self):
+        options = {"matcher": "auto"}
+        before = self.cache.fingerprint(cache.list_images(self.image_dir), options)
+        explicit = self.cache.fingerprint(cache.list_images(self.image_dir), {"matcher": "exhaustive"})
+        # Video frame names make the auto matcher plan sequential matching
+        for i in range(3):
+            os.rename(os.path.join(self.image_dir, f"img_{i}.jpg"), os.path.join(self.image_dir, f"frame_{i:06d}.jpg"))
+        self.assertNotEqual(self.cache.fingerprint(cache.list_images(self.image_dir), options), before)
+        self.assertEqual(self.cache.fingerprint(cache.list_images(self.image_dir), {"matcher": "exhaustive"}),
+                         explicit)
+
+    def test_eviction_drops_digests_of_removed_images(self):
+        ply_path = self._fake_reconstruction(self.image_dir, self.database_path, self.sparse_dir)
+        self.cache.fingerprint(cache.list_images(self.image_dir), {})
+        os.remove(os.path.join(self.image_dir, "img_0.jpg"))
+        self.cache.put("a", ply_path)
+
+        with sqlite3.connect(self.cache.index_path) as conn:
+            paths = [row[0] for row in conn.execute("SELECT path FROM file_digests ORDER BY path")]
+        self.assertEqual(paths, [os.path.abspath(os.path.join(self.image_dir, f"img_{i}.jpg")) for i in (1, 2)])
+
+    @patch('src.photogrammetry.reconstruction.run_reconstruction')
+    def test_failed_reconstruction_is_not_cached(self, mock_run_reconstruction):
+        mock_run_reconstruction.return_value = None
+        self.assertIsNone(self.cache.run(self.image_dir, self.database_path, self.sparse_dir))
+        self.assertIsNone(self.cache.run(self.image_dir, self.database_path, self.sparse_dir))
+        self.assertEqual(mock_run_reconstruction.call_count, 2)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        small_cache = cache.ReconstructionCache(os.path.join(self.temp_dir.name, "small"), max_entries=2)
+        ply_path = self._fake_reconstruction(self.image_dir, self.database_path, self.sparse_dir)
+
+        small_cache.put("a", ply_path)
+        small_cache.put("b", ply_path)
+        small_cache.get("a")  # Touch "a" so "b" becomes least recently used
+        small_cache.put("c", ply_path)
+
+        self.assertIsNotNone(small_cache.get("a"))
+        self.assertIsNone(small_cache.get("b"))
+        self.assertIsNotNone(small_cache.get("c"))
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir.name, "small", "b")))
+
+    def test_size_limit_evicts_entries(self):
+        small_cache = cache.ReconstructionCache(os.path.join(self.temp_dir.name, "small"), max_bytes=6)
+        ply_path = self._fake_reconstruction(self.image_dir, self.database_path, self.sparse_dir)
+
+        small_cache.put("a", ply_path)
+        small_cache.put("b", ply_path)
+
+        self.assertIsNone(small_cache.get("a"))
+        self.assertIsNotNone(small_cache.get("b"))
+
+    def test_new_entry_is_never_evicted(self):
+        small_cache = cache.ReconstructionCache(os.path.join(self.temp_dir.name, "small"), max_bytes=6)
+        ply_path = self._fake_reconstruction(self.image_dir, self.database_path, self.sparse_dir)
+        small_cache.put("a", ply_path)
+        small_cache.get("a")  # Most recently used, but evicted to make room for "b"
+
+        cached = small_cache.put("b", ply_path)
+        self.assertTrue(os.path.exists(cached))
+        self.assertIsNone(small_cache.get("a"))
+
+    def test_model_larger_than_cache_is_not_cached(self):
+        small_cache = cache.ReconstructionCache(os.path.join(self.temp_dir.name, "small"), max_bytes=2)
+        ply_path = self._fake_reconstruction(self.image_dir, self.database_path, self.sparse_dir)
+
+        self.assertEqual(small_cache.put("a", ply_path), ply_path)
+        self.assertTrue(os.path.exists(ply_path))
+        self.assertIsNone(small_cache.get("a"))
+
+
+class TestResourceEstimates(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _write_images(self, count, width, height):
+        for i in range(count):
+            cv2.imwrite(os.path.join(self.temp_dir.name, f"img_{i:03d}.png"), np.zeros((height, width, 3), np.uint8))
+
+    def test_estimate_grows_with_images_and_resolution(self):
+        self._write_images(5, 320, 240)
+        small = resources.estimate_reconstruction_resources(self.temp_dir.name)
+        self.assertEqual(small["cores"], 1)
+
+        self._write_images(40, 1600, 1200)
+        large = resources.estimate_reconstruction_resources(self.temp_dir.name)
+        self.assertGreaterEqual(large["cores"], 1)
+        self.assertGreater(large["memory"], small["memory"])
+
+    def test_downscaled_working_set_needs_less_memory(self):
+        self._write_images(2, 4000, 3000)
+        full = resources.estimate_reconstruction_resources(self.temp_dir.name)
+        downscaled = resources.estimate_reconstruction_resources(self.temp_dir.name, max_image_size=800)
+        self.assertLess(downscaled["memory"], full["memory"])
+
+    @patch('src.photogrammetry.resources.psutil.cpu_count', return_value=2)
+    def test_cores_are_capped_by_machine(self, mock_cpu_count):
+        self._write_images(100, 64, 48)
+        self.assertEqual(resources.estimate_reconstruction_resources(self.temp_dir.name)["cores"], 2)
+
+    def test_empty_directory(self):
+        estimate = resources.estimate_reconstruction_resources(self.temp_dir.name)
+        self.assertEqual(estimate, {"cores": 1, "memory": resources.BASE_MEMORY_BYTES})
+
@@ -0,0 +1,101 @@
+"""
+Tests for the result_store module.
+"""
+
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from src import result_store
+
+
+class TestResultStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.spill_dir = os.path.join(self.temp_dir.name, "spill")
+        self.store = result_store.ResultStore(max_bytes=10_000, spill_threshold=5_000, spill_dir=self.spill_dir)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_small_results_stay_in_memory(self):
+        self.store["a"] = "model.ply"
+        self.assertEqual(self.store["a"], "model.ply")
+        self.assertFalse(self.store.is_spilled("a"))
+        self.assertIn("a", self.store)
+        self.assertEqual(len(self.store), 1)
+
+    def test_large_arrays_are_spilled_and_memory_mapped(self):
+        array = np.arange(2_000, dtype=np.float64)
+        self.store["big"] = array
+
+        self.assertTrue(self.store.is_spilled("big"))
+        self.assertEqual(self.store.memory_bytes, 0)
+        loaded = self.store["big"]
+        self.assertIsInstance(loaded, np.memmap)
+        np.testing.assert_array_equal(loaded, array)
+
+    def test_large_objects_are_pickled(self):
+        value = {"vertices": list(range(1_000))}
+        self.store["big"] = value
+        self.assertTrue(self.store.is_spilled("big"))
+        self.assertEqual(self.store["big"], value)
+
+    def test_least_recently_used_results_are_spilled(self):
+        for key in "abc":
+            self.store[key] = np.zeros(400, dtype=np.float64)  # 3200 bytes each
+        self.store["a"]  # Touch "a" so "b" becomes least recently used
+        self.store["d"] = np.zeros(400, dtype=np.float64)
+
+        self.assertTrue(self.store.is_spilled("b"))
+        self.assertFalse(self.store.is_spilled("a"))
+        self.assertLessEqual(self.store.memory_bytes, 10_000)
+        np.testing.assert_array_equal(self.store["b"], np.zeros(400))
+
+    def test_unpicklable_results_stay_in_memory(self):
+        store = result_store.ResultStore(max_bytes=100, spill_threshold=10_000, spill_dir=self.spill_dir)
+        lock = threading.Lock()
+        store["lock"] = lock
+        # Evicting "lock" to make room fails; neither result is lost and storing "b" does not fail
+        store["b"] = b"x" * 200
+
+        self.assertIs(store["lock"], lock)
+        self.assertFalse(store.is_spilled("lock"))
+        self.assertTrue(store.is_spilled("b"))
+        self.assertEqual(store["b"], b"x" * 200)
+        self.assertEqual(os.listdir(self.spill_dir), ["b.pkl"])
+
+        # A result too large for memory that cannot be written is kept in memory as well
+        self.store["locks"] = [lock] * 1_000
+        self.assertFalse(self.store.is_spilled("locks"))
+        self.assertEqual(len(self.store["locks"]), 1_000)
+
+    def test_delete_removes_spilled_files(self):
+        self.store["big"] = np.zeros(1_000, dtype=np.float64)
+        self.assertEqual(len(os.listdir(self.spill_dir)), 1)
+
+        self.assertIsNotNone(self.store.pop("big"))
+        self.assertNotIn("big", self.store)
+        self.assertEqual(os.listdir(self.spill_dir), [])
+        self.assertIsNone(self.store.pop("big", None))
+        with self.assertRaises(KeyError):
+            self.store["big"]
+
+    def test_overwrite_replaces_previous_value(self):
+        self.store["a"] = np.zeros(1_000, dtype=np.float64)
+        self.store["a"] = "small"
+        self.assertFalse(self.store.is_spilled("a"))
+        self.assertEqual(self.store["a"], "small")
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_estimate_size(self):
+        array = np.zeros(100, dtype=np.float32)
+        self.assertEqual(result_store.estimate_size(array), 400)
+        self.assertGreater(result_store.estimate_size({"mesh": array}), 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
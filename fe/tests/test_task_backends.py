@@ -0,0 +1,294 @@
+"""
+Tests for the process-pool and SQLite task backends.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import psutil
+
+from src import task_queue
+from src.task_backends import ProcessPoolBackend, SQLiteBackend, SQLiteWorker, connect
+
+
+def add(a, b):
+    return a + b
+
+
+def report_progress(progress_callback=None):
+    progress_callback(50, "Halfway")
+    return "done"
+
+
+def fail():
+    raise ValueError("broken task")
+
+
+def wait_for_cancel(cancel_event=None):
+    cancel_event.wait(10)
+    return "stopped"
+
+
+def traced(tracer=None):
+    with tracer.stage("model_conversion", num_images=3):
+        pass
+    return "traced"
+
+
+def timed_sleep(seconds):
+    """Sleep and return when the task started and finished"""
+    started = time.time()
+    time.sleep(seconds)
+    return started, time.time()
+
+
+def wait_for_status(backend, task_id, statuses, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = backend.get_status(task_id)
+        if status and status["status"] in statuses:
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f"Task {task_id} did not reach {statuses}: {backend.get_status(task_id)}")
+
+
+class TestSQLiteBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "tasks.db")
+        self.backend = SQLiteBackend(self.db_path)
+        self.worker = SQLiteWorker(self.db_path, worker_id="test-worker", poll_interval=0.05)
+
+    def tearDown(self):
+        self.backend.stop_workers()
+        shutil.rmtree(self.temp_dir)
+
+    def test_submit_and_run(self):
+        task_id = self.backend.submit(add, [2, 3], {}, "session")
+        self.assertEqual(self.backend.get_status(task_id)["status"], "queued")
+        self.assertEqual(self.backend.session_task_ids("session"), [task_id])
+
+        self.assertEqual(self.worker.run_one(), task_id)
+        status = self.backend.get_status(task_id)
+        self.assertEqual(status["status"], "completed")
+        self.assertEqual(status["worker"], "test-worker")
+        self.assertEqual(self.backend.get_result(task_id), 5)
+        self.assertIsNone(self.worker.run_one())
+
+    def test_progress_and_failure(self):
+        progress_id = self.backend.submit(report_progress, [], {}, "session")
+        failing_id = self.backend.submit(fail, [], {}, "session")
+        self.worker.run_one()
+        self.worker.run_one()
+
+        self.assertEqual(self.backend.get_result(progress_id), "done")
+        status = self.backend.get_status(failing_id)
+        self.assertEqual(status["status"], "failed")
+        self.assertIn("broken task", status["message"])
+        self.assertIsNone(self.backend.get_result(failing_id))
+
+    def test_cancel_queued_task(self):
+        task_id = self.backend.submit(add, [1, 1], {}, "session")
+        self.assertTrue(self.backend.cancel(task_id))
+        self.assertEqual(self.backend.get_status(task_id)["status"], "cancelled")
+        self.assertIsNone(self.worker.run_one())
+        self.assertFalse(self.backend.cancel(task_id))
+
+    def test_cancel_running_task(self):
+        self.backend.start_workers(1)
+        task_id = self.backend.submit(wait_for_cancel, [], {}, "session")
+        wait_for_status(self.backend, task_id, ("running",))
+
+        self.assertTrue(self.backend.cancel(task_id))
+        status = wait_for_status(self.backend, task_id, ("cancelled", "completed", "failed"))
+        self.assertEqual(status["status"], "cancelled")
+
+    def test_stale_task_is_reclaimed(self):
+        task_id = self.backend.submit(add, [4, 4], {}, "session")
+        lost_worker = SQLiteWorker(self.db_path, worker_id="lost-worker", lease_seconds=0.1)
+        self.assertEqual(lost_worker.claim()["id"], task_id)
+        time.sleep(0.2)
+
+        reclaiming_worker = SQLiteWorker(self.db_path, worker_id="new-worker", lease_seconds=0.1)
+        self.assertEqual(reclaiming_worker.run_one(), task_id)
+        status = self.backend.get_status(task_id)
+        self.assertEqual(status["worker"], "new-worker")
+        self.assertEqual(status["attempts"], 2)
+        self.assertEqual(self.backend.get_result(task_id), 8)
+
+    def test_workers_share_host_resources(self):
+        cores = psutil.cpu_count() or 1
+        big = self.backend.submit(add, [1, 1], {}, "session", resources={"cores": cores, "memory": 0})
+        small = self.backend.submit(add, [2, 2], {}, "other", resources={"cores": 1, "memory": 0})
+        # Workers of separate processes on one host only share the database
+        self.assertEqual(SQLiteWorker(self.db_path, worker_id="process-1").claim()["id"], big)
+        self.assertIsNone(SQLiteWorker(self.db_path, worker_id="process-2").claim())
+
+        remote_worker = SQLiteWorker(self.db_path, worker_id="remote")
+        remote_worker.host = "other-host"
+        self.assertEqual(remote_worker.claim()["id"], small)
+
+    def test_task_cancelled_while_its_worker_was_lost(self):
+        task_id = self.backend.submit(add, [4, 4], {}, "session")
+        lost_worker = SQLiteWorker(self.db_path, worker_id="lost-worker", lease_seconds=0.1)
+        self.assertEqual(lost_worker.claim()["id"], task_id)
+        self.assertTrue(self.backend.cancel(task_id))
+        time.sleep(0.2)
+
+        self.assertIsNone(SQLiteWorker(self.db_path, worker_id="new-worker", lease_seconds=0.1).claim())
+        status = self.backend.get_status(task_id)
+        self.assertEqual(status["status"], "cancelled")
+        self.assertEqual(status["attempts"], 1)
+
+    def test_wait_for_change_polls_versions(self):
+        task_id = self.backend.submit(add, [1, 1], {}, "session")
+        queued = self.backend.get_status(task_id)
+        self.assertEqual(self.backend.wait_for_change(task_id, queued["version"], timeout=0.05), queued)
+
+        self.worker.run_one()
+        changed = self.backend.wait_for_change(task_id, queued["version"], timeout=1)
+        self.assertEqual(changed["status"], "completed")
+
+    def test_stage_metrics(self):
+        task_id = self.backend.submit(traced, [], {}, "session")
+        self.assertEqual(self.backend.get_status(task_id)["metrics"], [])
+        self.worker.run_one()
+
+        metrics = self.backend.get_status(task_id)["metrics"]
+        self.assertEqual([record["stage"] for record in metrics], ["model_conversion"])
+        self.assertEqual(metrics[0]["labels"], {"num_images": 3})
+
+    def test_rejects_unimportable_functions(self):
+        with self.assertRaises(ValueError):
+            self.backend.submit(lambda: None, [], {}, "session")
+
+    def test_cleanup(self):
+        task_id = self.backend.submit(add, [1, 2], {}, "session")
+        self.worker.run_one()
+        conn = connect(self.db_path)
+        conn.execute("UPDATE tasks SET updated_at = 0 WHERE id = ?", (task_id,))
+        conn.close()
+
+        self.backend.cleanup(1, "other-session")
+        self.assertIsNotNone(self.backend.get_status(task_id))
+        self.backend.cleanup(1, "session")
+        self.assertIsNone(self.backend.get_status(task_id))
+
+
+class TestProcessPoolBackend(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.backend = ProcessPoolBackend(num_workers=1)
+        cls.backend.start_workers(1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.backend.shutdown()
+
+    def setUp(self):
+        with task_queue.status_lock:
+            task_queue.task_status = {}
+            task_queue.task_results = {}
+            task_queue.task_cancel_events = {}
+
+    def test_runs_tasks_in_another_process(self):
+        task_id = self.backend.submit(os.getpid, [], {}, "session")
+        status = wait_for_status(self.backend, task_id, ("completed", "failed"))
+        self.assertEqual(status["status"], "completed")
+        self.assertNotEqual(self.backend.get_result(task_id), os.getpid())
+
+    def test_progress_and_failure(self):
+        progress_id = self.backend.submit(report_progress, [], {}, "session")
+        failing_id = self.backend.submit(fail, [], {}, "session")
+        wait_for_status(self.backend, failing_id, ("completed", "failed"))
+
+        self.assertEqual(self.backend.get_result(progress_id), "done")
+        status = self.backend.get_status(failing_id)
+        self.assertEqual(status["status"], "failed")
+        self.assertIn("broken task", status["message"])
+
+    def test_cancel_running_task(self):
+        task_id = self.backend.submit(wait_for_cancel, [], {}, "session")
+        wait_for_status(self.backend, task_id, ("running",))
+
+        self.assertTrue(self.backend.cancel(task_id))
+        status = wait_for_status(self.backend, task_id, ("cancelled", "completed", "failed"))
+        self.assertEqual(status["status"], "cancelled")
+
+    def test_sessions_take_turns(self):
+        # Occupies the only worker process while the other tasks queue up
+        blocker = self.backend.submit(timed_sleep, [0.5], {}, "busy")
+        busy = [self.backend.submit(timed_sleep, [0], {}, "busy") for _ in range(2)]
+        low = self.backend.submit(timed_sleep, [0], {}, "other", priority=task_queue.PRIORITY_LOW)
+        other = self.backend.submit(timed_sleep, [0], {}, "other")
+        for task_id in (blocker, *busy, low, other):
+            wait_for_status(self.backend, task_id, ("completed", "failed"))
+
+        started = {task_id: self.backend.get_result(task_id)[0] for task_id in (*busy, low, other)}
+        order = sorted(started, key=started.get)
+        self.assertEqual(order, [busy[0], other, busy[1], low])
+
+    def test_admission_waits_for_resources(self):
+        backend = ProcessPoolBackend(num_workers=2)
+        try:
+            # Each task needs every core, so the second starts only after the first finished
+            resources = {"cores": psutil.cpu_count() or 1, "memory": 0}
+            task_ids = [backend.submit(timed_sleep, [0.3], {}, session, resources=resources)
+                        for session in ("a", "b")]
+            for task_id in task_ids:
+                wait_for_status(backend, task_id, ("completed", "failed"))
+            (_, first_finished), (second_started, _) = sorted(backend.get_result(task_id) for task_id in task_ids)
+            self.assertGreaterEqual(second_started, first_finished)
+        finally:
+            backend.shutdown()
+
+    def test_stage_metrics(self):
+        task_id = self.backend.submit(traced, [], {}, "session")
+        wait_for_status(self.backend, task_id, ("completed", "failed"))
+        deadline = time.time() + 5
+        # Metrics and the final status arrive over different channels
+        while not self.backend.get_status(task_id)["metrics"] and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual([record["stage"] for record in self.backend.get_status(task_id)["metrics"]],
+                         ["model_conversion"])
+
+
+class TestBackendSelection(unittest.TestCase):
+
+    def tearDown(self):
+        task_queue.set_backend(None)
+
+    def test_module_functions_use_active_backend(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            backend = SQLiteBackend(os.path.join(temp_dir, "tasks.db"))
+            task_queue.set_backend(backend)
+            task_id = task_queue.submit_task(add, [1, 2], {})
+            SQLiteWorker(backend.db_path).run_one()
+            self.assertEqual(task_queue.get_task_status(task_id)["status"], "completed")
+            self.assertEqual(task_queue.get_task_result(task_id), 3)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_incomplete_backend_cannot_be_created(self):
+        class SubmitOnly(task_queue.TaskBackend):
+            def submit(self, func, args, kwargs, session_id, priority=task_queue.PRIORITY_NORMAL,
+                       resources=None, depends_on=None):
+                return "task"
+
+        with self.assertRaises(TypeError):
+            SubmitOnly()
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            task_queue.create_backend("carrier-pigeon")
+        self.assertIsInstance(task_queue.create_backend("thread"), task_queue.ThreadBackend)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,7 +7,11 @@ import time
 import threading
 import queue
 
+from collections import namedtuple
+from unittest.mock import patch
+
 import streamlit as st
+from src import config
 from src import task_queue  # Import the task_queue module
 
 
@@ -25,6 +29,8 @@ class TestTaskQueue(unittest.TestCase):
             task_queue.task_queue = queue.Queue()
             task_queue.task_status = {}
             task_queue.task_results = {}
+            task_queue.task_cancel_events = {}
+            task_queue.waiting_tasks = {}
 
         # Initialize worker threads
         self.num_workers = 2
@@ -45,6 +51,8 @@ class TestTaskQueue(unittest.TestCase):
             task_queue.task_queue = queue.Queue()
             task_queue.task_status = {}
             task_queue.task_results = {}
+            task_queue.task_cancel_events = {}
+            task_queue.waiting_tasks = {}
 
     def test_submit_task(self):
         """Test that submit_task adds a task to the queue and returns a task ID."""
@@ -78,6 +86,30 @@ class TestTaskQueue(unittest.TestCase):
             self.assertEqual(
                 task_queue.task_results[task_id], "Task completed")
 
+    def test_result_is_stored_outside_status_lock(self):
+        """Test that writing a result does not block status updates of other tasks."""
+        lock_was_free = []
+
+        class SlowStore(dict):
+            def __setitem__(self, key, value):
+                # Spilling a large result to disk takes a while
+                free = task_queue.status_lock.acquire(timeout=1)
+                if free:
+                    task_queue.status_lock.release()
+                lock_was_free.append(free)
+                super().__setitem__(key, value)
+
+        with task_queue.status_lock:
+            task_queue.task_results = SlowStore()
+        task_id = task_queue.submit_task(lambda: "result", [], {})
+        deadline = time.time() + 5
+        status = task_queue.wait_for_status_change(task_id, -1)
+        while status["status"] != "completed" and time.time() < deadline:
+            status = task_queue.wait_for_status_change(task_id, status["version"], timeout=1)
+        self.assertEqual(status["status"], "completed")
+        self.assertEqual(lock_was_free, [True])
+        self.assertEqual(task_queue.get_task_result(task_id), "result")
+
     def test_update_and_get_task_status(self):
         """Test that update_task_status correctly updates the status of a task."""
         def test_func():
@@ -92,6 +124,38 @@ class TestTaskQueue(unittest.TestCase):
         self.assertEqual(status["progress"], 50)
         self.assertEqual(status["message"], "Task in progress")
 
+    def test_status_snapshots_are_not_mutated(self):
+        """Test that updates replace status entries instead of changing snapshots readers hold."""
+        task_id = task_queue.submit_task(threading.Event().wait, [5], {})
+        snapshot = task_queue.get_task_status(task_id)
+        version = snapshot["version"]
+
+        task_queue.update_task_status(task_id, "running", 10, "Step")
+        self.assertEqual(snapshot["version"], version)
+        self.assertGreater(task_queue.get_task_status(task_id)["version"], version)
+        task_queue.cancel_task(task_id)
+
+    def test_wait_for_status_change(self):
+        """Test that waiting returns on the next update, or unchanged after the timeout."""
+        release = threading.Event()
+
+        def test_func(progress_callback=None):
+            release.wait(5)
+            progress_callback(50, "Halfway")
+
+        task_id = task_queue.submit_task(test_func, [], {})
+        status = task_queue.wait_for_status_change(task_id, -1, timeout=1)
+        while status["status"] == "queued":
+            status = task_queue.wait_for_status_change(task_id, status["version"], timeout=1)
+
+        unchanged = task_queue.wait_for_status_change(task_id, status["version"], timeout=0.05)
+        self.assertEqual(unchanged["version"], status["version"])
+
+        threading.Timer(0.05, release.set).start()
+        changed = task_queue.wait_for_status_change(task_id, status["version"], timeout=5)
+        self.assertGreater(changed["version"], status["version"])
+        self.assertIsNone(task_queue.wait_for_status_change("unknown", 0, timeout=0.01))
+
     def test_get_task_result(self):
         """Test that get_task_result retrieves the correct result."""
         def test_func():
@@ -136,6 +200,328 @@ class TestTaskQueue(unittest.TestCase):
             self.assertIn("Intentional task failure",
                           task_queue.task_status[task_id]["message"])
 
+    def test_cancel_running_task(self):
+        """Test that a running task receives its cancel event and ends as cancelled."""
+        started = threading.Event()
+
+        def cancellable_task(cancel_event=None):
+            started.set()
+            cancel_event.wait(5)
+            return "Not cancelled"
+
+        task_id = task_queue.submit_task(cancellable_task, [], {})
+        self.assertTrue(started.wait(1))
+        self.assertTrue(task_queue.cancel_task(task_id))
+        time.sleep(0.2)
+
+        status = task_queue.get_task_status(task_id)
+        self.assertEqual(status["status"], "cancelled")
+        self.assertIsNone(task_queue.get_task_result(task_id))
+
+    def test_cancel_queued_task(self):
+        """Test that a cancelled queued task is never started."""
+        release = threading.Event()
+        ran = []
+
+        def blocking_task():
+            release.wait(5)
+
+        for _ in range(self.num_workers):
+            task_queue.submit_task(blocking_task, [], {})
+        task_id = task_queue.submit_task(lambda: ran.append(True), [], {})
+
+        self.assertTrue(task_queue.cancel_task(task_id))
+        self.assertEqual(task_queue.get_task_status(task_id)["status"], "cancelled")
+        release.set()
+        time.sleep(0.2)
+
+        self.assertEqual(ran, [])
+        self.assertEqual(task_queue.get_task_status(task_id)["status"], "cancelled")
+
+    def test_cancel_finished_or_unknown_task(self):
+        """Test that finished and unknown tasks cannot be cancelled."""
+        task_id = task_queue.submit_task(lambda: "done", [], {})
+        time.sleep(0.2)
+        self.assertFalse(task_queue.cancel_task(task_id))
+        self.assertFalse(task_queue.cancel_task("unknown"))
+
+    def test_cancel_session_tasks(self):
+        """Test that all tasks of a session are cancelled."""
+        def cancellable_task(cancel_event=None):
+            cancel_event.wait(5)
+
+        task_ids = [task_queue.submit_task(cancellable_task, [], {}) for _ in range(3)]
+        self.assertEqual(sorted(task_queue.cancel_session_tasks("test_session_id")), sorted(task_ids))
+        time.sleep(0.2)
+        for task_id in task_ids:
+            self.assertEqual(task_queue.get_task_status(task_id)["status"], "cancelled")
+
+    def test_num_threads_follow_resource_estimate(self):
+        """Test that tasks accepting num_threads receive the admitted core count."""
+        def threaded_task(num_threads=None):
+            return num_threads
+
+        task_id = task_queue.submit_task(threaded_task, [], {}, resources={"cores": 3, "memory": 1})
+        time.sleep(0.2)
+        self.assertEqual(task_queue.get_task_result(task_id), 3)
+
+    def test_stage_metrics_are_stored_and_exported(self):
+        """Test that tasks accepting a tracer record stage metrics with their status."""
+        def traced_task(tracer=None):
+            with tracer.stage("mapping", num_images=12):
+                pass
+            return "done"
+
+        task_id = task_queue.submit_task(traced_task, [], {})
+        time.sleep(0.5)
+        metrics = task_queue.get_task_status(task_id)["metrics"]
+        self.assertEqual([record["stage"] for record in metrics], ["mapping"])
+        self.assertEqual(metrics[0]["labels"], {"num_images": 12})
+
+        exported = task_queue.export_task_metrics(fmt="prometheus")
+        self.assertIn(f'task_id="{task_id}"', exported)
+        self.assertIn('stage="mapping"', exported)
+        with self.assertRaises(ValueError):
+            task_queue.export_task_metrics(fmt="csv")
+
+    def test_janitor_cleans_up_all_sessions(self):
+        """Test that the janitor expires finished tasks of every session."""
+        task_id = task_queue.submit_task(lambda: "done", [], {})
+        time.sleep(0.2)
+        with task_queue.status_lock:
+            task_queue.task_status[task_id] = {**task_queue.task_status[task_id],
+                                               "user_session_id": "other_session", "updated_at": 0}
+
+        stop_event = threading.Event()
+        with patch.object(task_queue, "_janitor", None):
+            janitor = task_queue.start_janitor(interval=0.05, max_age_hours=1, stop_event=stop_event)
+            time.sleep(0.3)
+            stop_event.set()
+            janitor.join(2)
+
+        self.assertNotIn(task_id, task_queue.task_status)
+        self.assertNotIn(task_id, task_queue.task_results)
+
+    def test_start_workers_reuses_pool(self):
+        """Test that repeated start_workers calls share the running workers."""
+        workers = task_queue.start_workers(num_workers=self.num_workers)
+        self.assertEqual(sorted(w.name for w in workers), sorted(w.name for w in self.workers))
+        self.assertTrue(all(w in self.workers for w in workers))
+
+
+class TestTaskGraph(unittest.TestCase):
+
+    def setUp(self):
+        for key in list(st.session_state.keys()):
+            del st.session_state[key]
+        st.session_state.session_id = "test_session_id"
+        with task_queue.status_lock:
+            task_queue.task_queue = queue.Queue()
+            task_queue.task_status = {}
+            task_queue.task_results = {}
+            task_queue.task_cancel_events = {}
+            task_queue.waiting_tasks = {}
+        self.num_workers = 2
+        self.workers = task_queue.start_workers(num_workers=self.num_workers)
+
+    def tearDown(self):
+        for _ in range(self.num_workers):
+            task_queue.task_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def _wait_until_finished(self, task_ids, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            statuses = [task_queue.get_task_status(task_id)["status"] for task_id in task_ids]
+            if all(status in task_queue.FINISHED_STATUSES for status in statuses):
+                return statuses
+            time.sleep(0.02)
+        self.fail(f"Tasks did not finish: {statuses}")
+
+    def test_dependent_receives_upstream_results(self):
+        """Test that a task waits for its dependencies and receives their results."""
+        release = threading.Event()
+
+        def upstream():
+            release.wait(5)
+            return 21
+
+        def downstream(upstream_results=None):
+            return upstream_results["value"] * 2
+
+        upstream_id = task_queue.submit_task(upstream, [], {})
+        downstream_id = task_queue.submit_task(downstream, [], {}, depends_on={"value": upstream_id})
+        time.sleep(0.1)
+        status = task_queue.get_task_status(downstream_id)
+        self.assertEqual(status["status"], "queued")
+        self.assertIn("Waiting for 1 upstream", status["message"])
+
+        release.set()
+        self._wait_until_finished([downstream_id])
+        self.assertEqual(task_queue.get_task_result(downstream_id), 42)
+
+    def test_graph_runs_independent_branches_in_parallel(self):
+        """Test that independent nodes run concurrently and the join node sees both results."""
+        both_running = threading.Barrier(2, timeout=5)
+
+        def branch(name):
+            both_running.wait()  # Fails unless the other branch runs at the same time
+            return name
+
+        def join(upstream_results=None):
+            return sorted(upstream_results.values())
+
+        task_ids = task_queue.submit_task_graph({
+            "join": {"func": join, "depends_on": ["keyframes", "exif"]},
+            "keyframes": {"func": branch, "args": ["keyframes"]},
+            "exif": {"func": branch, "args": ["exif"]},
+        })
+        self.assertEqual(self._wait_until_finished(task_ids.values()), ["completed"] * 3)
+        self.assertEqual(task_queue.get_task_result(task_ids["join"]), ["exif", "keyframes"])
+
+    def test_failure_cancels_only_dependents(self):
+        """Test that a failed node cancels its downstream tasks but not unrelated branches."""
+        def fail():
+            raise ValueError("extraction failed")
+
+        task_ids = task_queue.submit_task_graph({
+            "extract": {"func": fail},
+            "reconstruct": {"func": lambda upstream_results=None: "model", "depends_on": ["extract"]},
+            "mesh": {"func": lambda: "mesh", "depends_on": ["reconstruct"]},
+            "exif": {"func": lambda: "exif"},
+        })
+        self._wait_until_finished(task_ids.values())
+
+        self.assertEqual(task_queue.get_task_status(task_ids["extract"])["status"], "failed")
+        for name in ("reconstruct", "mesh"):
+            status = task_queue.get_task_status(task_ids[name])
+            self.assertEqual(status["status"], "cancelled")
+            self.assertIn("upstream task", status["message"])
+        self.assertEqual(task_queue.get_task_status(task_ids["exif"])["status"], "completed")
+
+    def test_cancelling_waiting_task_cancels_its_dependents(self):
+        """Test that cancelling a task that waits for dependencies also cancels its dependents."""
+        release = threading.Event()
+        upstream_id = task_queue.submit_task(release.wait, [5], {})
+        middle_id = task_queue.submit_task(lambda: "middle", [], {}, depends_on=[upstream_id])
+        last_id = task_queue.submit_task(lambda: "last", [], {}, depends_on=[middle_id])
+
+        self.assertTrue(task_queue.cancel_task(middle_id))
+        self.assertEqual(task_queue.get_task_status(last_id)["status"], "cancelled")
+        release.set()
+        self._wait_until_finished([upstream_id])
+        self.assertEqual(task_queue.get_task_status(upstream_id)["status"], "completed")
+        self.assertIsNone(task_queue.get_task_result(middle_id))
+
+    def test_invalid_dependencies(self):
+        """Test that unknown dependencies and cycles are rejected before anything is submitted."""
+        with self.assertRaises(ValueError):
+            task_queue.submit_task(lambda: None, [], {}, depends_on=["unknown"])
+        with self.assertRaises(ValueError):
+            task_queue.submit_task_graph({"a": {"func": print, "depends_on": ["b"]},
+                                          "b": {"func": print, "depends_on": ["a"]}})
+        with self.assertRaises(ValueError):
+            task_queue.submit_task_graph({"a": {"func": print, "depends_on": ["missing"]}})
+        self.assertEqual(task_queue.task_status, {})
+
+
+VirtualMemory = namedtuple("VirtualMemory", ["total", "available"])
+
+
+class TestFairTaskQueue(unittest.TestCase):
+
+    def _task(self, name, session_id, priority=task_queue.PRIORITY_NORMAL):
+        return {"id": name, "session_id": session_id, "priority": priority}
+
+    def test_round_robin_across_sessions(self):
+        """Test that a session with many tasks does not starve the others."""
+        fair_queue = task_queue.FairTaskQueue()
+        for i in range(3):
+            fair_queue.put(self._task(f"heavy-{i}", "heavy"))
+        fair_queue.put(self._task("light-0", "light"))
+
+        order = [fair_queue.get()["id"] for _ in range(4)]
+        self.assertEqual(order, ["heavy-0", "light-0", "heavy-1", "heavy-2"])
+
+    def test_priority_before_fairness(self):
+        """Test that short high-priority tasks are served before long ones."""
+        fair_queue = task_queue.FairTaskQueue()
+        fair_queue.put(self._task("reconstruction", "a", task_queue.PRIORITY_LOW))
+        fair_queue.put(self._task("extraction", "b", task_queue.PRIORITY_HIGH))
+        fair_queue.put(self._task("other", "c"))
+
+        order = [fair_queue.get()["id"] for _ in range(3)]
+        self.assertEqual(order, ["extraction", "other", "reconstruction"])
+
+    def test_shutdown_signal_after_tasks(self):
+        """Test that shutdown signals are handed out once no tasks are left."""
+        fair_queue = task_queue.FairTaskQueue()
+        fair_queue.put(None)
+        fair_queue.put(self._task("task", "a"))
+
+        self.assertEqual(fair_queue.get()["id"], "task")
+        self.assertIsNone(fair_queue.get())
+        for _ in range(2):
+            fair_queue.task_done()
+        fair_queue.join()
+        self.assertTrue(fair_queue.empty())
+
+    @patch.object(config, "ADMISSION_BACKFILL_LIMIT", 300)
+    @patch('src.task_queue.psutil')
+    def test_admission_waits_for_resources(self, mock_psutil):
+        """Test that tasks only start while their estimated cores and memory are free."""
+        mock_psutil.cpu_count.return_value = 4
+        mock_psutil.virtual_memory.return_value = VirtualMemory(total=16, available=12)
+        fair_queue = task_queue.FairTaskQueue()
+        fair_queue.put({"id": "big", "session_id": "a", "resources": {"cores": 3, "memory": 8}})
+        fair_queue.put({"id": "also-big", "session_id": "b", "resources": {"cores": 2, "memory": 4}})
+        fair_queue.put({"id": "small", "session_id": "c", "resources": {"cores": 1, "memory": 2}})
+
+        big = fair_queue.get()
+        self.assertEqual(big["id"], "big")
+        # "also-big" does not fit next to "big", so the small task goes ahead
+        self.assertEqual(fair_queue.get()["id"], "small")
+        self.assertEqual(fair_queue.qsize(), 1)
+
+        fair_queue.release(big)
+        self.assertEqual(fair_queue.get()["id"], "also-big")
+
+    @patch.object(config, "ADMISSION_BACKFILL_LIMIT", 0)
+    @patch.object(config, "ADMISSION_POLL_INTERVAL", 0.05)
+    @patch('src.task_queue.psutil')
+    def test_waiting_task_is_not_starved(self, mock_psutil):
+        """Test that small tasks stop overtaking a task that waited too long."""
+        mock_psutil.cpu_count.return_value = 4
+        mock_psutil.virtual_memory.return_value = VirtualMemory(total=16, available=12)
+        fair_queue = task_queue.FairTaskQueue()
+        fair_queue.put({"id": "running", "session_id": "a", "resources": {"cores": 3, "memory": 1}})
+        running = fair_queue.get()
+        fair_queue.put({"id": "big", "session_id": "b", "resources": {"cores": 4, "memory": 1}})
+        fair_queue.put({"id": "small", "session_id": "c", "resources": {"cores": 1, "memory": 1}})
+        time.sleep(0.01)
+
+        results = []
+        consumer = threading.Thread(target=lambda: results.append(fair_queue.get()))
+        consumer.start()
+        time.sleep(0.1)
+        self.assertEqual(results, [])
+
+        fair_queue.release(running)
+        consumer.join(2)
+        self.assertEqual(results[0]["id"], "big")
+
+    def test_blocking_get(self):
+        """Test that get waits for a task to be put."""
+        fair_queue = task_queue.FairTaskQueue()
+        results = []
+        consumer = threading.Thread(target=lambda: results.append(fair_queue.get()))
+        consumer.start()
+        time.sleep(0.05)
+        fair_queue.put(self._task("late", "a"))
+        consumer.join(2)
+        self.assertEqual(results[0]["id"], "late")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,29 +1,57 @@
 import streamlit as st
-import time
-from src.task_queue import submit_task, get_task_status, get_task_result, generate_task_id
-from src.photogrammetry import reconstruction  # Import reconstruction.py
-from src.photogrammetry.colmap_wrapper import COLMAPError
+import threading
+from src.task_queue import submit_task, get_task_status, get_task_result, generate_task_id, cancel_task, PRIORITY_LOW, \
+    wait_for_status_change, export_task_metrics
+from src.instrumentation import Tracer, trace_stage
+from src import config
+from src.photogrammetry.cache import ReconstructionCache
+from src.photogrammetry.colmap_wrapper import COLMAPError, MATCHERS
+from src.photogrammetry.resources import estimate_reconstruction_resources
 from typing import Callable, Optional
 import os
-import tempfile
 import shutil
 import logging
 from pathlib import Path
 
-MESH_PERSISTENCE_DIR = "persistent_meshes"
+MESH_PERSISTENCE_DIR = config.MESH_PERSISTENCE_DIR
 
+# Statuses after which a task no longer changes
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
 
-def perform_long_running_task(task_id: str, user_data_dir: str, colmap_temp_dir: str, progress_callback: Optional[Callable[[float, str], None]] = None):
+# Fragments graduated from st.experimental_fragment to st.fragment in Streamlit 1.37
+_fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+_reconstruction_cache: Optional[ReconstructionCache] = None
+
+
+def get_reconstruction_cache() -> ReconstructionCache:
+    """Returns the process-wide reconstruction cache, creating it on first use."""
+    global _reconstruction_cache
+    if _reconstruction_cache is None:
+        _reconstruction_cache = ReconstructionCache(os.path.join(MESH_PERSISTENCE_DIR, "cache"))
+    return _reconstruction_cache
+
+
+def perform_long_running_task(task_id: str, user_data_dir: str, colmap_temp_dir: str, progress_callback: Optional[Callable[[float, str], None]] = None, colmap_options: Optional[dict] = None, cancel_event: Optional[threading.Event] = None, num_threads: Optional[int] = None, tracer: Optional[Tracer] = None):
     """Runs the COLMAP reconstruction pipeline within a temporary directory."""
     logging.info("perform_long_running_task started")
+    colmap_options = dict(colmap_options or {})
+    if cancel_event is not None:
+        colmap_options["cancel_event"] = cancel_event
+    if num_threads is not None:
+        # Matches the cores the task queue admitted this task with
+        colmap_options["num_threads"] = num_threads
+    if tracer is not None:
+        # Records each stage with the task, see export_task_metrics
+        colmap_options["tracer"] = tracer
     image_dir = os.path.join(user_data_dir, "images")
     database_path = os.path.join(colmap_temp_dir, "database.db")  # Create db in temp dir
     sparse_dir = os.path.join(colmap_temp_dir, "sparse")          # Create sparse in temp dir
     os.makedirs(sparse_dir, exist_ok=True)                         # Ensure sparse dir exists
 
     try:
-        logging.info(f"Calling reconstruction.run_reconstruction with image_dir={image_dir}, database_path={database_path}, sparse_dir={sparse_dir}")
-        result = reconstruction.run_reconstruction(image_dir, database_path, sparse_dir, progress_callback)
+        logging.info(f"Calling cached reconstruction with image_dir={image_dir}, database_path={database_path}, sparse_dir={sparse_dir}")
+        result = get_reconstruction_cache().run(image_dir, database_path, sparse_dir, progress_callback, **colmap_options)
         if result:
             logging.info(f"Reconstruction succeeded, result={result}")
 
@@ -34,12 +62,21 @@ def perform_long_running_task(task_id: str, user_data_dir: str, colmap_temp_dir:
             # Construct the path to the persisted .ply file
             persisted_ply_path = os.path.join(task_persistence_dir, "model.ply") # No longer nested in "sparse"
 
-            # Copy only the .ply file to the persistence directory
-            ply_src_path = os.path.join(sparse_dir, "model.ply")
+            # Link the cached .ply file into the persistence directory, so cache eviction
+            # does not remove a model that a session is still using
             try:
-                shutil.copy2(ply_src_path, persisted_ply_path)
+                with trace_stage(tracer, "persist_model", [persisted_ply_path]):
+                    if os.path.exists(persisted_ply_path):
+                        os.remove(persisted_ply_path)
+                    try:
+                        os.link(result, persisted_ply_path)
+                    except OSError:
+                        shutil.copy2(result, persisted_ply_path)
             except Exception as e:
-                logging.error(f"Error copying {ply_src_path} to {persisted_ply_path}: {e}")
+                logging.error(f"Error copying {result} to {persisted_ply_path}: {e}")
+                if progress_callback:
+                    progress_callback(0, f"Could not save the reconstructed model: {e}")
+                return None
 
             logging.info(f"Model persisted to {persisted_ply_path}")
             return persisted_ply_path  # Return the path in the persistent directory
@@ -86,18 +123,35 @@ def show():
     # Create persistent mesh directory if it doesn't exist
     os.makedirs(MESH_PERSISTENCE_DIR, exist_ok=True)
 
+    with st.expander("Reconstruction options"):
+        feature_type = st.selectbox("Feature type", ["sift", "orb"])
+        camera_model = st.selectbox("Camera model", ["SIMPLE_RADIAL", "SIMPLE_PINHOLE", "PINHOLE", "RADIAL", "OPENCV"])
+        matchers = list(MATCHERS) if config.VOCAB_TREE_PATH else [m for m in MATCHERS if m != "vocab_tree"]
+        matcher = st.selectbox("Matching strategy", matchers,
+                               help="'auto' matches video frames sequentially, small sets exhaustively "
+                                    "and large sets spatially or with a vocabulary tree.")
+        max_image_size = st.number_input("Working image size (longest side)", min_value=400, max_value=8000,
+                                         value=config.PREPROCESS_MAX_IMAGE_SIZE or 3200, step=100,
+                                         help="Photos are oriented and downscaled to this size before "
+                                              "reconstruction; the originals are kept.")
+        merge_models = st.checkbox("Merge split models", value=False,
+                                   help="When COLMAP splits the scene into several models, merge those "
+                                        "that share images instead of keeping only the largest.")
+        dense = st.checkbox("Dense mesh", value=False,
+                            help="Reconstruct a surface mesh after the sparse point cloud.  Without a GPU "
+                                 "the mesh is built from the sparse points.")
+        dense_max_image_size = st.number_input("Dense image size (longest side)", min_value=200, max_value=8000,
+                                               value=config.DENSE_MAX_IMAGE_SIZE, step=100, disabled=not dense,
+                                               help="Smaller images make dense reconstruction faster.")
+
     # Submit task
     if st.button("Start Reconstruction", disabled=disable_start):
         logging.info("Submitting task...")
 
-        # Clean up previous temp dir if it exists
-        if st.session_state.get("colmap_temp_dir") and Path(st.session_state.colmap_temp_dir).exists():
-            logging.info(f"Cleaning up previous temp dir: {st.session_state.colmap_temp_dir}")
-            shutil.rmtree(st.session_state.colmap_temp_dir)
-
-        # create a temp dir at session state
-        temp_dir = tempfile.mkdtemp()
-        st.session_state.colmap_temp_dir = temp_dir
+        # Reuse the session's COLMAP workspace, so a retry resumes from the stage that failed
+        workspace_dir = Path(st.session_state.user_data_dir) / "reconstructions"
+        workspace_dir.mkdir(parents=True, exist_ok=True)
+        st.session_state.colmap_temp_dir = str(workspace_dir)
 
         # Generate a unique task ID
         st.session_state.task_id = generate_task_id()
@@ -105,10 +159,21 @@ def show():
         task_id = submit_task(
             perform_long_running_task,
             [st.session_state.task_id, str(st.session_state.user_data_dir), st.session_state.colmap_temp_dir],
-            {}
+            # Incremental mode extends the session's previous model when only new images were added
+            {"colmap_options": {"feature_type": feature_type, "camera_model": camera_model, "matcher": matcher,
+                                "vocab_tree_path": config.VOCAB_TREE_PATH, "incremental": True,
+                                "merge_models": merge_models, "dense": dense,
+                                "dense_max_image_size": int(dense_max_image_size),
+                                "max_image_size": int(max_image_size)}},
+            # Reconstructions are long; let other sessions' short tasks go first
+            priority=PRIORITY_LOW,
+            # Wait for cores and memory instead of swapping alongside another reconstruction
+            resources=estimate_reconstruction_resources(os.path.join(st.session_state.user_data_dir, "images"),
+                                                        int(max_image_size))
         )
 
         st.session_state.reconstruction_task_id = task_id
+        st.session_state.last_reconstruction_task_id = task_id
 
         logging.info(f"Task submitted with id: {st.session_state.reconstruction_task_id}")
         st.rerun()
@@ -117,17 +182,60 @@ def show():
     st.subheader("Task Status")  # Added section for task status
     with st.container():  # Use a container for layout
         if st.session_state.reconstruction_task_id:  # Check if task_id is not None
-            display_task_status(st.session_state.reconstruction_task_id)
+            # Render immediately on page runs; the panel's own refreshes wait for status changes
+            st.session_state.task_status_version = -1
+            task_status_panel(st.session_state.reconstruction_task_id)
         else:
             st.write("No reconstruction task submitted yet.")
 
+    if st.session_state.get("last_reconstruction_task_id") and not st.session_state.reconstruction_task_id:
+        display_stage_metrics(st.session_state.last_reconstruction_task_id)
+
+
+def display_stage_metrics(task_id: str):
+    """Shows the time and resources each stage of a finished reconstruction used, with exports."""
+    status = get_task_status(task_id)
+    if not status or not status.get("metrics"):
+        return
+    with st.expander("Stage metrics"):
+        st.dataframe([
+            {
+                "Stage": record["stage"],
+                "Status": record.get("status"),
+                "Wall time (s)": round(record["wall_time"], 2),
+                "CPU time (s)": round(record["cpu_time"], 2),
+                "Peak RSS (MiB)": round(record["peak_rss"] / 1024 ** 2, 1),
+                "Output (MiB)": round(record["output_bytes"] / 1024 ** 2, 2),
+                "Images": record.get("labels", {}).get("num_images"),
+            }
+            for record in status["metrics"]
+        ])
+        col1, col2 = st.columns(2)
+        col1.download_button("Download JSON", export_task_metrics([task_id], "json"),
+                             file_name=f"{task_id}-metrics.json", mime="application/json")
+        col2.download_button("Download Prometheus", export_task_metrics([task_id], "prometheus"),
+                             file_name=f"{task_id}-metrics.prom", mime="text/plain")
+
+
+@_fragment(run_every=config.STATUS_REFRESH_INTERVAL)
+def task_status_panel(task_id: str):
+    """Refreshes the task status on its own, without re-running the page, whenever the status changes."""
+    last_version = st.session_state.get("task_status_version", -1)
+    status = wait_for_status_change(task_id, last_version, timeout=config.STATUS_WAIT_TIMEOUT)
+    if status and status["status"] in FINISHED_STATUSES and 0 <= last_version < status["version"]:
+        # Re-run the whole page once, so controls that depend on the running task update
+        st.rerun()
+    st.session_state.task_status_version = status["version"] if status else -1
+    display_task_status(task_id, status)
 
-def display_task_status(task_id: str):
+
+def display_task_status(task_id: str, status: Optional[dict] = None):
     """Displays task status information."""
-    logging.info(f"display_task_status called with task_id: {task_id}")
+    logging.debug(f"display_task_status called with task_id: {task_id}")
     if task_id:
-        status = get_task_status(task_id)
-        logging.info(f"Task status: {status}")
+        if status is None:
+            status = get_task_status(task_id)
+        logging.debug(f"Task status: {status}")
 
         # Show only tasks from this session
         if status and status["user_session_id"] == st.session_state.session_id:
@@ -143,34 +251,33 @@ def display_task_status(task_id: str):
                     st.session_state.mesh_path = result  # Store the mesh path
                     st.session_state.mesh_id = "some_mesh_id"  # Fake ID, but non-null
 
-                    # Clean up any old runs, or failed attempts, for this session.
-                    if st.session_state.get("colmap_temp_dir") and Path(st.session_state.colmap_temp_dir).exists():
-                        logging.info(f"Cleaning up temp dir: {st.session_state.colmap_temp_dir}")
-                        shutil.rmtree(st.session_state.colmap_temp_dir)
-
                 else:
                     st.error("Reconstruction failed to produce a model.")
+                    st.info("Start the reconstruction again to resume from the failed stage.")
 
                 # Enable next step button, display results, etc.
                 st.session_state.reconstruction_task_id = None  # Clear task id
                 if st.session_state.get("last_status") != status["status"]:
                     st.session_state["last_status"] = status["status"]
 
+            elif status["status"] == "cancelled":
+                st.warning("Reconstruction cancelled.")
+                st.session_state.reconstruction_task_id = None  # Clear task id
+                if st.session_state.get("last_status") != status["status"]:
+                    st.session_state["last_status"] = status["status"]
+
             elif status["status"] == "failed":
                 st.error(f"Reconstruction failed: {status['message']}")
-
-                # Clean up any old runs, or failed attempts, for this session.
-                if st.session_state.get("colmap_temp_dir") and Path(st.session_state.colmap_temp_dir).exists():
-                    logging.info(f"Cleaning up temp dir: {st.session_state.colmap_temp_dir}")
-                    shutil.rmtree(st.session_state.colmap_temp_dir)
+                # The COLMAP workspace is kept, so completed stages are skipped on retry
+                st.info("Start the reconstruction again to resume from the failed stage.")
 
                 st.session_state.reconstruction_task_id = None  # Clear task id
                 if st.session_state.get("last_status") != status["status"]:
                     st.session_state["last_status"] = status["status"]
 
             else:
-                time.sleep(1)  # Poll every second
-                st.rerun()
+                if st.button("Cancel Reconstruction"):
+                    cancel_task(task_id)
         elif status:
             # Indicate task ownership
             st.warning("This task belongs to a different session.")
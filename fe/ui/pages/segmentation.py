@@ -1,4 +1,7 @@
+import logging
 import streamlit as st
+from src.mesh.analysis import select_regions
+from src.mesh.io import load_mesh
 from ui.components import placeholder_3d_viewer
 
 
@@ -13,18 +16,39 @@ def show():
 
     # Display the mesh (replace with actual 3D viewer component)
     st.subheader("3D Mesh")
-    placeholder_3d_viewer(mesh_path=st.session_state.get("mesh_path"))
+    mesh_path = st.session_state.get("mesh_path")
+    placeholder_3d_viewer(mesh_path=mesh_path)
+    mesh = None
+    if mesh_path:
+        try:
+            # Parsed once per file version and shared across reruns and pages
+            mesh = load_mesh(mesh_path)
+            kind = "points" if mesh.is_point_cloud else f"vertices, {mesh.num_faces:,} faces"
+            st.caption(f"{mesh.num_vertices:,} {kind}")
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not load mesh {mesh_path}: {e}")
+            st.error(f"Could not load mesh: {e}")
 
     # Mesh segmentation tools
     st.subheader("Segmentation Tools")
+    if mesh is not None and not mesh.is_point_cloud and st.button("Detect regions"):
+        with st.spinner("Segmenting mesh..."):
+            # Kept with the mesh they were detected on, so a new reconstruction does not reuse them
+            st.session_state.detected_regions = (mesh_path, select_regions(mesh, "automatic"))
+        st.session_state.selected_regions = []
 
     # Region selection
     st.subheader("Region Selection")
+    regions_path, detected_regions = st.session_state.get("detected_regions") or (None, None)
+    if detected_regions and regions_path == mesh_path:
+        region_names = [f"Region {i + 1} ({len(faces):,} faces)" for i, faces in enumerate(detected_regions)]
+    else:
+        # Replace with actual region names
+        region_names = ["Region 1", "Region 2", "Region 3"]
     selected_regions = st.multiselect(
         "Select regions on the mesh",
-        # Replace with actual region names
-        ["Region 1", "Region 2", "Region 3"],
-        default=st.session_state.get("selected_regions", [])
+        region_names,
+        default=[name for name in st.session_state.get("selected_regions", []) if name in region_names]
     )
 
     # Update session state
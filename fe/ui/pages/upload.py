@@ -1,7 +1,21 @@
 import streamlit as st
-from src.photogrammetry.video_extractor import extract_frames
+from src import config
+from src.image_store import ImageStore
+from src.photogrammetry.keyframes import iter_keyframes
+from src.instrumentation import Tracer
+from typing import Optional
 import logging
 
+_image_store: Optional[ImageStore] = None
+
+
+def get_image_store() -> ImageStore:
+    """Returns the image store shared by all sessions, creating it on first use."""
+    global _image_store
+    if _image_store is None:
+        _image_store = ImageStore(config.IMAGE_STORE_DIR)
+    return _image_store
+
 
 def show():
     """Display the upload page"""
@@ -24,12 +38,22 @@ def show():
         type=["mp4", "mov"]
     )
 
+    # Keyframe budget for video uploads
+    max_keyframes = st.slider(
+        "Maximum frames to keep from video",
+        min_value=10,
+        max_value=500,
+        value=config.DEFAULT_KEYFRAME_BUDGET,
+        step=10,
+        help="Blurry and near-duplicate frames are skipped; fewer frames means faster reconstruction."
+    )
+
     # Process uploads
     if uploaded_images:
         process_image_uploads(uploaded_images)
 
     if uploaded_video:
-        process_video_upload(uploaded_video)
+        process_video_upload(uploaded_video, max_keyframes)
 
     # Display uploaded files
     if "uploaded_files" in st.session_state and st.session_state.uploaded_files:
@@ -53,13 +77,26 @@ def process_image_uploads(uploaded_images):
     user_img_dir = st.session_state.user_data_dir / "images"
     logging.debug(f"Processing image uploads to: {user_img_dir}")
 
-    # Save images to temp directory
+    # Uploader file id -> blob digest, so reruns skip files that were already stored
+    if "uploaded_digests" not in st.session_state:
+        st.session_state.uploaded_digests = {}
+    store = get_image_store()
+    uploaded_digests = st.session_state.uploaded_digests
+
     for uploaded_file in uploaded_images:
-        file_path = user_img_dir / uploaded_file.name
+        if uploaded_file.file_id in uploaded_digests:
+            continue
         try:
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            logging.debug(f"Image saved to: {file_path}")
+            digest = store.add_bytes(uploaded_file.getbuffer(), uploaded_file.name)
+            if digest in uploaded_digests.values():
+                # Identical content already uploaded under another name
+                logging.debug(f"Skipping duplicate image: {uploaded_file.name}")
+                uploaded_digests[uploaded_file.file_id] = digest
+                continue
+
+            file_path = store.link_into(digest, user_img_dir, uploaded_file.name)
+            uploaded_digests[uploaded_file.file_id] = digest
+            logging.debug(f"Image linked to: {file_path}")
 
             # Add to session state
             if str(file_path) not in st.session_state.uploaded_files:
@@ -70,7 +107,7 @@ def process_image_uploads(uploaded_images):
             st.error(f"Error processing image {uploaded_file.name}: {e}")
 
 
-def process_video_upload(uploaded_video):
+def process_video_upload(uploaded_video, max_keyframes=config.DEFAULT_KEYFRAME_BUDGET):
     """Process uploaded video file"""
     user_img_dir = st.session_state.user_data_dir / "images"
     video_path = user_img_dir / uploaded_video.name
@@ -85,21 +122,37 @@ def process_video_upload(uploaded_video):
                 f.write(uploaded_video.getbuffer())
             logging.debug(f"Video saved to: {video_path}")
 
-            # Extract frames
+            # Extract frames, showing previews while extraction is still running
+            progress_bar = st.progress(0, text="Extracting frames from video...")
+            preview = st.empty()
+
+            def update_progress(progress, message=""):
+                progress_bar.progress(int(progress), text=message)
+
             with st.spinner("Extracting frames from video..."):
                 try:
-                    extracted_frames = extract_frames(
-                        str(video_path),
-                        str(user_img_dir),
-                        fps=1  # Extract 1 frame per second
-                    )
-                    logging.debug(f"Extracted {len(extracted_frames)} frames from video")
-
-                    # Add extracted frames to session state
-                    for frame_path in extracted_frames:
-                        if frame_path not in st.session_state.uploaded_files:
-                            st.session_state.uploaded_files.append(frame_path)
-                            logging.debug(f"Frame added to session state: {frame_path}")
+                    extracted_frames = []
+                    # Frame extraction runs here rather than in the task queue; keep its metrics with the session
+                    tracer = Tracer(on_record=st.session_state.setdefault("frame_extraction_metrics", []).append)
+                    with tracer.stage("frame_extraction", extracted_frames, video=uploaded_video.name) as record:
+                        for frame_path in iter_keyframes(
+                            str(video_path),
+                            str(user_img_dir),
+                            max_frames=max_keyframes,
+                            progress_callback=update_progress
+                        ):
+                            extracted_frames.append(frame_path)
+                            preview.image(frame_path, width=300,
+                                          caption=f"{len(extracted_frames)} keyframes selected")
+
+                            # Add extracted frames to session state
+                            if frame_path not in st.session_state.uploaded_files:
+                                st.session_state.uploaded_files.append(frame_path)
+                                logging.debug(f"Frame added to session state: {frame_path}")
+                        record["labels"]["num_images"] = len(extracted_frames)
+                    logging.debug(f"Selected {len(extracted_frames)} keyframes from video")
+                    progress_bar.empty()
+                    preview.empty()
 
                     st.success(f"Extracted {len(extracted_frames)} frames from video")
                     st.session_state[video_processed_key] = True  # Mark as processed